@@ -2,9 +2,11 @@
 REST API сервис, анализирующий рынок для промо-акций.
 """
 import argparse
+import asyncio
 import logging
 import os
 import pwd
+import socket
 from sys import argv
 
 from aiohttp.web import run_app
@@ -14,12 +16,18 @@ from configargparse import ArgumentParser
 from setproctitle import setproctitle
 from yarl import URL
 
-from analyzer.api.app import create_app
-from analyzer.utils.argparse import clear_environ, positive_int
+from analyzer.api.app import MAX_REQUEST_SIZE, create_app
+from analyzer.api.docs import DOCS_MODES
+from analyzer.utils.argparse import (
+    clear_environ, fraction, non_negative_float, non_negative_int,
+    positive_int,
+)
 from analyzer.utils.pg import DEFAULT_PG_URL
+from analyzer.utils.supervisor import Supervisor
 
 
 ENV_VAR_PREFIX = 'ANALYZER_'
+EVENT_LOOPS = ('asyncio', 'uvloop')
 
 
 parser = ArgumentParser(
@@ -34,14 +42,124 @@ group.add_argument('--api-address', default='0.0.0.0',
                    help='IPv4/IPv6 address API server would listen on')
 group.add_argument('--api-port', type=positive_int, default=8081,
                    help='TCP port API server would listen on')
+group.add_argument('--workers', type=positive_int, default=1,
+                   help='Number of API server processes')
+group.add_argument('--event-loop', choices=EVENT_LOOPS, default='asyncio',
+                   help='Event loop implementation (uvloop requires '
+                        'analyzer[uvloop] extra)')
+group.add_argument('--api-backlog', type=positive_int, default=128,
+                   help='Max number of pending connections of API socket')
+group.add_argument('--api-keepalive-timeout', type=non_negative_float,
+                   default=75,
+                   help='Seconds to keep idle HTTP connection open '
+                        '(0 disables keep-alive)')
+group.add_argument('--api-socket-rcvbuf', type=positive_int,
+                   help='Receive buffer size of accepted connections, bytes '
+                        '(by default is set by OS)')
+group.add_argument('--api-docs', choices=DOCS_MODES, default='startup',
+                   help='When to build OpenAPI spec: on startup, on first '
+                        'request of documentation (lazy) or never (off)')
+group.add_argument('--admin-token',
+                   help='Token to access admin handlers (/admin/*) with '
+                        '"Authorization: Bearer <token>" header, admin '
+                        'handlers are disabled if not set')
+group.add_argument('--birthdays-json-in-db', action='store_true',
+                   help='Build citizens birthdays response JSON in '
+                        'PostgreSQL')
+group.add_argument('--town-stat-cache-size', type=non_negative_int,
+                   default=1024,
+                   help='Max number of cached town age statistics entries, '
+                        'one per import and combination of approximate, '
+                        'percentiles and statistics parameters '
+                        '(0 disables cache)')
+
+group = parser.add_argument_group('Load shedding options')
+group.add_argument('--limit-imports', type=non_negative_int, default=4,
+                   help='Max imports processed concurrently (0 is unlimited)')
+group.add_argument('--limit-patches', type=non_negative_int, default=64,
+                   help='Max citizen updates processed concurrently '
+                        '(0 is unlimited)')
+group.add_argument('--limit-reads', type=non_negative_int, default=256,
+                   help='Max read requests processed concurrently '
+                        '(0 is unlimited)')
+group.add_argument('--limit-body-size', type=non_negative_int,
+                   default=2 * MAX_REQUEST_SIZE,
+                   help='Max total size of request bodies processed '
+                        'concurrently, bytes (0 is unlimited)')
+group.add_argument('--limit-queue-timeout', type=non_negative_float,
+                   default=1.0,
+                   help='Max time request waits for limits, seconds; after '
+                        'that request is rejected with 503')
+group.add_argument('--limit-retry-after', type=positive_int, default=1,
+                   help='Retry-After header value for rejected requests, '
+                        'seconds')
+
+group = parser.add_argument_group('Deadline options')
+group.add_argument('--deadline-imports', type=non_negative_float,
+                   default=120,
+                   help='Max time to process import, seconds (0 is '
+                        'unlimited)')
+group.add_argument('--deadline-patches', type=non_negative_float,
+                   default=30,
+                   help='Max time to process citizen update, seconds (0 is '
+                        'unlimited)')
+group.add_argument('--deadline-reads', type=non_negative_float, default=30,
+                   help='Max time to process read request including '
+                        'streaming response, seconds (0 is unlimited)')
 
 group = parser.add_argument_group('PostgreSQL options')
 group.add_argument('--pg-url', type=URL, default=URL(DEFAULT_PG_URL),
                    help='URL to use to connect to the database')
+group.add_argument('--pg-replica-url', type=URL,
+                   help='URL to use to connect to the read replica of the '
+                        'database (GET requests are served from it, unless '
+                        'client requires data not yet replicated)')
+group.add_argument('--pg-pooler-mode', action='store_true',
+                   help='Connect to the database via transaction pooler '
+                        '(e.g. PgBouncer): do not cache prepared statements '
+                        'and do not use server-side cursors')
 group.add_argument('--pg-pool-min-size', type=int, default=10,
                    help='Minimum database connections')
 group.add_argument('--pg-pool-max-size', type=int, default=10,
                    help='Maximum database connections')
+group.add_argument('--pg-max-connections', type=positive_int,
+                   help='Maximum database connections of all API server '
+                        'processes (limits connection pool size of each '
+                        'process)')
+
+group = parser.add_argument_group('Analytics options')
+group.add_argument('--analytics-engine', action='store_true',
+                   help='Calculate statistics using in-memory analytics '
+                        'engine (requires numpy)')
+group.add_argument('--analytics-memory-limit', type=positive_int,
+                   default=256 * 1024 ** 2,
+                   help='Memory limit for imports loaded into analytics '
+                        'engine, bytes')
+
+group = parser.add_argument_group('Query log options')
+group.add_argument('--query-log', action='store_true',
+                   help='Log duration of every database query with handler '
+                        'that executed it')
+group.add_argument('--query-log-threshold', type=non_negative_float,
+                   default=0.1,
+                   help='Queries slower than threshold are logged with '
+                        'warning level and may be explained, seconds')
+group.add_argument('--query-log-explain-rate', type=fraction, default=0.1,
+                   help='Fraction of slow read queries to capture plan for '
+                        'with EXPLAIN (ANALYZE, BUFFERS) in background')
+group.add_argument('--query-log-explain-timeout', type=non_negative_float,
+                   default=10,
+                   help='Max time to explain query, seconds')
+
+group = parser.add_argument_group('Event loop monitor options')
+group.add_argument('--loop-monitor-interval', type=non_negative_float,
+                   default=0.1,
+                   help='How often to measure event loop lag, seconds (0 '
+                        'disables monitor)')
+group.add_argument('--loop-block-threshold', type=non_negative_float,
+                   default=0.5,
+                   help='Log stack of code blocking event loop longer than '
+                        'threshold, seconds (0 disables)')
 
 group = parser.add_argument_group('Logging options')
 group.add_argument('--log-level', default='info',
@@ -50,8 +168,53 @@ group.add_argument('--log-format', choices=LogFormat.choices(),
                    default='color')
 
 
+def limit_pg_pool_size(args):
+    """
+    Ограничивает размер пула соединений каждого процесса так, чтобы все
+    процессы вместе открывали не более --pg-max-connections соединений.
+    """
+    if args.pg_max_connections is None:
+        return
+
+    max_size = args.pg_max_connections // args.workers
+    if max_size < 1:
+        parser.error('--pg-max-connections must be greater or equal to '
+                     '--workers')
+
+    args.pg_pool_max_size = min(args.pg_pool_max_size, max_size)
+    args.pg_pool_min_size = min(args.pg_pool_min_size, args.pg_pool_max_size)
+
+
+def get_event_loop_policy(event_loop: str) -> asyncio.AbstractEventLoopPolicy:
+    if event_loop == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            parser.error('uvloop is not installed, '
+                         'use pip install analyzer[uvloop]')
+        return uvloop.EventLoopPolicy()
+    return asyncio.DefaultEventLoopPolicy()
+
+
+def setup_event_loop(policy: asyncio.AbstractEventLoopPolicy):
+    """
+    Создает цикл событий выбранной реализации для текущего процесса. Должна
+    вызываться до использования цикла событий (в т.ч. в aiomisc.basic_config).
+    """
+    asyncio.set_event_loop_policy(policy)
+    # Цикл событий создается явно: uvloop не создает его автоматически при
+    # вызове asyncio.get_event_loop().
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+def run_worker(args, sock):
+    app = create_app(args)
+    run_app(app, sock=sock, backlog=args.api_backlog)
+
+
 def main():
     args = parser.parse_args()
+    limit_pg_pool_size(args)
 
     # После получения конфигурации приложения переменные окружения приложения
     # больше не нужны и даже могут представлять опасность - например, они могут
@@ -64,16 +227,32 @@ def main():
     # по префиксу приложения, указанного в ConfigArgParser.
     clear_environ(lambda i: i.startswith(ENV_VAR_PREFIX))
 
+    # В режиме нескольких процессов цикл событий создается в каждом дочернем
+    # процессе после fork.
+    policy = get_event_loop_policy(args.event_loop)
+    if args.workers == 1:
+        setup_event_loop(policy)
+
     # Чтобы логи не блокировали основной поток (и event loop) во время операций
     # записи в stderr или файл - логи можно буфферизовать и обрабатывать в
     # отдельном потоке (aiomisc.basic_config настроит буфферизацию
     # автоматически).
-    basic_config(args.log_level, args.log_format, buffered=True)
+    #
+    # Буфферизация выполняется в отдельном потоке, который не копируется в
+    # дочерние процессы при fork, поэтому в режиме нескольких процессов
+    # буфферизованные логи настраиваются в каждом процессе отдельно.
+    basic_config(args.log_level, args.log_format,
+                 buffered=args.workers == 1)
 
     # Аллоцируем сокет из под привиллегированного пользователя отдельным шагом,
     # чтобы была возможность перед запуском приложения сменить пользователя ОС.
+    # Размер буфера приема наследуется сокетами принятых соединений.
+    options = []
+    if args.api_socket_rcvbuf is not None:
+        options.append((socket.SOL_SOCKET, socket.SO_RCVBUF,
+                        args.api_socket_rcvbuf))
     sock = bind_socket(address=args.api_address, port=args.api_port,
-                       proto_name='http')
+                       options=options, proto_name='http')
 
     # После того как приложение аллоцировало сокет и ему больше не нужны
     # привиллегии - хорошим решением будет сменить пользователя (например,
@@ -87,8 +266,21 @@ def main():
     # В списке процессов намного удобнее видеть название текущего приложения
     setproctitle(os.path.basename(argv[0]))
 
-    app = create_app(args)
-    run_app(app, sock=sock)
+    if args.workers == 1:
+        run_worker(args, sock)
+        return
+
+    # Каждый процесс создает собственное приложение (и пул соединений с БД)
+    # и принимает соединения на общем сокете.
+    logging.info('Starting %d workers, up to %d database connections',
+                 args.workers, args.workers * args.pg_pool_max_size)
+
+    def worker():
+        setup_event_loop(policy)
+        basic_config(args.log_level, args.log_format, buffered=True)
+        run_worker(args, sock)
+
+    Supervisor(worker, args.workers).run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,348 @@
+"""
+Аналитический движок, рассчитывающий статистику по выгрузкам в памяти
+процесса.
+
+Для часто запрашиваемых выгрузок данные жителей загружаются из PostgreSQL один
+раз и хранятся в компактных массивах NumPy:
+- даты рождения - кол-во дней с 01.01.1970 (int32),
+- города - коды в словаре уникальных названий городов выгрузки (int32),
+- родственные связи - списки смежности в формате CSR (для жителя с индексом i
+  индексы родственников хранятся в indices[indptr[i]:indptr[i + 1]]).
+
+Статистика рассчитывается векторными операциями (bincount, сортировка) вместо
+агрегирующих SQL-запросов. Суммарный объем загруженных массивов ограничен,
+при превышении лимита из памяти удаляются наименее востребованные выгрузки.
+
+NumPy - необязательная зависимость: pip install analyzer[analytics].
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date
+from functools import partial
+from typing import Dict, List, Sequence, Tuple
+
+from aiohttp.web_app import Application
+from asyncpgsa import PG
+from configargparse import Namespace
+from sqlalchemy import select
+
+from analyzer.db.schema import (
+    citizens_table, imports_table, relations_table, towns_table,
+)
+
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+log = logging.getLogger(__name__)
+
+EPOCH = date(1970, 1, 1)
+
+# Город, значения перцентилей и статистик
+TownAgeStat = Tuple[str, List[float], Dict[str, float]]
+
+
+class ImportAnalytics:
+    """
+    Данные одной выгрузки, необходимые для расчета статистики.
+    """
+    __slots__ = (
+        'citizen_ids', 'birth_days', 'birth_years', 'birth_months',
+        'birth_month_days', 'town_codes', 'towns', 'indptr', 'indices',
+        'generation'
+    )
+
+    def __init__(self, citizen_ids, birth_days, town_codes, towns,
+                 indptr, indices, generation: int = 0):
+        # Поколение выгрузки (imports.generation), по которому загружены
+        # данные
+        self.generation = generation
+        self.citizen_ids = citizen_ids
+        self.birth_days = birth_days
+        self.town_codes = town_codes
+        self.towns = towns
+        self.indptr = indptr
+        self.indices = indices
+
+        # Год, месяц и день рождения требуются для всех расчетов, поэтому
+        # вычисляются один раз при загрузке.
+        dates = birth_days.astype('datetime64[D]')
+        months = dates.astype('datetime64[M]')
+        self.birth_years = (
+            months.astype('datetime64[Y]').astype(np.int32) + 1970
+        ).astype(np.int16)
+        self.birth_months = (months.astype(np.int32) % 12 + 1).astype(np.int8)
+        self.birth_month_days = (
+            (dates - months).astype(np.int32) + 1
+        ).astype(np.int8)
+
+    @classmethod
+    def from_rows(cls, citizen_rows, relation_rows,
+                  generation: int = 0) -> 'ImportAnalytics':
+        """
+        Создает объект из строк таблиц citizens (отсортированы по citizen_id)
+        и relations (отсортированы по citizen_id).
+        """
+        citizen_ids = np.fromiter(
+            (row['citizen_id'] for row in citizen_rows), dtype=np.int32,
+            count=len(citizen_rows)
+        )
+        birth_days = np.fromiter(
+            ((row['birth_date'] - EPOCH).days for row in citizen_rows),
+            dtype=np.int32, count=len(citizen_rows)
+        )
+        towns, town_codes = np.unique(
+            np.array([row['town'] for row in citizen_rows], dtype=object),
+            return_inverse=True
+        )
+
+        # Идентификаторы жителей заменяются индексами в массиве citizen_ids
+        relation_citizens = np.searchsorted(citizen_ids, np.fromiter(
+            (row['citizen_id'] for row in relation_rows), dtype=np.int32,
+            count=len(relation_rows)
+        ))
+        indices = np.searchsorted(citizen_ids, np.fromiter(
+            (row['relative_id'] for row in relation_rows), dtype=np.int32,
+            count=len(relation_rows)
+        )).astype(np.int32)
+        indptr = np.zeros(len(citizen_ids) + 1, dtype=np.int32)
+        np.cumsum(
+            np.bincount(relation_citizens, minlength=len(citizen_ids)),
+            out=indptr[1:]
+        )
+        return cls(citizen_ids, birth_days, town_codes.astype(np.int32),
+                   towns.tolist(), indptr, indices, generation)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            getattr(self, name).nbytes for name in self.__slots__
+            if name not in ('towns', 'generation')
+        ) + sum(len(town.encode()) for town in self.towns)
+
+    def birthdays(self) -> Dict[int, List[dict]]:
+        """
+        Кол-во подарков, которые жители купят родственникам в каждом месяце.
+        """
+        # Для каждой родственной связи: индекс жителя, который покупает
+        # подарок, и месяц рождения родственника.
+        buyers = np.repeat(
+            np.arange(len(self.citizen_ids), dtype=np.int32),
+            np.diff(self.indptr)
+        )
+        months = self.birth_months[self.indices].astype(np.int32) - 1
+        presents = np.bincount(buyers * 12 + months,
+                               minlength=len(self.citizen_ids) * 12)
+
+        result = {month: [] for month in range(1, 13)}
+        for key in np.flatnonzero(presents).tolist():
+            citizen, month = divmod(key, 12)
+            result[month + 1].append({
+                'citizen_id': int(self.citizen_ids[citizen]),
+                'presents': int(presents[key])
+            })
+        return result
+
+    def ages(self, today: date):
+        """
+        Возраст жителей в полных годах (так же, как date_part('year', age())).
+        """
+        ages = today.year - self.birth_years.astype(np.int32)
+        before_birthday = (
+            (self.birth_months > today.month) |
+            ((self.birth_months == today.month) &
+             (self.birth_month_days > today.day))
+        )
+        return ages - before_birthday
+
+    def town_age_stat(self, today: date, fractions: Sequence[float],
+                      statistics: Sequence[str]) -> List[TownAgeStat]:
+        """
+        Перцентили (с линейной интерполяцией, как percentile_cont) и
+        статистики (mean, min, max, count) возрастов жителей по городам.
+        """
+        if not len(self.citizen_ids):
+            return []
+
+        # Сортируем возраст жителей внутри каждого города
+        ages = self.ages(today)
+        order = np.lexsort((ages, self.town_codes))
+        ages = ages[order].astype(np.float64)
+        sizes = np.bincount(self.town_codes, minlength=len(self.towns))
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+        percentiles = []
+        for fraction in fractions:
+            position = (sizes - 1) * fraction
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+            percentiles.append(ages[starts + lower] + (
+                (ages[starts + upper] - ages[starts + lower]) *
+                (position - lower)
+            ))
+
+        aggregates = {
+            'mean': np.add.reduceat(ages, starts) / sizes,
+            'min': ages[starts],
+            'max': ages[starts + sizes - 1],
+            'count': sizes,
+        }
+        aggregates = {name: aggregates[name].tolist() for name in statistics}
+
+        return [
+            (
+                town,
+                [values[i] for values in percentiles],
+                {name: values[i] for name, values in aggregates.items()}
+            )
+            for i, town in enumerate(self.towns)
+        ]
+
+
+class AnalyticsEngine:
+    """
+    Хранит данные выгрузок в памяти процесса (с вытеснением наименее
+    востребованных выгрузок) и рассчитывает по ним статистику.
+    """
+
+    def __init__(self, pg: PG, memory_limit: int):
+        if np is None:
+            raise RuntimeError('numpy is required for analytics engine')
+
+        self.pg = pg
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        self.imports = OrderedDict()  # type: Dict[int, ImportAnalytics]
+        # Загрузки выгрузок, которые выполняются в данный момент.
+        # Конкурентные запросы к одной выгрузке ожидают одну загрузку.
+        self.loading = {}  # type: Dict[int, asyncio.Task]
+
+    async def load(self, import_id: int) -> ImportAnalytics:
+        citizens_query = select([
+            citizens_table.c.citizen_id,
+            citizens_table.c.birth_date,
+            towns_table.c.name.label('town')
+        ]).select_from(
+            citizens_table.join(towns_table)
+        ).where(
+            citizens_table.c.import_id == import_id
+        ).order_by(
+            citizens_table.c.citizen_id
+        )
+        relations_query = select([
+            relations_table.c.citizen_id,
+            relations_table.c.relative_id
+        ]).where(
+            relations_table.c.import_id == import_id
+        ).order_by(
+            relations_table.c.citizen_id
+        )
+        generation_query = select([
+            imports_table.c.generation
+        ]).where(
+            imports_table.c.import_id == import_id
+        )
+
+        # Жители, родственные связи и поколение выгрузки должны
+        # соответствовать одному снимку данных.
+        async with self.pg.transaction(isolation='repeatable_read',
+                                       readonly=True) as conn:
+            generation = await conn.fetchval(generation_query)
+            citizen_rows = await conn.fetch(citizens_query)
+            relation_rows = await conn.fetch(relations_query)
+
+        return ImportAnalytics.from_rows(citizen_rows, relation_rows,
+                                         generation)
+
+    async def get(self, import_id: int, generation: int) -> ImportAnalytics:
+        """
+        Возвращает данные выгрузки поколения не старше generation.
+        """
+        data = self.imports.get(import_id)
+        if data is not None and data.generation >= generation:
+            self.imports.move_to_end(import_id)
+            return data
+
+        # Выгрузка могла быть изменена другим процессом - в этом случае
+        # сохраненные данные устарели.
+        if data is not None:
+            self.invalidate(import_id)
+
+        # Загрузка выполняется отдельной задачей, чтобы отмена одного из
+        # ожидающих ее запросов не отменяла загрузку для остальных.
+        task = self.loading.get(import_id)
+        if task is None:
+            task = asyncio.ensure_future(self.load(import_id))
+            task.add_done_callback(partial(self.on_loaded, import_id))
+            self.loading[import_id] = task
+        data = await asyncio.shield(task)
+
+        # Загрузка могла начаться до изменения выгрузки
+        if data.generation < generation:
+            self.invalidate(import_id)
+            return await self.get(import_id, generation)
+        return data
+
+    def on_loaded(self, import_id: int, task: asyncio.Task):
+        # Выгрузка могла быть изменена во время загрузки (см. invalidate) - в
+        # этом случае данные не сохраняются.
+        if self.loading.get(import_id) is not task:
+            return
+
+        del self.loading[import_id]
+        if not task.cancelled() and task.exception() is None:
+            self.store(import_id, task.result())
+
+    def store(self, import_id: int, data: ImportAnalytics):
+        self.invalidate(import_id)
+        if data.nbytes > self.memory_limit:
+            log.debug('Import %d does not fit analytics memory limit',
+                      import_id)
+            return
+
+        while self.imports and \
+                self.memory_used + data.nbytes > self.memory_limit:
+            evicted_id, evicted = self.imports.popitem(last=False)
+            self.memory_used -= evicted.nbytes
+            log.debug('Import %d evicted from analytics engine', evicted_id)
+
+        self.imports[import_id] = data
+        self.memory_used += data.nbytes
+
+    def invalidate(self, import_id: int):
+        """
+        Удаляет данные выгрузки после ее изменения.
+        """
+        self.loading.pop(import_id, None)
+        data = self.imports.pop(import_id, None)
+        if data is not None:
+            self.memory_used -= data.nbytes
+
+    async def birthdays(self, import_id: int,
+                        generation: int) -> Dict[int, List[dict]]:
+        return (await self.get(import_id, generation)).birthdays()
+
+    async def town_age_stat(self, import_id: int, generation: int,
+                            today: date, fractions: Sequence[float],
+                            statistics: Sequence[str]) -> List[TownAgeStat]:
+        data = await self.get(import_id, generation)
+        return data.town_age_stat(today, fractions, statistics)
+
+
+async def setup_analytics(app: Application, args: Namespace):
+    """
+    Создает аналитический движок, если он включен в настройках приложения.
+    Должен выполняться после подключения к PostgreSQL.
+    """
+    if args.analytics_engine:
+        log.info('Analytics engine memory limit: %d bytes',
+                 args.analytics_memory_limit)
+        app['analytics'] = AnalyticsEngine(app['pg'],
+                                           args.analytics_memory_limit)
+    else:
+        app['analytics'] = None
+    yield
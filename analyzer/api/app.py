@@ -5,13 +5,24 @@ from typing import AsyncIterable, Mapping
 
 from aiohttp import PAYLOAD_REGISTRY
 from aiohttp.web_app import Application
-from aiohttp_apispec import setup_aiohttp_apispec, validation_middleware
 from configargparse import Namespace
 
+from analyzer.api.analytics import setup_analytics
+from analyzer.api.cache import setup_cache
+from analyzer.api.docs import setup_docs
 from analyzer.api.handlers import HANDLERS
-from analyzer.api.middleware import error_middleware, handle_validation_error
+from analyzer.api.limits import setup_limits
+from analyzer.api.loop_monitor import setup_loop_monitor
+from analyzer.api.middleware import (
+    deadline_middleware, docs_middleware, error_middleware,
+    handle_validation_error, limits_middleware, metrics_middleware,
+    query_log_middleware, timed_validation_middleware, timing_middleware,
+)
 from analyzer.api.payloads import AsyncGenJSONListPayload, JsonPayload
-from analyzer.utils.pg import setup_pg
+from analyzer.api.timing import add_server_timing
+from analyzer.utils.pg import setup_pg, setup_pg_replica
+from analyzer.utils.profiler import SamplingProfiler
+from analyzer.utils.querylog import setup_query_log
 
 
 # По умолчанию размер запроса к aiohttp ограничен 1 мегабайтом:
@@ -31,11 +42,53 @@ def create_app(args: Namespace) -> Application:
     """
     app = Application(
         client_max_size=MAX_REQUEST_SIZE,
-        middlewares=[error_middleware, validation_middleware]
+        # metrics_middleware должен быть первым, чтобы учитывать ответы,
+        # сформированные error_middleware. limits_middleware должен
+        # выполняться до чтения тела запроса в validation_middleware, время
+        # ожидания в очереди входит в срок обработки запроса.
+        middlewares=[metrics_middleware, timing_middleware,
+                     query_log_middleware, error_middleware,
+                     deadline_middleware, limits_middleware,
+                     timed_validation_middleware],
+        # Параметры обработчика HTTP-соединений
+        handler_args={'keepalive_timeout': args.api_keepalive_timeout}
     )
 
+    # Настройки приложения доступны обработчикам
+    app['args'] = args
+
+    # Сроки обработки запросов каждого класса, секунд (0 - без ограничений)
+    app['deadlines'] = {
+        'imports': args.deadline_imports,
+        'patches': args.deadline_patches,
+        'reads': args.deadline_reads,
+    }
+
+    # Профилировщик процесса для обработчика ProfileView
+    app['profiler'] = SamplingProfiler()
+
+    # Разбивка времени обработки запроса в заголовке Server-Timing
+    app.on_response_prepare.append(add_server_timing)
+
     # Подключение на старте к postgres и отключение при остановке
     app.cleanup_ctx.append(partial(setup_pg, args=args))
+    app.cleanup_ctx.append(partial(setup_pg_replica, args=args))
+
+    # Журнал запросов к postgres (заменяет подключения обертками, поэтому
+    # должен выполняться до создания объектов, использующих подключения)
+    app.cleanup_ctx.append(partial(setup_query_log, args=args))
+
+    # Аналитический движок использует подключение к postgres
+    app.cleanup_ctx.append(partial(setup_analytics, args=args))
+
+    # Кэш статистики возрастов жителей по городам
+    app.cleanup_ctx.append(partial(setup_cache, args=args))
+
+    # Ограничения нагрузки
+    app.cleanup_ctx.append(partial(setup_limits, args=args))
+
+    # Мониторинг задержек цикла событий
+    app.cleanup_ctx.append(partial(setup_loop_monitor, args=args))
 
     # Регистрация обработчиков
     for handler in HANDLERS:
@@ -43,8 +96,9 @@ def create_app(args: Namespace) -> Application:
         app.router.add_route('*', handler.URL_PATH, handler)
 
     # Swagger документация
-    setup_aiohttp_apispec(app=app, title='Citizens API', swagger_path='/',
-                          error_callback=handle_validation_error)
+    setup_docs(app, args.api_docs, error_callback=handle_validation_error)
+    if args.api_docs == 'lazy':
+        app.middlewares.append(docs_middleware)
 
     # Автоматическая сериализация в json данных в HTTP ответах
     PAYLOAD_REGISTRY.register(AsyncGenJSONListPayload,
@@ -0,0 +1,116 @@
+"""
+Кэш статистики возрастов жителей по городам.
+
+Возраст жителей зависит только от данных выгрузки и текущей даты (UTC), поэтому
+рассчитанная статистика сохраняется в памяти процесса вместе с версией -
+поколением выгрузки (imports.generation, увеличивается при каждом изменении
+жителей) и датой, на которую она рассчитана. Запрос с другой версией (выгрузка
+изменилась или наступила полночь по UTC) заменяет устаревшую статистику.
+
+Поколение выгрузки хранится в БД, поэтому изменения, сделанные другими
+процессами, также приводят к пересчету статистики.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date
+from functools import partial
+from typing import Awaitable, Callable, List, Tuple
+
+from aiohttp.web_app import Application
+from configargparse import Namespace
+
+
+log = logging.getLogger(__name__)
+
+# Выгрузка, режим расчета (точный или приблизительный), запрошенные
+# перцентили и статистики
+Key = Tuple[int, bool, Tuple[float, ...], Tuple[str, ...]]
+# Поколение выгрузки и дата расчета
+Version = Tuple[int, date]
+
+
+class TownAgeStatCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # Ключ -> (версия, статистика)
+        self.entries = OrderedDict()
+        # Расчеты, которые выполняются в данный момент. Конкурентные запросы
+        # с одинаковыми ключом и версией ожидают один расчет.
+        self.computing = {}
+        # Кол-во запросов, ожидающих каждый расчет
+        self.waiters = {}
+
+    async def get(self, key: Key, version: Version,
+                  compute: Callable[[], Awaitable[List]]) -> List:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.entries.move_to_end(key)
+            return entry[1]
+
+        # Расчет выполняется отдельной задачей, чтобы отмена одного из
+        # ожидающих его запросов не отменяла расчет для остальных.
+        task = self.computing.get((key, version))
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            task.add_done_callback(partial(self.on_computed, key, version))
+            self.computing[key, version] = task
+
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+                # Незавершенный расчет больше никто не ожидает (запросы
+                # отменены по истечении срока или при отключении клиентов) -
+                # отменяем его, чтобы остановить запрос к PostgreSQL.
+                task.cancel()
+
+    def on_computed(self, key: Key, version: Version, task: asyncio.Task):
+        # Выгрузка могла быть изменена во время расчета (см. invalidate) - в
+        # этом случае результат не сохраняется.
+        if self.computing.get((key, version)) is not task:
+            return
+
+        del self.computing[key, version]
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        # Статистика, рассчитанная для более старой версии (например, запрос
+        # начался до полуночи), не должна заменять более новую.
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > version:
+            return
+
+        self.entries[key] = version, task.result()
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, import_id: int):
+        """
+        Удаляет статистику выгрузки после ее изменения.
+        """
+        for key in [key for key in self.entries if key[0] == import_id]:
+            del self.entries[key]
+        for key, version in list(self.computing):
+            if key[0] == import_id:
+                del self.computing[key, version]
+
+
+async def setup_cache(app: Application, args: Namespace):
+    """
+    Создает кэш статистики, если он включен в настройках приложения.
+    """
+    if args.town_stat_cache_size:
+        # Статистика кэшируется отдельно для каждого сочетания параметров
+        # запроса (см. Key), поэтому размер задается в записях, а не в
+        # выгрузках.
+        log.info('Town age stat cache size: %d entries',
+                 args.town_stat_cache_size)
+        app['town_stat_cache'] = TownAgeStatCache(args.town_stat_cache_size)
+    else:
+        app['town_stat_cache'] = None
+    yield
@@ -0,0 +1,81 @@
+"""
+Swagger документация REST API сервиса.
+
+Построение спецификации OpenAPI по схемам marshmallow занимает заметную часть
+времени запуска приложения. Поэтому помимо построения спецификации при запуске
+(как в aiohttp_apispec.setup_aiohttp_apispec) поддерживаются режимы, в которых
+спецификация строится при первом запросе документации (lazy) или документация
+отключена (off).
+"""
+from typing import Callable
+
+from aiohttp.web_app import Application
+from aiohttp.web_urldispatcher import UrlDispatcher
+from aiohttp_apispec import AiohttpApiSpec, setup_aiohttp_apispec
+
+
+DOCS_MODES = ('startup', 'lazy', 'off')
+
+TITLE = 'Citizens API'
+VERSION = '0.0.1'
+SWAGGER_PATH = '/'
+SWAGGER_URL = '/api/docs/swagger.json'
+
+
+class SpecTarget(dict):
+    """
+    Принимает построенную спецификацию вместо приложения: после запуска
+    состояние приложения не должно изменяться.
+    """
+
+    def __init__(self, router: UrlDispatcher):
+        super().__init__()
+        self.router = router
+
+
+class LazyApiSpec(AiohttpApiSpec):
+    """
+    Строит спецификацию OpenAPI при первом вызове build, а не при запуске
+    приложения. Валидация запросов (validation_middleware) от спецификации не
+    зависит и работает во всех режимах.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.swagger = {}
+        super().__init__(*args, **kwargs)
+
+    def _register(self, app: Application):
+        # Вызывается aiohttp-apispec при запуске приложения. Обработчик
+        # документации отдает app['swagger_dict'], он заполняется в build.
+        app['swagger_dict'] = self.swagger
+
+    def build(self, app: Application) -> dict:
+        if not self.swagger:
+            target = SpecTarget(app.router)
+            super()._register(target)
+            self.swagger.update(target['swagger_dict'])
+        return self.swagger
+
+
+def setup_docs(app: Application, mode: str, error_callback: Callable):
+    """
+    Настраивает документацию в выбранном режиме (см. DOCS_MODES). В режиме
+    lazy спецификация сохраняется в app['docs'] и строится docs_middleware.
+    """
+    app['docs'] = None
+    if mode == 'startup':
+        setup_aiohttp_apispec(app=app, title=TITLE, version=VERSION,
+                              url=SWAGGER_URL, swagger_path=SWAGGER_PATH,
+                              error_callback=error_callback)
+        return
+
+    if mode == 'lazy':
+        app['docs'] = LazyApiSpec(app=app, title=TITLE, version=VERSION,
+                                  url=SWAGGER_URL, swagger_path=SWAGGER_PATH,
+                                  error_callback=error_callback)
+        return
+
+    # Спецификация не строится и не отдается, но aiohttp-apispec необходимо
+    # зарегистрировать для работы validation_middleware
+    LazyApiSpec(app=app, title=TITLE, version=VERSION, url=None,
+                error_callback=error_callback)
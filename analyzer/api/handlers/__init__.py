@@ -2,10 +2,12 @@ from .citizen import CitizenView
 from .citizen_birthdays import CitizenBirthdaysView
 from .citizens import CitizensView
 from .imports import ImportsView
+from .metrics import MetricsView
+from .profile import ProfileView
 from .town_stat import TownAgeStatView
 
 
 HANDLERS = (
     CitizenBirthdaysView, CitizensView, CitizenView, ImportsView,
-    TownAgeStatView,
+    MetricsView, ProfileView, TownAgeStatView,
 )
@@ -1,17 +1,141 @@
+import re
+from typing import AsyncIterable, Optional
+
 from aiohttp.web_exceptions import HTTPNotFound
+from aiohttp.web_response import StreamResponse
 from aiohttp.web_urldispatcher import View
 from asyncpgsa import PG
-from sqlalchemy import exists, select
+from configargparse import Namespace
+from marshmallow import ValidationError
+from sqlalchemy import Column, select
+from sqlalchemy.sql import Select
 
+from analyzer.api.analytics import AnalyticsEngine
+from analyzer.api.cache import TownAgeStatCache
+from analyzer.api.timing import TimingPG
 from analyzer.db.schema import imports_table
+from analyzer.utils.pg import (
+    KeysetSelectQuery, SelectQuery, remaining_time, set_statement_timeout,
+)
+
+
+# Позиция в журнале предзаписи (WAL) PostgreSQL, после которой сохранены
+# изменения клиента. Возвращается в ответах на изменяющие запросы, клиент
+# передает ее в последующих запросах, чтобы прочитать свои изменения.
+LSN_HEADER = 'X-Last-Write-LSN'
+LSN_RE = re.compile(r'^[0-9A-F]{1,8}/[0-9A-F]{1,8}$', re.IGNORECASE)
+
+# Для реплики - позиция последней примененной записи журнала. Если реплика
+# была повышена до мастера (или вместо реплики указан мастер), проверять
+# позицию не требуется.
+WRITE_LSN_QUERY = 'SELECT pg_current_wal_insert_lsn()::text'
+REPLAYED_LSN_QUERY = """
+    SELECT CASE WHEN pg_is_in_recovery()
+        THEN pg_last_wal_replay_lsn() >= $1::text::pg_lsn
+        ELSE TRUE
+    END
+"""
 
 
 class BaseView(View):
     URL_PATH: str
 
+    @property
+    def args(self) -> Namespace:
+        return self.request.app['args']
+
+    def timing_pg(self, pg: Optional[PG]) -> Optional[PG]:
+        """
+        Учитывает время запросов к PostgreSQL в заголовке Server-Timing (см.
+        analyzer.api.timing).
+        """
+        timings = self.request.get('timings')
+        if pg is None or timings is None:
+            return pg
+        return TimingPG(pg, timings)
+
     @property
     def pg(self) -> PG:
-        return self.request.app['pg']
+        return self.timing_pg(self.request.app['pg'])
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """
+        Срок обработки запроса по time.monotonic (см. deadline_middleware).
+        """
+        return self.request.get('deadline')
+
+    def query_timeout(self) -> Optional[float]:
+        """
+        Оставшееся время обработки запроса для передачи в запросы asyncpg.
+        """
+        return remaining_time(self.deadline)
+
+    async def set_statement_timeout(self, conn):
+        """
+        Ограничивает время выполнения запросов транзакции оставшимся временем
+        обработки запроса.
+        """
+        await set_statement_timeout(conn, self.deadline)
+
+    @property
+    def pg_replica(self) -> Optional[PG]:
+        return self.timing_pg(self.request.app.get('pg_replica'))
+
+    async def read_pg(self) -> PG:
+        """
+        Возвращает подключение для запросов на чтение: к реплике, если она
+        указана в настройках и уже содержит изменения, сделанные клиентом
+        (см. LSN_HEADER), иначе к мастеру.
+        """
+        if self.pg_replica is None:
+            return self.pg
+
+        lsn = self.request.headers.get(LSN_HEADER)
+        if lsn is None:
+            return self.pg_replica
+
+        if not LSN_RE.match(lsn):
+            raise ValidationError({LSN_HEADER: ['Invalid LSN']})
+
+        replayed = await self.pg_replica.fetchval(
+            REPLAYED_LSN_QUERY, lsn, timeout=self.query_timeout()
+        )
+        if replayed:
+            return self.pg_replica
+        return self.pg
+
+    async def set_write_lsn(self, response: StreamResponse):
+        """
+        Добавляет в ответ позицию в журнале предзаписи после изменений,
+        сделанных запросом. Вызывается после фиксации транзакции.
+        """
+        if self.pg_replica is not None:
+            response.headers[LSN_HEADER] = await self.pg.fetchval(
+                WRITE_LSN_QUERY
+            )
+
+    def select_query(self, pg: PG, query: Select,
+                     key: Column) -> AsyncIterable:
+        """
+        Возвращает результаты запроса по частям, для отправки клиенту по мере
+        получения из БД. key - уникальный столбец результатов, по которому
+        запрашиваются части, если серверные курсоры недоступны.
+        """
+        if self.args.pg_pooler_mode:
+            transaction = pg.transaction(isolation='repeatable_read',
+                                         readonly=True)
+            return KeysetSelectQuery(query, key, transaction,
+                                     deadline=self.deadline)
+        return SelectQuery(query, pg.transaction(), deadline=self.deadline)
+
+    @property
+    def analytics(self) -> Optional[AnalyticsEngine]:
+        return self.request.app.get('analytics')
+
+    @property
+    def town_stat_cache(self) -> Optional[TownAgeStatCache]:
+        return self.request.app.get('town_stat_cache')
 
 
 class BaseImportView(BaseView):
@@ -19,9 +143,33 @@ class BaseImportView(BaseView):
     def import_id(self):
         return int(self.request.match_info.get('import_id'))
 
-    async def check_import_exists(self):
+    @staticmethod
+    async def acquire_lock(conn, import_id):
+        await conn.execute('SELECT pg_advisory_xact_lock($1)', import_id)
+
+    async def check_import_exists(self, pg: Optional[PG] = None) -> int:
+        """
+        Проверяет, что выгрузка существует, и возвращает ее поколение
+        (imports.generation).
+        """
         query = select([
-            exists().where(imports_table.c.import_id == self.import_id)
-        ])
-        if not await self.pg.fetchval(query):
+            imports_table.c.generation
+        ]).where(
+            imports_table.c.import_id == self.import_id
+        )
+        generation = await (pg or self.pg).fetchval(
+            query, timeout=self.query_timeout()
+        )
+        if generation is None:
             raise HTTPNotFound()
+        return generation
+
+    def import_changed(self):
+        """
+        Сбрасывает данные выгрузки, сохраненные в памяти процесса. Вызывается
+        после того, как изменения выгрузки сохранены в БД.
+        """
+        if self.analytics is not None:
+            self.analytics.invalidate(self.import_id)
+        if self.town_stat_cache is not None:
+            self.town_stat_cache.invalidate(self.import_id)
@@ -1,16 +1,14 @@
 from http import HTTPStatus
-from itertools import groupby
 
 from aiohttp.web_response import Response
 from aiohttp_apispec import docs, response_schema
-from sqlalchemy import Integer, and_, cast, func, select
+from sqlalchemy import and_, select
 
 from analyzer.api.schema import CitizenPresentsResponseSchema
-from analyzer.db.schema import (
-    citizens_table as citizens_t, relations_table as relations_t,
-)
+from analyzer.db.schema import presents_table as presents_t
 
 from .base import BaseImportView
+from .query import BIRTHDAYS_JSON_QUERY
 
 
 class CitizenBirthdaysView(BaseImportView):
@@ -19,36 +17,35 @@ class CitizenBirthdaysView(BaseImportView):
     @docs(summary='Статистика дней рождений родственников жителей по месяцам')
     @response_schema(CitizenPresentsResponseSchema(), code=HTTPStatus.OK.value)
     async def get(self):
-        await self.check_import_exists()
-
-        # В задании требуется, чтобы ключами были номера месяцев
-        # (без ведущих нулей, "01" -> 1).
-        month = func.date_part('month', citizens_t.c.birth_date)
-        month = cast(month, Integer).label('month')
-
+        pg = await self.read_pg()
+        generation = await self.check_import_exists(pg)
+
+        if self.analytics is not None:
+            result = await self.analytics.birthdays(self.import_id,
+                                                    generation)
+            return Response(body={'data': result})
+
+        if self.args.birthdays_json_in_db:
+            # Ответ целиком формируется в PostgreSQL и отправляется клиенту
+            # без разбора и повторной сериализации.
+            body = await pg.fetchval(BIRTHDAYS_JSON_QUERY, self.import_id,
+                                     timeout=self.query_timeout())
+            return Response(text=body, content_type='application/json')
+
+        # Статистика рассчитывается при создании выгрузки и обновляется при
+        # изменении жителей (см. таблицу presents).
         query = select([
-            month,
-            relations_t.c.citizen_id,
-            func.count(relations_t.c.relative_id).label('presents')
-        ]).select_from(
-            relations_t.join(
-                citizens_t, and_(
-                    citizens_t.c.import_id == relations_t.c.import_id,
-                    citizens_t.c.citizen_id == relations_t.c.relative_id
-                )
-            )
-        ).group_by(
-            month,
-            relations_t.c.import_id,
-            relations_t.c.citizen_id
-        ).where(
-            relations_t.c.import_id == self.import_id
-        )
-        rows = await self.pg.fetch(query)
+            presents_t.c.month,
+            presents_t.c.citizen_id,
+            presents_t.c.presents
+        ]).where(and_(
+            presents_t.c.import_id == self.import_id,
+            presents_t.c.presents > 0
+        ))
+        rows = await pg.fetch(query, timeout=self.query_timeout())
 
         result = {i: [] for i in range(1, 13)}
-        for month, rows in groupby(rows, key=lambda row: row['month']):
-            for row in rows:
-                result[month].append({'citizen_id': row['citizen_id'],
-                                      'presents': row['presents']})
+        for row in rows:
+            result[row['month']].append({'citizen_id': row['citizen_id'],
+                                         'presents': row['presents']})
         return Response(body={'data': result})
@@ -1,24 +1,146 @@
+from http import HTTPStatus
+
+from aiohttp.web_exceptions import HTTPNotFound
 from aiohttp.web_response import Response
-from aiohttp_apispec import docs, response_schema
+from aiohttp_apispec import docs, request_schema, response_schema
+from asyncpg import ForeignKeyViolationError
+from marshmallow import ValidationError
+from sqlalchemy import Integer, and_, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
 
-from analyzer.api.schema import CitizensResponseSchema
-from analyzer.db.schema import citizens_table as citizens_t
-from analyzer.utils.pg import SelectQuery
+from analyzer.api.schema import CitizensResponseSchema, PatchCitizensSchema
+from analyzer.db.schema import (
+    citizens_table as citizens_t, presents_table as presents_t,
+    relations_table as relations_t,
+)
 
 from .base import BaseImportView
-from .query import CITIZENS_QUERY
+from .query import (
+    CITIZENS_QUERY, PATCH_CITIZEN_FIELDS, PATCH_CITIZENS_QUERY, PRESENTS_QUERY,
+)
 
 
 class CitizensView(BaseImportView):
     URL_PATH = r'/imports/{import_id:\d+}/citizens'
 
+    @staticmethod
+    async def refresh_presents(conn, import_id, citizen_ids):
+        """
+        Пересчитывает кол-во подарков для указанных жителей.
+        """
+        citizen_ids = bindparam('citizen_ids', citizen_ids,
+                                type_=ARRAY(Integer))
+        query = presents_t.delete().where(and_(
+            presents_t.c.import_id == import_id,
+            presents_t.c.citizen_id == any_(citizen_ids)
+        ))
+        await conn.execute(query)
+
+        query = presents_t.insert().from_select(
+            [column.name for column in presents_t.columns],
+            PRESENTS_QUERY.where(and_(
+                relations_t.c.import_id == import_id,
+                relations_t.c.citizen_id == any_(citizen_ids)
+            ))
+        )
+        await conn.execute(query)
+
+    @staticmethod
+    async def patch_citizens(conn, import_id, citizens):
+        """
+        Обновляет жителей и их родственные связи одним запросом, возвращает
+        кол-во найденных жителей и жителей, для которых могло измениться
+        кол-во подарков.
+        """
+        # Каждое поле передается отдельным массивом, позиция в массиве
+        # соответствует жителю.
+        citizen_ids = [citizen['citizen_id'] for citizen in citizens]
+        values = [
+            [citizen.get(field) for citizen in citizens]
+            for field in PATCH_CITIZEN_FIELDS
+        ]
+
+        # Требуемые родственные связи передаются двумя массивами: жители и их
+        # родственники.
+        relation_citizen_ids, relation_relative_ids = [], []
+        relatives_owner_ids = []
+        for citizen in citizens:
+            if 'relatives' not in citizen:
+                continue
+
+            relatives_owner_ids.append(citizen['citizen_id'])
+            for relative_id in citizen['relatives']:
+                relation_citizen_ids.append(citizen['citizen_id'])
+                relation_relative_ids.append(relative_id)
+
+        try:
+            return await conn.fetchrow(
+                PATCH_CITIZENS_QUERY, import_id, citizen_ids, *values,
+                relation_citizen_ids, relation_relative_ids,
+                relatives_owner_ids
+            )
+        except ForeignKeyViolationError:
+            raise ValidationError({'citizens': (
+                'Unable to add relatives, some do not exist'
+            )})
+
     @docs(summary='Отобразить жителей для указанной выгрузки')
     @response_schema(CitizensResponseSchema())
     async def get(self):
-        await self.check_import_exists()
+        pg = await self.read_pg()
+        await self.check_import_exists(pg)
 
         query = CITIZENS_QUERY.where(
             citizens_t.c.import_id == self.import_id
         )
-        body = SelectQuery(query, self.pg.transaction())
+        body = self.select_query(pg, query, citizens_t.c.citizen_id)
         return Response(body=body)
+
+    @docs(summary='Обновить нескольких жителей в определенной выгрузке')
+    @request_schema(PatchCitizensSchema())
+    @response_schema(CitizensResponseSchema(), code=HTTPStatus.OK.value)
+    async def patch(self):
+        await self.check_import_exists()
+
+        citizens = self.request['data']['citizens']
+
+        # Транзакция требуется чтобы в случае ошибки (или отключения клиента,
+        # не дождавшегося ответа) откатить все изменения, а также для
+        # получения транзакционной advisory-блокировки (общей с
+        # CitizenView).
+        async with self.pg.transaction() as conn:
+            await self.set_statement_timeout(conn)
+            await self.acquire_lock(conn, self.import_id)
+
+            result = await self.patch_citizens(conn, self.import_id,
+                                               citizens)
+            if result['found'] != len(citizens):
+                raise HTTPNotFound()
+
+            # Кол-во подарков зависит только от дат рождения и родственных
+            # связей.
+            if any(
+                    'birth_date' in citizen or 'relatives' in citizen
+                    for citizen in citizens
+            ):
+                await self.refresh_presents(conn, self.import_id,
+                                            result['affected_citizen_ids'])
+
+            # Обновленные жители читаются в той же транзакции, чтобы ответ
+            # не содержал изменений конкурентных запросов, выполненных после
+            # ее завершения.
+            citizen_ids = bindparam(
+                'citizen_ids',
+                [citizen['citizen_id'] for citizen in citizens],
+                type_=ARRAY(Integer)
+            )
+            query = CITIZENS_QUERY.where(and_(
+                citizens_t.c.import_id == self.import_id,
+                citizens_t.c.citizen_id == any_(citizen_ids)
+            )).order_by(citizens_t.c.citizen_id)
+            citizens = await conn.fetch(query)
+
+        self.import_changed()
+        response = Response(body={'data': citizens})
+        await self.set_write_lsn(response)
+        return response
@@ -6,10 +6,15 @@ from aiohttp_apispec import docs, request_schema, response_schema
 from aiomisc import chunk_list
 
 from analyzer.api.schema import ImportResponseSchema, ImportSchema
-from analyzer.db.schema import citizens_table, imports_table, relations_table
+from analyzer.db.lookups import AddressIds, insert_addresses
+from analyzer.db.schema import (
+    citizens_table, imports_table, presents_table, relations_table,
+    town_birth_months_table,
+)
 from analyzer.utils.pg import MAX_QUERY_ARGS
 
 from .base import BaseView
+from .query import PRESENTS_QUERY, TOWN_BIRTH_MONTHS_QUERY
 
 
 class ImportsView(BaseView):
@@ -23,10 +28,12 @@ class ImportsView(BaseView):
     MAX_RELATIONS_PER_INSERT = MAX_QUERY_ARGS // len(relations_table.columns)
 
     @classmethod
-    def make_citizens_table_rows(cls, citizens, import_id) -> Generator:
+    def make_citizens_table_rows(cls, citizens, import_id,
+                                 address_ids: AddressIds) -> Generator:
         """
         Генерирует данные готовые для вставки в таблицу citizens (с ключом
-        import_id и без ключа relatives).
+        import_id, идентификаторами адресов в словарях и без ключа
+        relatives).
         """
         for citizen in citizens:
             yield {
@@ -35,9 +42,9 @@ class ImportsView(BaseView):
                 'name': citizen['name'],
                 'birth_date': citizen['birth_date'],
                 'gender': citizen['gender'],
-                'town': citizen['town'],
-                'street': citizen['street'],
-                'building': citizen['building'],
+                'town_id': address_ids['town'][citizen['town']],
+                'street_id': address_ids['street'][citizen['street']],
+                'building_id': address_ids['building'][citizen['building']],
                 'apartment': citizen['apartment'],
             }
 
@@ -61,6 +68,8 @@ class ImportsView(BaseView):
         # Транзакция требуется чтобы в случае ошибки (или отключения клиента,
         # не дождавшегося ответа) откатить частично добавленные изменения.
         async with self.pg.transaction() as conn:
+            await self.set_statement_timeout(conn)
+
             # Создаем выгрузку
             query = imports_table.insert().returning(imports_table.c.import_id)
             import_id = await conn.fetchval(query)
@@ -69,7 +78,13 @@ class ImportsView(BaseView):
             # лениво генерируют данные, готовые для вставки в таблицы citizens
             # и relations на основе данных отправленных клиентом.
             citizens = self.request['data']['citizens']
-            citizen_rows = self.make_citizens_table_rows(citizens, import_id)
+
+            # Заполняем словари адресов выгрузки, по одному запросу на
+            # словарь
+            address_ids = await insert_addresses(conn, import_id, citizens)
+
+            citizen_rows = self.make_citizens_table_rows(citizens, import_id,
+                                                         address_ids)
             relation_rows = self.make_relations_table_rows(citizens, import_id)
 
             # Чтобы уложиться в ограничение кол-ва аргументов в запросе к
@@ -91,5 +106,23 @@ class ImportsView(BaseView):
             for chunk in chunked_relation_rows:
                 await conn.execute(query.values(list(chunk)))
 
-        return Response(body={'data': {'import_id': import_id}},
-                        status=HTTPStatus.CREATED)
+            # Рассчитываем кол-во подарков по месяцам для жителей выгрузки
+            query = presents_table.insert().from_select(
+                [column.name for column in presents_table.columns],
+                PRESENTS_QUERY.where(relations_table.c.import_id == import_id)
+            )
+            await conn.execute(query)
+
+            # Рассчитываем кол-во жителей по городам и месяцам рождения
+            query = town_birth_months_table.insert().from_select(
+                [column.name for column in town_birth_months_table.columns],
+                TOWN_BIRTH_MONTHS_QUERY.where(
+                    citizens_table.c.import_id == import_id
+                )
+            )
+            await conn.execute(query)
+
+        response = Response(body={'data': {'import_id': import_id}},
+                            status=HTTPStatus.CREATED)
+        await self.set_write_lsn(response)
+        return response
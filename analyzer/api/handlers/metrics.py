@@ -0,0 +1,19 @@
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs
+
+from analyzer.api.metrics import REGISTRY, collect_pool_stats
+
+from .base import BaseView
+
+
+class MetricsView(BaseView):
+    URL_PATH = '/metrics'
+    # Версия text exposition format Prometheus
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    @docs(summary='Метрики сервиса в формате Prometheus')
+    async def get(self):
+        collect_pool_stats(self.pg.pool)
+        response = Response(text=REGISTRY.render())
+        response.headers['Content-Type'] = self.CONTENT_TYPE
+        return response
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from hmac import compare_digest
+
+from aiohttp.web_exceptions import HTTPConflict, HTTPForbidden, HTTPNotFound
+from aiohttp.web_response import Response
+from aiohttp_apispec import docs, querystring_schema
+from marshmallow import ValidationError
+
+from analyzer.api.schema import ProfileQuerySchema
+from analyzer.utils.profiler import SamplingProfiler, collapse
+
+from .base import BaseView
+
+
+class ProfileView(BaseView):
+    URL_PATH = '/admin/profile'
+    # Интервал между выборками стека по умолчанию, миллисекунд
+    DEFAULT_INTERVAL = 10
+
+    @property
+    def profiler(self) -> SamplingProfiler:
+        return self.request.app['profiler']
+
+    def check_admin(self):
+        """
+        Обработчик доступен только с токеном --admin-token в заголовке
+        Authorization. Если токен не указан в настройках, обработчик отключен.
+        """
+        if self.args.admin_token is None:
+            raise HTTPNotFound()
+
+        authorization = self.request.headers.get('Authorization', '')
+        expected = 'Bearer ' + self.args.admin_token
+        if not compare_digest(authorization.encode(), expected.encode()):
+            raise HTTPForbidden()
+
+    @docs(summary='Статистическое профилирование процесса, обработавшего '
+                  'запрос (в формате collapsed stacks)')
+    @querystring_schema(ProfileQuerySchema())
+    async def get(self):
+        self.check_admin()
+
+        params = self.request['querystring']
+        seconds = params['seconds']
+        interval = params.get('interval', self.DEFAULT_INTERVAL) / 1000
+        remaining = self.query_timeout()
+        if remaining is not None and remaining <= seconds:
+            raise ValidationError({
+                'seconds': ['Profiling exceeds request deadline']
+            })
+
+        if not self.profiler.acquire():
+            raise HTTPConflict(text='Profiler is already running')
+
+        # Профилируется поток с циклом событий, выборки собираются в
+        # отдельном потоке
+        loop = asyncio.get_event_loop()
+        stacks = await loop.run_in_executor(
+            None, self.profiler.sample, threading.get_ident(), seconds,
+            interval
+        )
+        return Response(text=collapse(stacks))
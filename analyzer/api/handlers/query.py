@@ -1,16 +1,21 @@
-from sqlalchemy import and_, func, select
+from sqlalchemy import Date, Integer, and_, cast, func, select
 
-from analyzer.db.schema import citizens_table, relations_table
+from analyzer.db.schema import (
+    buildings_table, citizens_table, relations_table, streets_table,
+    towns_table,
+)
 
 
+# Адреса жителей хранятся в словарях (см. analyzer.db.lookups), значения
+# получаются соединением с ними.
 CITIZENS_QUERY = select([
     citizens_table.c.citizen_id,
     citizens_table.c.name,
     citizens_table.c.birth_date,
     citizens_table.c.gender,
-    citizens_table.c.town,
-    citizens_table.c.street,
-    citizens_table.c.building,
+    towns_table.c.name.label('town'),
+    streets_table.c.name.label('street'),
+    buildings_table.c.name.label('building'),
     citizens_table.c.apartment,
     # В результате LEFT JOIN у жителей не имеющих родственников список
     # relatives будет иметь значение [None]. Чтобы удалить это значение
@@ -20,7 +25,14 @@ CITIZENS_QUERY = select([
         None
     ).label('relatives')
 ]).select_from(
-    citizens_table.outerjoin(
+    citizens_table.join(
+        towns_table, towns_table.c.town_id == citizens_table.c.town_id
+    ).join(
+        streets_table, streets_table.c.street_id == citizens_table.c.street_id
+    ).join(
+        buildings_table,
+        buildings_table.c.building_id == citizens_table.c.building_id
+    ).outerjoin(
         relations_table, and_(
             citizens_table.c.import_id == relations_table.c.import_id,
             citizens_table.c.citizen_id == relations_table.c.citizen_id
@@ -28,5 +40,568 @@ CITIZENS_QUERY = select([
     )
 ).group_by(
     citizens_table.c.import_id,
-    citizens_table.c.citizen_id
+    citizens_table.c.citizen_id,
+    # Значения словарей функционально зависят от их первичных ключей
+    towns_table.c.town_id,
+    streets_table.c.street_id,
+    buildings_table.c.building_id
+)
+
+
+# Рассчитывает кол-во подарков, которые жители купят своим родственникам в
+# каждом месяце. Используется для заполнения таблицы presents.
+# В задании требуется, чтобы ключами были номера месяцев
+# (без ведущих нулей, "01" -> 1).
+PRESENTS_MONTH = cast(
+    func.date_part('month', citizens_table.c.birth_date), Integer
+).label('month')
+PRESENTS_QUERY = select([
+    relations_table.c.import_id,
+    relations_table.c.citizen_id,
+    PRESENTS_MONTH,
+    func.count(relations_table.c.relative_id).label('presents')
+]).select_from(
+    relations_table.join(
+        citizens_table, and_(
+            citizens_table.c.import_id == relations_table.c.import_id,
+            citizens_table.c.citizen_id == relations_table.c.relative_id
+        )
+    )
+).group_by(
+    relations_table.c.import_id,
+    relations_table.c.citizen_id,
+    PRESENTS_MONTH
+)
+
+# Рассчитывает кол-во жителей, родившихся в каждом месяце, по городам.
+# Используется для заполнения таблицы town_birth_months.
+BIRTH_MONTH = cast(
+    func.date_trunc('month', citizens_table.c.birth_date), Date
+).label('birth_month')
+TOWN_BIRTH_MONTHS_QUERY = select([
+    citizens_table.c.import_id,
+    citizens_table.c.town_id,
+    BIRTH_MONTH,
+    func.count().label('population')
+]).group_by(
+    citizens_table.c.import_id,
+    citizens_table.c.town_id,
+    BIRTH_MONTH
+)
+
+# Поля жителя, которые можно изменить с помощью PATCH-запроса (кроме
+# relatives). Порядок полей соответствует порядку аргументов $3...$9 в запросе
+# PATCH_CITIZEN_QUERY и PATCH_CITIZENS_QUERY.
+PATCH_CITIZEN_FIELDS = (
+    'name', 'gender', 'birth_date', 'town', 'street', 'building', 'apartment'
+)
+
+# Обновляет жителя, его родственные связи и возвращает актуальную информацию о
+# нем за один запрос к БД.
+#
+# Аргументы:
+# $1 - import_id, $2 - citizen_id,
+# $3...$9 - новые значения полей PATCH_CITIZEN_FIELDS (NULL - поле не меняется,
+#           все поля в таблице citizens объявлены как NOT NULL),
+# $10 - новый список родственников (NULL - родственники не меняются).
+#
+# Все подзапросы в WITH работают с одним и тем же снимком данных, сделанным до
+# начала выполнения запроса: изменения, сделанные в updated, deleted и
+# inserted, не видны другим частям запроса. Поэтому актуальный список
+# родственников возвращается из аргумента $10 (либо из current_relatives, если
+# родственники не менялись).
+#
+# Таблица presents обновляется на разницу между старым и новым состоянием
+# жителя (presents_diff): житель с датой рождения в месяце M и родственниками R
+# добавляет каждому родственнику из R подарок в месяце M, а себе - по подарку
+# в месяц рождения каждого родственника.
+# Аналогично обновляется таблица town_birth_months (town_birth_months_diff).
+# Поколение выгрузки (imports.generation) увеличивается на 1.
+#
+# Отсутствующие в словарях выгрузки город, улица и строение добавляются
+# (town_inserted, street_inserted, building_inserted), а старые значения, если
+# у других жителей выгрузки их нет, удаляются (town_deleted, street_deleted,
+# building_deleted; строки town_birth_months удаляются вместе с городом).
+# Конкурентные запросы не могут добавить или удалить те же значения, т.к.
+# изменяют жителей выгрузки под той же advisory-блокировкой.
+#
+# Если житель не найден - запрос не изменяет данные и не возвращает строк.
+PATCH_CITIZEN_QUERY = '''
+WITH previous AS (
+    SELECT town_id, street_id, building_id FROM citizens
+    WHERE import_id = $1 AND citizen_id = $2
+),
+town_inserted AS (
+    INSERT INTO towns (import_id, name)
+    SELECT $1, $6::varchar FROM previous
+    WHERE $6::varchar IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM towns WHERE import_id = $1 AND name = $6::varchar
+    )
+    RETURNING town_id
+),
+street_inserted AS (
+    INSERT INTO streets (import_id, name)
+    SELECT $1, $7::varchar FROM previous
+    WHERE $7::varchar IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM streets WHERE import_id = $1 AND name = $7::varchar
+    )
+    RETURNING street_id
+),
+building_inserted AS (
+    INSERT INTO buildings (import_id, name)
+    SELECT $1, $8::varchar FROM previous
+    WHERE $8::varchar IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM buildings WHERE import_id = $1 AND name = $8::varchar
+    )
+    RETURNING building_id
+),
+updated AS (
+    UPDATE citizens SET
+        name = COALESCE($3::varchar, name),
+        gender = COALESCE($4::gender, gender),
+        birth_date = COALESCE($5::date, birth_date),
+        town_id = COALESCE(
+            (SELECT town_id FROM town_inserted),
+            (SELECT town_id FROM towns
+             WHERE import_id = $1 AND name = $6::varchar),
+            town_id
+        ),
+        street_id = COALESCE(
+            (SELECT street_id FROM street_inserted),
+            (SELECT street_id FROM streets
+             WHERE import_id = $1 AND name = $7::varchar),
+            street_id
+        ),
+        building_id = COALESCE(
+            (SELECT building_id FROM building_inserted),
+            (SELECT building_id FROM buildings
+             WHERE import_id = $1 AND name = $8::varchar),
+            building_id
+        ),
+        apartment = COALESCE($9::integer, apartment)
+    WHERE
+        import_id = $1 AND citizen_id = $2 AND
+        -- Не создаем новую версию строки, если поля жителя не меняются
+        num_nonnulls(
+            $3::varchar, $4::gender, $5::date, $6::varchar, $7::varchar,
+            $8::varchar, $9::integer
+        ) > 0
+    RETURNING
+        citizen_id, name, birth_date, gender, town_id, street_id,
+        building_id, apartment
+),
+citizen AS (
+    SELECT * FROM updated
+    UNION ALL
+    SELECT
+        citizen_id, name, birth_date, gender, town_id, street_id,
+        building_id, apartment
+    FROM citizens
+    WHERE
+        import_id = $1 AND citizen_id = $2 AND
+        NOT EXISTS (SELECT 1 FROM updated)
+),
+current_relatives AS (
+    SELECT relative_id FROM relations
+    WHERE import_id = $1 AND citizen_id = $2
+),
+removed_relatives AS (
+    SELECT relative_id FROM current_relatives WHERE $10::integer[] IS NOT NULL
+    EXCEPT
+    SELECT unnest($10::integer[])
+),
+added_relatives AS (
+    -- Связи добавляются только если житель существует
+    SELECT unnest($10::integer[]) AS relative_id FROM citizen
+    EXCEPT
+    SELECT relative_id FROM current_relatives
+),
+deleted AS (
+    DELETE FROM relations
+    WHERE import_id = $1 AND (
+        (citizen_id = $2 AND
+         relative_id IN (SELECT relative_id FROM removed_relatives)) OR
+        (relative_id = $2 AND
+         citizen_id IN (SELECT relative_id FROM removed_relatives))
+    )
+),
+inserted AS (
+    INSERT INTO relations (import_id, citizen_id, relative_id)
+    SELECT $1, $2, relative_id FROM added_relatives
+    UNION ALL
+    -- Обратная связь не нужна, если житель сам себе родственник
+    SELECT $1, relative_id, $2 FROM added_relatives WHERE relative_id != $2
+),
+new_relatives AS (
+    SELECT unnest(COALESCE(
+        $10::integer[],
+        ARRAY(SELECT relative_id FROM current_relatives)
+    )) AS relative_id
+    FROM citizen
+),
+presents_diff AS (
+    -- Родственники жителя покупали ему подарок в старый месяц рождения
+    SELECT
+        current_relatives.relative_id AS citizen_id,
+        date_part('month', citizens.birth_date)::integer AS month,
+        -1 AS presents
+    FROM current_relatives, citizens
+    WHERE citizens.import_id = $1 AND citizens.citizen_id = $2
+    UNION ALL
+    -- и будут покупать в новый
+    SELECT
+        new_relatives.relative_id,
+        date_part('month', citizen.birth_date)::integer,
+        1
+    FROM new_relatives, citizen
+    UNION ALL
+    -- Житель покупал подарки старым родственникам (подарок самому себе уже
+    -- учтен выше)
+    SELECT $2, date_part('month', citizens.birth_date)::integer, -1
+    FROM current_relatives
+    JOIN citizens ON
+        citizens.import_id = $1 AND
+        citizens.citizen_id = current_relatives.relative_id
+    WHERE current_relatives.relative_id != $2
+    UNION ALL
+    -- и будет покупать новым
+    SELECT $2, date_part('month', citizens.birth_date)::integer, 1
+    FROM new_relatives
+    JOIN citizens ON
+        citizens.import_id = $1 AND
+        citizens.citizen_id = new_relatives.relative_id
+    WHERE new_relatives.relative_id != $2
+),
+presents_updated AS (
+    INSERT INTO presents (import_id, citizen_id, month, presents)
+    SELECT $1, citizen_id, month, sum(presents)
+    FROM presents_diff
+    GROUP BY citizen_id, month
+    HAVING sum(presents) != 0
+    ON CONFLICT (import_id, citizen_id, month) DO UPDATE
+    SET presents = presents.presents + excluded.presents
+),
+town_birth_months_diff AS (
+    SELECT
+        town_id,
+        date_trunc('month', birth_date)::date AS birth_month,
+        -1 AS population
+    FROM citizens
+    WHERE import_id = $1 AND citizen_id = $2
+    UNION ALL
+    SELECT town_id, date_trunc('month', birth_date)::date, 1
+    FROM citizen
+),
+town_birth_months_updated AS (
+    INSERT INTO town_birth_months (import_id, town_id, birth_month, population)
+    SELECT $1, town_id, birth_month, sum(population)
+    FROM town_birth_months_diff
+    GROUP BY town_id, birth_month
+    HAVING sum(population) != 0
+    ON CONFLICT (import_id, town_id, birth_month) DO UPDATE
+    SET population = town_birth_months.population + excluded.population
+),
+generation_updated AS (
+    UPDATE imports SET generation = generation + 1
+    WHERE import_id = $1 AND EXISTS (SELECT 1 FROM citizen)
+),
+town_deleted AS (
+    DELETE FROM towns USING previous, citizen
+    WHERE
+        towns.town_id = previous.town_id AND
+        previous.town_id != citizen.town_id AND
+        NOT EXISTS (
+            SELECT 1 FROM citizens
+            WHERE
+                import_id = $1 AND town_id = towns.town_id AND
+                citizen_id != $2
+        )
+),
+street_deleted AS (
+    DELETE FROM streets USING previous, citizen
+    WHERE
+        streets.street_id = previous.street_id AND
+        previous.street_id != citizen.street_id AND
+        NOT EXISTS (
+            SELECT 1 FROM citizens
+            WHERE
+                import_id = $1 AND street_id = streets.street_id AND
+                citizen_id != $2
+        )
+),
+building_deleted AS (
+    DELETE FROM buildings USING previous, citizen
+    WHERE
+        buildings.building_id = previous.building_id AND
+        previous.building_id != citizen.building_id AND
+        NOT EXISTS (
+            SELECT 1 FROM citizens
+            WHERE
+                import_id = $1 AND building_id = buildings.building_id AND
+                citizen_id != $2
+        )
+)
+SELECT
+    citizen.citizen_id, citizen.name, citizen.birth_date, citizen.gender,
+    -- Добавленные значения словарей не видны запросу, но совпадают с
+    -- аргументами
+    COALESCE(
+        $6::varchar,
+        (SELECT name FROM towns WHERE town_id = citizen.town_id)
+    ) AS town,
+    COALESCE(
+        $7::varchar,
+        (SELECT name FROM streets WHERE street_id = citizen.street_id)
+    ) AS street,
+    COALESCE(
+        $8::varchar,
+        (SELECT name FROM buildings WHERE building_id = citizen.building_id)
+    ) AS building,
+    citizen.apartment,
+    COALESCE(
+        $10::integer[],
+        ARRAY(SELECT relative_id FROM current_relatives)
+    ) AS relatives
+FROM citizen
+'''
+
+# Обновляет нескольких жителей и их родственные связи за один запрос к БД,
+# возвращает кол-во найденных жителей (found) и жителей, для которых может
+# измениться кол-во подарков (affected_citizen_ids): самих жителей, их старых и
+# новых родственников.
+#
+# Аргументы:
+# $1 - import_id, $2 - идентификаторы жителей,
+# $3...$9 - новые значения полей PATCH_CITIZEN_FIELDS (массивы той же длины,
+#           что и $2; NULL - поле не меняется),
+# $10, $11 - пары (citizen_id, relative_id) требуемых родственных связей,
+# $12 - идентификаторы жителей, у которых меняется список родственников.
+#
+# Таблица town_birth_months обновляется на разницу между старыми и новыми
+# городами и датами рождения жителей (town_birth_months_diff), поколение
+# выгрузки (imports.generation) увеличивается на 1. Словари выгрузки
+# обновляются так же, как в PATCH_CITIZEN_QUERY.
+#
+# Требуемые связи симметричны (см. PatchCitizensSchema.validate_relatives),
+# поэтому связь между жителями сохраняется, если ее требует хотя бы один из
+# них.
+PATCH_CITIZENS_QUERY = '''
+WITH found AS (
+    SELECT citizen_id, town_id, street_id, building_id FROM citizens
+    WHERE import_id = $1 AND citizen_id = ANY($2::integer[])
+),
+patches AS (
+    SELECT * FROM unnest(
+        $2::integer[], $3::varchar[], $4::gender[], $5::date[],
+        $6::varchar[], $7::varchar[], $8::varchar[], $9::integer[]
+    ) AS patch(
+        citizen_id, name, gender, birth_date, town, street, building,
+        apartment
+    )
+    WHERE citizen_id IN (SELECT citizen_id FROM found)
+),
+town_inserted AS (
+    INSERT INTO towns (import_id, name)
+    SELECT DISTINCT $1::integer, town FROM patches
+    WHERE town IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM towns WHERE import_id = $1 AND name = patches.town
+    )
+    RETURNING town_id, name
+),
+street_inserted AS (
+    INSERT INTO streets (import_id, name)
+    SELECT DISTINCT $1::integer, street FROM patches
+    WHERE street IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM streets WHERE import_id = $1 AND name = patches.street
+    )
+    RETURNING street_id, name
+),
+building_inserted AS (
+    INSERT INTO buildings (import_id, name)
+    SELECT DISTINCT $1::integer, building FROM patches
+    WHERE building IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM buildings
+        WHERE import_id = $1 AND name = patches.building
+    )
+    RETURNING building_id, name
+),
+town AS (
+    SELECT town_id, name FROM town_inserted
+    UNION ALL
+    SELECT town_id, name FROM towns
+    WHERE import_id = $1 AND name IN (SELECT town FROM patches)
+),
+street AS (
+    SELECT street_id, name FROM street_inserted
+    UNION ALL
+    SELECT street_id, name FROM streets
+    WHERE import_id = $1 AND name IN (SELECT street FROM patches)
+),
+building AS (
+    SELECT building_id, name FROM building_inserted
+    UNION ALL
+    SELECT building_id, name FROM buildings
+    WHERE import_id = $1 AND name IN (SELECT building FROM patches)
+),
+changes AS (
+    SELECT
+        patches.citizen_id, patches.name, patches.gender,
+        patches.birth_date, town.town_id, street.street_id,
+        building.building_id, patches.apartment
+    FROM patches
+    LEFT JOIN town ON town.name = patches.town
+    LEFT JOIN street ON street.name = patches.street
+    LEFT JOIN building ON building.name = patches.building
+),
+updated AS (
+    UPDATE citizens SET
+        name = COALESCE(changes.name, citizens.name),
+        gender = COALESCE(changes.gender, citizens.gender),
+        birth_date = COALESCE(changes.birth_date, citizens.birth_date),
+        town_id = COALESCE(changes.town_id, citizens.town_id),
+        street_id = COALESCE(changes.street_id, citizens.street_id),
+        building_id = COALESCE(changes.building_id, citizens.building_id),
+        apartment = COALESCE(changes.apartment, citizens.apartment)
+    FROM changes
+    WHERE
+        citizens.import_id = $1 AND
+        citizens.citizen_id = changes.citizen_id AND
+        num_nonnulls(
+            changes.name, changes.gender, changes.birth_date, changes.town_id,
+            changes.street_id, changes.building_id, changes.apartment
+        ) > 0
+    RETURNING
+        citizens.citizen_id, citizens.town_id, citizens.street_id,
+        citizens.building_id, citizens.birth_date
+),
+town_birth_months_diff AS (
+    SELECT
+        town_id,
+        date_trunc('month', birth_date)::date AS birth_month,
+        -1 AS population
+    FROM citizens
+    WHERE
+        import_id = $1 AND
+        citizen_id IN (SELECT citizen_id FROM updated)
+    UNION ALL
+    SELECT town_id, date_trunc('month', birth_date)::date, 1
+    FROM updated
+),
+town_birth_months_updated AS (
+    INSERT INTO town_birth_months (import_id, town_id, birth_month, population)
+    SELECT $1, town_id, birth_month, sum(population)
+    FROM town_birth_months_diff
+    GROUP BY town_id, birth_month
+    HAVING sum(population) != 0
+    ON CONFLICT (import_id, town_id, birth_month) DO UPDATE
+    SET population = town_birth_months.population + excluded.population
+),
+generation_updated AS (
+    UPDATE imports SET generation = generation + 1 WHERE import_id = $1
+),
+town_deleted AS (
+    DELETE FROM towns
+    WHERE
+        town_id IN (
+            SELECT town_id FROM found
+            WHERE citizen_id IN (SELECT citizen_id FROM updated)
+            EXCEPT
+            SELECT town_id FROM updated
+        ) AND
+        NOT EXISTS (
+            SELECT 1 FROM citizens
+            WHERE
+                import_id = $1 AND town_id = towns.town_id AND
+                citizen_id NOT IN (SELECT citizen_id FROM updated)
+        )
+),
+street_deleted AS (
+    DELETE FROM streets
+    WHERE
+        street_id IN (
+            SELECT street_id FROM found
+            WHERE citizen_id IN (SELECT citizen_id FROM updated)
+            EXCEPT
+            SELECT street_id FROM updated
+        ) AND
+        NOT EXISTS (
+            SELECT 1 FROM citizens
+            WHERE
+                import_id = $1 AND street_id = streets.street_id AND
+                citizen_id NOT IN (SELECT citizen_id FROM updated)
+        )
+),
+building_deleted AS (
+    DELETE FROM buildings
+    WHERE
+        building_id IN (
+            SELECT building_id FROM found
+            WHERE citizen_id IN (SELECT citizen_id FROM updated)
+            EXCEPT
+            SELECT building_id FROM updated
+        ) AND
+        NOT EXISTS (
+            SELECT 1 FROM citizens
+            WHERE
+                import_id = $1 AND building_id = buildings.building_id AND
+                citizen_id NOT IN (SELECT citizen_id FROM updated)
+        )
+),
+requested_relations AS (
+    SELECT citizen_id, relative_id
+    FROM unnest($10::integer[], $11::integer[])
+        AS relation(citizen_id, relative_id)
+    -- Связи добавляются только для существующих жителей
+    WHERE citizen_id IN (SELECT citizen_id FROM found)
+),
+required_relations AS (
+    SELECT citizen_id, relative_id FROM requested_relations
+    UNION
+    SELECT relative_id, citizen_id FROM requested_relations
+),
+deleted AS (
+    DELETE FROM relations
+    WHERE
+        import_id = $1 AND
+        (citizen_id = ANY($12::integer[]) OR
+         relative_id = ANY($12::integer[])) AND
+        (citizen_id, relative_id) NOT IN (
+            SELECT citizen_id, relative_id FROM required_relations
+        )
+),
+inserted AS (
+    INSERT INTO relations (import_id, citizen_id, relative_id)
+    SELECT $1, citizen_id, relative_id FROM required_relations
+    ON CONFLICT DO NOTHING
 )
+SELECT
+    (SELECT count(*) FROM found) AS found,
+    ARRAY(
+        SELECT citizen_id FROM found
+        UNION
+        SELECT relative_id FROM relations
+        WHERE
+            import_id = $1 AND
+            citizen_id IN (SELECT citizen_id FROM found)
+        UNION
+        SELECT relative_id FROM requested_relations
+    ) AS affected_citizen_ids
+'''
+
+# Строит весь ответ обработчика CitizenBirthdaysView в виде JSON-документа
+# (все 12 месяцев, включая месяцы без подарков) на стороне PostgreSQL.
+# Аргументы: $1 - import_id.
+BIRTHDAYS_JSON_QUERY = '''
+SELECT json_build_object('data', json_object_agg(
+    months.month, COALESCE(presents.citizens, '[]'::json) ORDER BY months.month
+))::text
+FROM generate_series(1, 12) AS months(month)
+LEFT JOIN (
+    SELECT month, json_agg(json_build_object(
+        'citizen_id', citizen_id, 'presents', presents
+    )) AS citizens
+    FROM presents
+    WHERE import_id = $1 AND presents > 0
+    GROUP BY month
+) AS presents ON presents.month = months.month
+'''
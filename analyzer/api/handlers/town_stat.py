@@ -1,39 +1,268 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date
+from functools import partial
 from http import HTTPStatus
+from itertools import accumulate
+from operator import mul
+from typing import List, Sequence
 
+from aiohttp.web_exceptions import HTTPNotFound
 from aiohttp.web_response import Response
-from aiohttp_apispec import docs, response_schema
-from sqlalchemy import func, select, text
+from aiohttp_apispec import docs, querystring_schema, response_schema
+from asyncpgsa import PG
+from sqlalchemy import (
+    Date, Float, bindparam, cast, func, literal, select, text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql import Select
 
-from analyzer.api.schema import TownAgeStatResponseSchema
-from analyzer.db.schema import citizens_table
-from analyzer.utils.pg import rounded
+from analyzer.api.schema import (
+    TOWN_AGE_PERCENTILES, TownAgeStatQuerySchema, TownAgeStatResponseSchema,
+    percentile_name,
+)
+from analyzer.db.schema import (
+    citizens_table, imports_table, town_birth_months_table, towns_table,
+)
+from analyzer.utils.pg import round_half_up
 
 from .base import BaseImportView
 
 
+# Возраст жителей при приблизительном расчете определяется по первому дню
+# месяца рождения, поэтому может превышать точный не более чем на 1 год (для
+# жителей, родившихся в текущем месяце).
+APPROXIMATE_ERROR_BOUND = 1.0
+
+
+def weighted_percentile(ages: List[int], counts: List[int],
+                        percentile: float) -> float:
+    """
+    Рассчитывает перцентиль (с линейной интерполяцией, как percentile_cont)
+    по отсортированным возрастам и кол-ву жителей каждого возраста.
+    """
+    bounds = list(accumulate(counts))
+    position = (bounds[-1] - 1) * percentile
+    lower = int(position)
+    lower_age = ages[bisect_right(bounds, lower)]
+    if lower == position:
+        return lower_age
+    upper_age = ages[bisect_right(bounds, lower + 1)]
+    return lower_age + (upper_age - lower_age) * (position - lower)
+
+
+def make_town_stat(town: str, percentiles: Sequence[float],
+                   values: Sequence[float], statistics: dict) -> dict:
+    """
+    Формирует статистику города для ответа: перцентили и среднее значение
+    округляются до 2 знаков.
+    """
+    stat = {'town': town}
+    for percentile, value in zip(percentiles, values):
+        stat[percentile_name(percentile)] = round_half_up(value)
+    for name, value in statistics.items():
+        if name == 'count':
+            stat[name] = int(value)
+        elif name == 'mean':
+            stat[name] = round_half_up(value)
+        else:
+            stat[name] = float(value)
+    return stat
+
+
 class TownAgeStatView(BaseImportView):
     URL_PATH = r'/imports/{import_id:\d+}/towns/stat/percentile/age'
     CURRENT_DATE = text("TIMEZONE('utc', CURRENT_TIMESTAMP)")
 
-    @docs(summary='Статистика возрастов жителей по городам')
-    @response_schema(TownAgeStatResponseSchema(), code=HTTPStatus.OK.value)
-    async def get(self):
-        await self.check_import_exists()
+    @staticmethod
+    def today_param(today: date):
+        return bindparam('today', today, type_=Date)
 
-        age = func.age(self.CURRENT_DATE, citizens_table.c.birth_date)
+    @classmethod
+    def exact_query(cls, import_id: int, today: date,
+                    percentiles: Sequence[float] = TOWN_AGE_PERCENTILES,
+                    statistics: Sequence[str] = ()) -> Select:
+        """
+        Рассчитывает перцентили и статистики возрастов (на дату today) по всем
+        жителям выгрузки за один проход: все перцентили рассчитываются одним
+        агрегатом percentile_cont(ARRAY[...]), поэтому возрасты жителей
+        каждого города сортируются один раз.
+        """
+        age = func.age(cls.today_param(today), citizens_table.c.birth_date)
         age = func.date_part('year', age)
-        query = select([
-            citizens_table.c.town,
-            rounded(func.percentile_cont(0.5).within_group(age)).label('p50'),
-            rounded(func.percentile_cont(0.75).within_group(age)).label('p75'),
-            rounded(func.percentile_cont(0.99).within_group(age)).label('p99')
+        fractions = cast(
+            literal([percentile / 100 for percentile in percentiles],
+                    ARRAY(Float)),
+            ARRAY(Float)
+        )
+        aggregates = {
+            'mean': func.avg(age),
+            'min': func.min(age),
+            'max': func.max(age),
+            'count': func.count(),
+        }
+        # Жители группируются по идентификатору города, названия городов
+        # добавляются к уже рассчитанной статистике.
+        stats = select([
+            citizens_table.c.town_id,
+            func.percentile_cont(fractions).within_group(age)
+            .label('percentiles'),
+            *[aggregates[name].label(name) for name in statistics]
+        ]).group_by(
+            citizens_table.c.town_id
+        ).where(
+            citizens_table.c.import_id == import_id
+        ).alias('stats')
+        return select([
+            towns_table.c.name.label('town'),
+            stats.c.percentiles,
+            *[stats.c[name] for name in statistics]
         ]).select_from(
-            citizens_table
-        ).group_by(
-            citizens_table.c.town
+            stats.join(towns_table,
+                       towns_table.c.town_id == stats.c.town_id)
+        )
+
+    @staticmethod
+    def exact_stats(rows,
+                    percentiles: Sequence[float] = TOWN_AGE_PERCENTILES,
+                    statistics: Sequence[str] = ()) -> List[dict]:
+        return [
+            make_town_stat(
+                row['town'], percentiles, row['percentiles'],
+                {name: row[name] for name in statistics}
+            )
+            for row in rows
+        ]
+
+    @classmethod
+    def approximate_query(cls, import_id: int, today: date) -> Select:
+        """
+        Возвращает кол-во жителей каждого возраста (на дату today) по городам,
+        рассчитанное по таблице town_birth_months (без чтения жителей
+        выгрузки).
+        """
+        age = func.age(cls.today_param(today),
+                       town_birth_months_table.c.birth_month)
+        age = func.date_part('year', age).label('age')
+        return select([
+            towns_table.c.name.label('town'),
+            age,
+            func.sum(town_birth_months_table.c.population).label('population')
+        ]).select_from(
+            town_birth_months_table.join(
+                towns_table,
+                towns_table.c.town_id == town_birth_months_table.c.town_id
+            )
+        ).where(
+            town_birth_months_table.c.import_id == import_id
         ).where(
-            citizens_table.c.import_id == self.import_id
+            town_birth_months_table.c.population > 0
+        ).group_by(
+            towns_table.c.town_id,
+            age
+        ).order_by(
+            towns_table.c.town_id,
+            age
+        )
+
+    @staticmethod
+    def approximate_stats(
+            rows,
+            percentiles: Sequence[float] = TOWN_AGE_PERCENTILES,
+            statistics: Sequence[str] = ()
+    ) -> List[dict]:
+        towns = defaultdict(lambda: ([], []))
+        for row in rows:
+            ages, counts = towns[row['town']]
+            ages.append(row['age'])
+            counts.append(row['population'])
+
+        result = []
+        for town, (ages, counts) in towns.items():
+            count = sum(counts)
+            aggregates = {
+                'mean': sum(map(mul, ages, counts)) / count,
+                'min': ages[0],
+                'max': ages[-1],
+                'count': count,
+            }
+            result.append(make_town_stat(
+                town, percentiles,
+                [
+                    weighted_percentile(ages, counts, percentile / 100)
+                    for percentile in percentiles
+                ],
+                {name: aggregates[name] for name in statistics}
+            ))
+        return result
+
+    async def calculate(self, pg: PG, approximate: bool, generation: int,
+                        today: date, percentiles: Sequence[float],
+                        statistics: Sequence[str]) -> List[dict]:
+        if approximate:
+            rows = await pg.fetch(
+                self.approximate_query(self.import_id, today),
+                timeout=self.query_timeout()
+            )
+            return self.approximate_stats(rows, percentiles, statistics)
+
+        if self.analytics is not None:
+            stats = await self.analytics.town_age_stat(
+                self.import_id, generation, today,
+                [percentile / 100 for percentile in percentiles], statistics
+            )
+            return [
+                make_town_stat(town, percentiles, values, aggregates)
+                for town, values, aggregates in stats
+            ]
+
+        rows = await pg.fetch(
+            self.exact_query(self.import_id, today, percentiles, statistics),
+            timeout=self.query_timeout()
+        )
+        return self.exact_stats(rows, percentiles, statistics)
+
+    @docs(summary='Статистика возрастов жителей по городам')
+    @querystring_schema(TownAgeStatQuerySchema())
+    @response_schema(TownAgeStatResponseSchema(), code=HTTPStatus.OK.value)
+    async def get(self):
+        # Статистика зависит только от поколения выгрузки и текущей даты,
+        # которые получаются одним запросом с проверкой существования выгрузки.
+        # Все способы расчета (в т.ч. аналитический движок) используют эту
+        # дату, а не определяют текущую дату повторно: иначе около полуночи
+        # возраст и версия записи в кэше могут рассчитываться на разные даты.
+        query = select([
+            imports_table.c.generation,
+            cast(self.CURRENT_DATE, Date).label('today')
+        ]).where(
+            imports_table.c.import_id == self.import_id
         )
+        pg = await self.read_pg()
+        row = await pg.fetchrow(query, timeout=self.query_timeout())
+        if row is None:
+            raise HTTPNotFound()
+
+        params = self.request['querystring']
+        approximate = bool(params.get('approximate'))
+        # Порядок перцентилей и статистик в запросе не важен, поэтому они
+        # сортируются, чтобы одинаковые запросы использовали одну запись кэша.
+        percentiles = tuple(sorted(set(
+            params.get('percentiles', TOWN_AGE_PERCENTILES)
+        )))
+        statistics = tuple(sorted(set(params.get('statistics', ()))))
+        calculate = partial(self.calculate, pg, approximate,
+                            row['generation'], row['today'], percentiles,
+                            statistics)
+        if self.town_stat_cache is None:
+            stats = await calculate()
+        else:
+            stats = await self.town_stat_cache.get(
+                (self.import_id, approximate, percentiles, statistics),
+                (row['generation'], row['today']),
+                calculate
+            )
 
-        stats = await self.pg.fetch(query)
-        return Response(body={'data': stats})
+        body = {'data': stats}
+        if approximate:
+            body['error_bound'] = APPROXIMATE_ERROR_BOUND
+        return Response(body=body)
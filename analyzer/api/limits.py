@@ -0,0 +1,132 @@
+"""
+Ограничение нагрузки на REST API сервис.
+
+Запросы делятся на классы: загрузка выгрузок, изменение жителей и чтение.
+Для каждого класса ограничивается кол-во одновременно обрабатываемых запросов,
+для запросов с телом - также суммарный размер тел обрабатываемых запросов.
+Поэтому поток больших выгрузок не влияет на время обработки чтения.
+
+Запрос, для которого не освободилось место за отведенное время, отклоняется
+с ответом 503 Service Unavailable и заголовком Retry-After.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+from aiohttp.web_app import Application
+from configargparse import Namespace
+
+
+log = logging.getLogger(__name__)
+
+# Класс запроса определяется HTTP-методом
+REQUEST_CLASSES = {
+    'POST': 'imports',
+    'PATCH': 'patches',
+    'GET': 'reads',
+    'HEAD': 'reads',
+}
+
+
+class Limiter:
+    """
+    Выдает единицы ограниченного ресурса (обработчиков, байт) в порядке
+    очереди: запрос, ожидающий большого кол-ва единиц, не пропускается
+    запросами, пришедшими позже.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        # Ожидающие запросы: (кол-во единиц, future)
+        self.waiters = deque()
+
+    async def acquire(self, amount: int, timeout: float) -> bool:
+        """
+        Возвращает False, если за timeout секунд необходимое кол-во единиц
+        не освободилось.
+        """
+        # Запрос, которому нужно больше единиц, чем есть всего, выполняется,
+        # когда ресурс свободен полностью.
+        amount = min(amount, self.limit)
+        if not self.waiters and self.used + amount <= self.limit:
+            self.used += amount
+            return True
+
+        waiter = (amount, asyncio.get_event_loop().create_future())
+        self.waiters.append(waiter)
+        try:
+            # asyncio.wait, в отличие от asyncio.wait_for, не отменяет future
+            # по истечении времени: единицы могли быть выделены одновременно.
+            await asyncio.wait((waiter[1], ), timeout=timeout)
+        except asyncio.CancelledError:
+            self.cancel(waiter)
+            raise
+
+        if waiter[1].done():
+            return True
+
+        self.cancel(waiter)
+        return False
+
+    def cancel(self, waiter):
+        if waiter[1].done():
+            self.release(waiter[0])
+            return
+
+        waiter[1].cancel()
+        self.waiters.remove(waiter)
+        # Ожидающий запрос мог блокировать запросы за ним в очереди
+        self.wakeup()
+
+    def release(self, amount: int):
+        self.used -= min(amount, self.limit)
+        self.wakeup()
+
+    def wakeup(self):
+        while self.waiters:
+            amount, future = self.waiters[0]
+            if self.used + amount > self.limit:
+                break
+            self.waiters.popleft()
+            self.used += amount
+            future.set_result(None)
+
+
+class RequestLimits:
+    def __init__(self, concurrency: Dict[str, int], body_size: int,
+                 queue_timeout: float, retry_after: int):
+        # Ограничения 0 отключены
+        self.concurrency = {
+            request_class: Limiter(limit)
+            for request_class, limit in concurrency.items() if limit
+        }
+        self.body_size = Limiter(body_size) if body_size else None
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+    def get_concurrency(self, method: str) -> Optional[Limiter]:
+        return self.concurrency.get(REQUEST_CLASSES.get(method))
+
+
+async def setup_limits(app: Application, args: Namespace):
+    """
+    Создает ограничения нагрузки (в цикле событий, в котором работает
+    приложение).
+    """
+    app['limits'] = RequestLimits(
+        concurrency={
+            'imports': args.limit_imports,
+            'patches': args.limit_patches,
+            'reads': args.limit_reads,
+        },
+        body_size=args.limit_body_size,
+        queue_timeout=args.limit_queue_timeout,
+        retry_after=args.limit_retry_after
+    )
+    log.info('Concurrency limits: %d imports, %d patches, %d reads '
+             '(0 is unlimited), request bodies: %d bytes',
+             args.limit_imports, args.limit_patches, args.limit_reads,
+             args.limit_body_size)
+    yield
@@ -0,0 +1,102 @@
+"""
+Мониторинг задержек цикла событий.
+
+Синхронная работа в обработчиках (валидация больших выгрузок, сериализация
+больших ответов и т.п.) блокирует цикл событий и задерживает обработку всех
+остальных запросов процесса.
+
+Фоновая задача просыпается каждые --loop-monitor-interval секунд и
+записывает в метрику, насколько позже запланированного времени она была
+запущена. Поток-наблюдатель проверяет, что задача регулярно просыпается: если
+цикл событий заблокирован дольше --loop-block-threshold секунд, в лог
+записывается стек потока цикла событий в этот момент, т.е. стек кода,
+блокирующего цикл.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import traceback
+from time import monotonic
+
+from aiohttp.web_app import Application
+from configargparse import Namespace
+
+from analyzer.api.metrics import LOOP_BLOCKS, LOOP_LAG
+
+
+log = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    def __init__(self, interval: float, block_threshold: float):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        # Поток, в котором работает цикл событий
+        self.thread_id = threading.get_ident()
+        # Время последнего пробуждения задачи measure_lag
+        self.heartbeat = monotonic()
+        self.stopped = threading.Event()
+
+    async def measure_lag(self):
+        while True:
+            started = monotonic()
+            await asyncio.sleep(self.interval)
+            self.heartbeat = monotonic()
+            LOOP_LAG.observe(max(self.heartbeat - started - self.interval, 0))
+
+    def watch(self):
+        """
+        Проверяет, что цикл событий не заблокирован. Выполняется в отдельном
+        потоке до вызова stop.
+        """
+        # Каждая блокировка записывается в лог один раз
+        reported = None
+        while not self.stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            blocked = monotonic() - heartbeat - self.interval
+            if blocked < self.block_threshold or reported == heartbeat:
+                continue
+
+            reported = heartbeat
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            LOOP_BLOCKS.inc()
+            log.warning('Event loop is blocked for %.3fs, stack:\n%s',
+                        blocked, ''.join(traceback.format_stack(frame)))
+            # Ссылка на кадр удерживает все его локальные переменные
+            del frame
+
+    def stop(self):
+        self.stopped.set()
+
+
+async def setup_loop_monitor(app: Application, args: Namespace):
+    """
+    Запускает мониторинг задержек цикла событий, если он включен в настройках
+    приложения.
+    """
+    if not args.loop_monitor_interval:
+        yield
+        return
+
+    monitor = LoopMonitor(args.loop_monitor_interval,
+                          args.loop_block_threshold)
+    task = asyncio.ensure_future(monitor.measure_lag())
+
+    watcher = None
+    if args.loop_block_threshold:
+        watcher = threading.Thread(target=monitor.watch,
+                                   name='loop-monitor', daemon=True)
+        watcher.start()
+
+    try:
+        yield
+    finally:
+        monitor.stop()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if watcher is not None:
+            watcher.join()
@@ -0,0 +1,303 @@
+"""
+Метрики REST API сервиса в формате Prometheus (text exposition format):
+https://prometheus.io/docs/instrumenting/exposition_formats/
+
+Метрики хранятся в памяти процесса и отдаются обработчиком MetricsView. При
+запуске в нескольких процессах (--workers) каждый процесс отдает свои метрики.
+"""
+import logging
+from bisect import bisect_left
+from math import inf
+from typing import List, Sequence
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, inf
+)
+SIZE_BUCKETS = tuple(1024 ** 2 * 2 ** i for i in range(-6, 8)) + (inf,)
+LAG_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, inf
+)
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, escape(str(value)))
+        for name, value in zip(names, values)
+    )
+
+
+def format_value(value: float) -> str:
+    if value == inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: 'Metric'):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.render())
+        lines.append('')
+        return '\n'.join(lines)
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Значения метрики для каждого набора значений меток
+        self.values = {}
+        registry.register(self)
+
+    def new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError('Expected labels: %r' % (self.labelnames, ))
+        value = self.values.get(labelvalues)
+        if value is None:
+            value = self.values[labelvalues] = self.new_value()
+        return value
+
+    def render(self) -> List[str]:
+        return [
+            '%s%s %s' % (self.name, format_labels(self.labelnames, labels),
+                         format_value(value.value))
+            for labels, value in self.values.items()
+        ]
+
+
+class CounterValue:
+    __slots__ = ('value', )
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(Metric):
+    type = 'counter'
+    new_value = CounterValue
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class GaugeValue:
+    __slots__ = ('value', )
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+    new_value = GaugeValue
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+
+class HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        if buckets[-1] != inf:
+            buckets = tuple(buckets) + (inf, )
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        labelnames = self.labelnames + ('le', )
+        for labels, value in self.values.items():
+            total = 0
+            for bucket, count in zip(self.buckets, value.counts):
+                total += count
+                bucket_labels = labels + (format_value(bucket), )
+                lines.append('%s_bucket%s %d' % (
+                    self.name, format_labels(labelnames, bucket_labels), total
+                ))
+            labels = format_labels(self.labelnames, labels)
+            lines.append('%s_sum%s %s' % (self.name, labels,
+                                          format_value(value.sum)))
+            lines.append('%s_count%s %d' % (self.name, labels, total))
+        return lines
+
+
+REQUESTS = Counter(
+    'analyzer_http_requests_total', 'Total HTTP requests processed',
+    ('handler', 'method', 'status')
+)
+REQUEST_DURATION = Histogram(
+    'analyzer_http_request_duration_seconds',
+    'Time spent processing HTTP request (including streamed response body)',
+    ('handler', 'method')
+)
+REQUESTS_SHED = Counter(
+    'analyzer_http_requests_shed_total',
+    'HTTP requests rejected with 503 due to concurrency limits',
+    ('request_class', )
+)
+REQUESTS_CANCELLED = Counter(
+    'analyzer_http_requests_cancelled_total',
+    'HTTP requests cancelled because client disconnected',
+    ('handler', )
+)
+DEADLINES_EXCEEDED = Counter(
+    'analyzer_http_deadlines_exceeded_total',
+    'HTTP requests not processed within deadline', ('handler', )
+)
+IN_PROGRESS = Gauge(
+    'analyzer_http_requests_in_progress', 'HTTP requests being processed'
+)
+STREAMED_BYTES = Counter(
+    'analyzer_streamed_bytes_total',
+    'Bytes of response bodies streamed from database cursors'
+)
+STREAMS_ABORTED = Counter(
+    'analyzer_streams_aborted_total',
+    'Streamed response bodies aborted because client disconnected '
+    '(cancelled) or request deadline exceeded (deadline)', ('reason', )
+)
+STREAM_DURATION = Histogram(
+    'analyzer_stream_duration_seconds',
+    'Time spent fetching, serializing and sending streamed response bodies'
+)
+STREAM_SIZE = Histogram(
+    'analyzer_stream_size_bytes', 'Size of streamed response bodies',
+    buckets=SIZE_BUCKETS
+)
+PG_POOL_SIZE = Gauge(
+    'analyzer_pg_pool_size', 'Open PostgreSQL connections in pool'
+)
+PG_POOL_IDLE = Gauge(
+    'analyzer_pg_pool_idle', 'Open PostgreSQL connections not in use'
+)
+PG_POOL_WAITING = Gauge(
+    'analyzer_pg_pool_waiting',
+    'Coroutines waiting for PostgreSQL connection from pool'
+)
+PG_POOL_MAX_SIZE = Gauge(
+    'analyzer_pg_pool_max_size', 'Maximum PostgreSQL connections in pool'
+)
+
+LOOP_LAG = Histogram(
+    'analyzer_event_loop_lag_seconds',
+    'Delay of event loop monitor wakeups relative to schedule',
+    buckets=LAG_BUCKETS
+)
+LOOP_BLOCKS = Counter(
+    'analyzer_event_loop_blocks_total',
+    'Times event loop was blocked longer than --loop-block-threshold'
+)
+
+
+def pool_waiting(pool) -> int:
+    return sum(
+        1 for waiter in getattr(pool._queue, '_getters', ())
+        if not waiter.done()
+    )
+
+
+def pool_size(pool) -> int:
+    return sum(1 for holder in pool._holders if holder._con is not None)
+
+
+def pool_idle_size(pool) -> int:
+    return pool_size(pool) - sum(
+        1 for holder in pool._holders if holder._in_use is not None
+    )
+
+
+# Метрика, публичный метод пула asyncpg (asyncpg 0.25+) и функция расчета
+# значения по внутреннему состоянию пула (для более старых версий)
+POOL_STATS = (
+    (PG_POOL_SIZE, 'get_size', pool_size),
+    (PG_POOL_IDLE, 'get_idle_size', pool_idle_size),
+    (PG_POOL_MAX_SIZE, 'get_max_size', lambda pool: pool._maxsize),
+    (PG_POOL_WAITING, None, pool_waiting),
+)
+
+
+def collect_pool_stats(pool):
+    """
+    Обновляет метрики пула соединений asyncpg. Значения, для которых в
+    установленной версии asyncpg нет публичных методов (в т.ч. кол-во
+    ожидающих соединения корутин), рассчитываются по внутреннему состоянию
+    пула. Если оно устроено иначе, метрика не обновляется.
+    """
+    for gauge, method, fallback in POOL_STATS:
+        if method is not None and hasattr(pool, method):
+            gauge.set(getattr(pool, method)())
+            continue
+
+        try:
+            gauge.set(fallback(pool))
+        except AttributeError:
+            log.debug('Unable to collect %s from asyncpg pool', gauge.name)
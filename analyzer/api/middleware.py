@@ -1,22 +1,38 @@
+import asyncio
 import logging
 from http import HTTPStatus
+from time import monotonic
 from typing import Mapping, Optional
 
+from aiohttp.hdrs import TRANSFER_ENCODING
 from aiohttp.web_exceptions import (
-    HTTPBadRequest, HTTPException, HTTPInternalServerError,
+    HTTPBadRequest, HTTPException, HTTPGatewayTimeout,
+    HTTPInternalServerError, HTTPServiceUnavailable,
 )
 from aiohttp.web_middlewares import middleware
 from aiohttp.web_request import Request
+from aiohttp.web_response import Response
+from aiohttp_apispec import validation_middleware
+from asyncpg import QueryCanceledError
 from marshmallow import ValidationError
 
-from analyzer.api.payloads import JsonPayload
+from analyzer.api.docs import SWAGGER_PATH, SWAGGER_URL
+from analyzer.api.limits import REQUEST_CLASSES
+from analyzer.api.metrics import (
+    DEADLINES_EXCEEDED, IN_PROGRESS, REQUEST_DURATION, REQUESTS,
+    REQUESTS_CANCELLED, REQUESTS_SHED,
+)
+from analyzer.api.payloads import AsyncGenJSONListPayload, JsonPayload
+from analyzer.api.timing import Timings, current_timings
+from analyzer.utils.querylog import current_handler
 
 
 log = logging.getLogger(__name__)
 
 
 def format_http_error(http_error_cls, message: Optional[str] = None,
-                      fields: Optional[Mapping] = None) -> HTTPException:
+                      fields: Optional[Mapping] = None,
+                      headers: Optional[Mapping] = None) -> HTTPException:
     """
     Форматирует ошибку в виде HTTP исключения
     """
@@ -29,7 +45,17 @@ def format_http_error(http_error_cls, message: Optional[str] = None,
     if fields:
         error['fields'] = fields
 
-    return http_error_cls(body={'error': error})
+    return http_error_cls(body={'error': error}, headers=headers)
+
+
+def get_handler_name(request: Request) -> str:
+    """
+    Возвращает путь обработчика запроса (без регулярных выражений
+    параметров) для использования в метриках.
+    """
+    # Для запросов к несуществующим обработчикам route.resource равен None
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else 'unknown'
 
 
 def handle_validation_error(error: ValidationError, *_):
@@ -64,3 +90,199 @@ async def error_middleware(request: Request, handler):
         # HTTP ответа и могут случайно раскрыть внутреннюю информацию.
         log.exception('Unhandled exception')
         raise format_http_error(HTTPInternalServerError)
+
+
+@middleware
+async def metrics_middleware(request: Request, handler):
+    """
+    Считает кол-во и время обработки запросов для каждого обработчика.
+    Тело потоковых ответов (AsyncGenJSONListPayload) отправляется в
+    limits_middleware и входит во время обработки, а также учитывается
+    отдельными метриками.
+    """
+    name = get_handler_name(request)
+
+    IN_PROGRESS.inc()
+    started = monotonic()
+    status = HTTPStatus.INTERNAL_SERVER_ERROR
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except HTTPException as err:
+        status = err.status
+        raise
+    except asyncio.CancelledError:
+        # Клиент отключился, ответ не будет отправлен
+        status = None
+        REQUESTS_CANCELLED.labels(name).inc()
+        raise
+    finally:
+        IN_PROGRESS.dec()
+        if status is not None:
+            REQUEST_DURATION.labels(name, request.method).observe(
+                monotonic() - started
+            )
+            REQUESTS.labels(name, request.method, int(status)).inc()
+
+
+@middleware
+async def timing_middleware(request: Request, handler):
+    """
+    Создает разбивку времени обработки запроса для заголовка Server-Timing
+    (см. analyzer.api.timing). Заголовок добавляется перед отправкой ответа.
+    """
+    timings = request['timings'] = Timings()
+    token = current_timings.set(timings)
+    try:
+        return await handler(request)
+    finally:
+        current_timings.reset(token)
+
+
+@middleware
+async def timed_validation_middleware(request: Request, handler):
+    """
+    Выполняет validation_middleware aiohttp-apispec и учитывает время
+    валидации (до вызова обработчика) в заголовке Server-Timing.
+    """
+    timings = request['timings']
+    started = monotonic()
+    validated = False
+
+    async def handle(request: Request):
+        nonlocal validated
+        validated = True
+        timings.add('validation', monotonic() - started)
+        return await handler(request)
+
+    try:
+        return await validation_middleware(request, handle)
+    finally:
+        if not validated:
+            timings.add('validation', monotonic() - started)
+
+
+@middleware
+async def docs_middleware(request: Request, handler):
+    """
+    Строит спецификацию OpenAPI при первом запросе документации
+    (--api-docs=lazy, см. analyzer.api.docs).
+    """
+    if request.path in (SWAGGER_PATH, SWAGGER_URL):
+        request.app['docs'].build(request.app)
+    return await handler(request)
+
+
+@middleware
+async def query_log_middleware(request: Request, handler):
+    """
+    Сохраняет обработчик запроса в контексте для журнала запросов к
+    PostgreSQL (см. analyzer.utils.querylog).
+    """
+    token = current_handler.set(get_handler_name(request))
+    try:
+        return await handler(request)
+    finally:
+        current_handler.reset(token)
+
+
+async def send_streamed_response(request: Request, response: Response):
+    """
+    Отправляет ответ с потоковым телом (AsyncGenJSONListPayload) до выхода из
+    middleware. aiohttp не отправляет ответ повторно.
+    """
+    await response.prepare(request)
+    try:
+        await response.write_eof()
+    except BaseException:
+        # Заголовки ответа уже отправлены, сообщить клиенту об ошибке
+        # невозможно: соединение закрывается, чтобы клиент не принял
+        # неполное тело за ответ (ответ с ошибкой в закрытое соединение не
+        # отправляется).
+        if request.transport is not None:
+            request.transport.close()
+        raise
+
+
+@middleware
+async def limits_middleware(request: Request, handler):
+    """
+    Ограничивает кол-во одновременно обрабатываемых запросов каждого класса и
+    суммарный размер их тел (см. analyzer.api.limits). Должен выполняться до
+    чтения тела запроса. Ограничения удерживаются до отправки потоковых
+    ответов.
+    """
+    limits = request.app['limits']
+    deadline = monotonic() + limits.queue_timeout
+    required, acquired = [], []
+
+    concurrency = limits.get_concurrency(request.method)
+    if concurrency is not None:
+        required.append((concurrency, 1))
+
+    if limits.body_size is not None:
+        # Request.body_exists в aiohttp 3.6 истинно и для запросов без
+        # Content-Length (например, GET), поэтому тело определяется по
+        # заголовкам. Размер тела, передаваемого частями, неизвестен заранее
+        # - такой запрос обрабатывается, когда не обрабатываются другие тела.
+        size = request.content_length
+        encoding = request.headers.get(TRANSFER_ENCODING, '').lower()
+        if size is None and 'chunked' in encoding:
+            size = limits.body_size.limit
+        if size:
+            required.append((limits.body_size, size))
+
+    try:
+        for limiter, amount in required:
+            if not await limiter.acquire(amount, deadline - monotonic()):
+                REQUESTS_SHED.labels(
+                    REQUEST_CLASSES.get(request.method, 'other')
+                ).inc()
+                raise format_http_error(
+                    HTTPServiceUnavailable,
+                    headers={'Retry-After': str(limits.retry_after)}
+                )
+            acquired.append((limiter, amount))
+
+        response = await handler(request)
+        if isinstance(response, Response) and \
+                isinstance(response.body, AsyncGenJSONListPayload):
+            # Данные потоковых ответов получаются из PostgreSQL при отправке
+            # тела - она должна выполняться, пока удерживаются ограничения.
+            await send_streamed_response(request, response)
+        return response
+    finally:
+        for limiter, amount in acquired:
+            limiter.release(amount)
+
+
+@middleware
+async def deadline_middleware(request: Request, handler):
+    """
+    Ограничивает время обработки запроса сроком, настроенным для его класса
+    (см. analyzer.api.limits.REQUEST_CLASSES). Срок сохраняется в
+    request['deadline'] (по time.monotonic), обработчики передают оставшееся
+    время в запросы к PostgreSQL (см. BaseView.query_timeout).
+
+    По истечении срока обработчик отменяется (asyncpg при этом отменяет
+    выполняемый запрос в PostgreSQL), клиент получает ответ 504. При
+    отключении клиента обработчик отменяет aiohttp: задачу, в которой
+    обрабатывается запрос, отменяет RequestHandler.connection_lost (в
+    aiohttp 3.6, см. requirements.txt).
+    """
+    timeout = request.app['deadlines'].get(
+        REQUEST_CLASSES.get(request.method)
+    )
+    if not timeout:
+        return await handler(request)
+
+    request['deadline'] = monotonic() + timeout
+    try:
+        return await asyncio.wait_for(handler(request), timeout)
+    except (asyncio.TimeoutError, QueryCanceledError):
+        # QueryCanceledError - запрос остановлен PostgreSQL по истечении
+        # statement_timeout
+        DEADLINES_EXCEEDED.labels(get_handler_name(request)).inc()
+        raise format_http_error(HTTPGatewayTimeout,
+                                'Request deadline exceeded')
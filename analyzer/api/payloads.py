@@ -1,14 +1,20 @@
+import asyncio
 import json
 from datetime import date
 from decimal import Decimal
 from functools import partial, singledispatch
+from time import monotonic
 from typing import Any
 
 from aiohttp.payload import JsonPayload as BaseJsonPayload, Payload
 from aiohttp.typedefs import JSONEncoder
 from asyncpg import Record
 
+from analyzer.api.metrics import (
+    STREAM_DURATION, STREAM_SIZE, STREAMED_BYTES, STREAMS_ABORTED,
+)
 from analyzer.api.schema import BIRTH_DATE_FORMAT
+from analyzer.api.timing import measure
 
 
 @singledispatch
@@ -65,7 +71,10 @@ class JsonPayload(BaseJsonPayload):
                  dumps: JSONEncoder = dumps,
                  *args: Any,
                  **kwargs: Any) -> None:
-        super().__init__(value, encoding, content_type, dumps, *args, **kwargs)
+        # Данные сериализуются при создании объекта
+        with measure('serialization'):
+            super().__init__(value, encoding, content_type, dumps, *args,
+                             **kwargs)
 
 
 class AsyncGenJSONListPayload(Payload):
@@ -82,23 +91,40 @@ class AsyncGenJSONListPayload(Payload):
                          *args, **kwargs)
 
     async def write(self, writer):
+        started = monotonic()
         # Начало объекта
-        await writer.write(
-            ('{"%s":[' % self.root_object).encode(self._encoding)
-        )
-
-        first = True
-        async for row in self._value:
-            # Перед первой строчкой запятая не нужнаа
-            if not first:
-                await writer.write(b',')
-            else:
-                first = False
-
-            await writer.write(dumps(row).encode(self._encoding))
-
-        # Конец объекта
-        await writer.write(b']}')
+        chunk = ('{"%s":[' % self.root_object).encode(self._encoding)
+        await writer.write(chunk)
+        size = len(chunk)
+
+        try:
+            first = True
+            async for row in self._value:
+                # Перед первой строчкой запятая не нужнаа
+                if not first:
+                    chunk = b',' + dumps(row).encode(self._encoding)
+                else:
+                    chunk = dumps(row).encode(self._encoding)
+                    first = False
+
+                await writer.write(chunk)
+                size += len(chunk)
+
+            # Конец объекта
+            await writer.write(b']}')
+            size += 2
+        except asyncio.CancelledError:
+            STREAMS_ABORTED.labels('cancelled').inc()
+            raise
+        except asyncio.TimeoutError:
+            STREAMS_ABORTED.labels('deadline').inc()
+            raise
+        finally:
+            # Учитываются и прерванные ответы (например, если клиент
+            # отключился)
+            STREAMED_BYTES.inc(size)
+            STREAM_SIZE.observe(size)
+            STREAM_DURATION.observe(monotonic() - started)
 
 
 __all__ = (
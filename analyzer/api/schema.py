@@ -7,16 +7,35 @@
 Схемы валидации ответов *ResponseSchema используются только при тестировании,
 чтобы убедиться что обработчики возвращают данные в корректном формате.
 """
+import re
 from datetime import date
 
-from marshmallow import Schema, ValidationError, validates, validates_schema
-from marshmallow.fields import Date, Dict, Float, Int, List, Nested, Str
+from marshmallow import (
+    INCLUDE, Schema, ValidationError, validates, validates_schema,
+)
+from marshmallow.fields import (
+    Bool, Date, Dict, Float, Int, List, Nested, Str,
+)
 from marshmallow.validate import Length, OneOf, Range
 
 from analyzer.db.schema import Gender
 
 
 BIRTH_DATE_FORMAT = '%d.%m.%Y'
+TOWN_AGE_STATISTICS = ('mean', 'min', 'max', 'count')
+
+# Перцентили возрастов, которые рассчитываются, если клиент не указал другие
+TOWN_AGE_PERCENTILES = (50, 75, 99)
+
+# Поле с перцентилем в статистике возрастов (см. percentile_name)
+PERCENTILE_FIELD_RE = re.compile(r'^p\d+(\.\d+)?$')
+
+
+def percentile_name(percentile: float) -> str:
+    """
+    Название поля с перцентилем в ответе: 50 -> p50, 99.9 -> p99.9.
+    """
+    return 'p%g' % percentile
 
 
 class PatchCitizenSchema(Schema):
@@ -53,10 +72,10 @@ class CitizenSchema(PatchCitizenSchema):
     relatives = List(Int(validate=Range(min=0), strict=True), required=True)
 
 
-class ImportSchema(Schema):
-    citizens = Nested(CitizenSchema, many=True, required=True,
-                      validate=Length(max=10000))
-
+class CitizenListSchema(Schema):
+    """
+    Базовая схема запросов со списком жителей (поле citizens).
+    """
     @validates_schema
     def validate_unique_citizen_id(self, data, **_):
         citizen_ids = set()
@@ -67,6 +86,11 @@ class ImportSchema(Schema):
                 )
             citizen_ids.add(citizen['citizen_id'])
 
+
+class ImportSchema(CitizenListSchema):
+    citizens = Nested(CitizenSchema, many=True, required=True,
+                      validate=Length(max=10000))
+
     @validates_schema
     def validate_relatives(self, data, **_):
         relatives = {
@@ -83,6 +107,39 @@ class ImportSchema(Schema):
                     )
 
 
+class PatchCitizensItemSchema(PatchCitizenSchema):
+    citizen_id = Int(validate=Range(min=0), strict=True, required=True)
+
+
+class PatchCitizensSchema(CitizenListSchema):
+    citizens = Nested(PatchCitizensItemSchema, many=True, required=True,
+                      validate=Length(max=10000))
+
+    @validates_schema
+    def validate_relatives(self, data, **_):
+        """
+        Если в запросе меняются родственники двух жителей, связь между ними
+        должна быть указана у обоих (или не указана ни у одного), иначе
+        результат зависел бы от порядка применения изменений.
+        """
+        relatives = {
+            citizen['citizen_id']: set(citizen['relatives'])
+            for citizen in data['citizens']
+            if 'relatives' in citizen
+        }
+
+        for citizen_id, relative_ids in relatives.items():
+            for relative_id in relative_ids:
+                if relative_id not in relatives:
+                    continue
+
+                if citizen_id not in relatives[relative_id]:
+                    raise ValidationError(
+                        f'citizen {relative_id} does not have '
+                        f'relation with {citizen_id}'
+                    )
+
+
 class ImportIdSchema(Schema):
     import_id = Int(strict=True, required=True)
 
@@ -120,14 +177,78 @@ class CitizenPresentsResponseSchema(Schema):
 
 
 class TownAgeStatSchema(Schema):
+    """
+    Набор полей зависит от параметров запроса, которые передаются в контексте
+    схемы (ключи percentiles и statistics). Без параметров ожидаются
+    перцентили по умолчанию (p50, p75, p99).
+    """
+    class Meta:
+        # Перцентили возвращаются в полях pN, где N - запрошенный перцентиль,
+        # и проверяются в validate_percentiles (по исходным данным, т.к.
+        # marshmallow разбивает названия неизвестных полей с точкой, например
+        # p99.9, на вложенные словари).
+        unknown = INCLUDE
+
     town = Str(validate=Length(min=1, max=256), required=True)
-    p50 = Float(validate=Range(min=0), required=True)
-    p75 = Float(validate=Range(min=0), required=True)
-    p99 = Float(validate=Range(min=0), required=True)
+    mean = Float(validate=Range(min=0))
+    min = Float(validate=Range(min=0))
+    max = Float(validate=Range(min=0))
+    count = Int(validate=Range(min=1), strict=True)
+
+    @validates_schema(pass_original=True)
+    def validate_percentiles(self, data, original_data, **_):
+        percentiles = {
+            percentile_name(percentile)
+            for percentile in self.context.get('percentiles',
+                                               TOWN_AGE_PERCENTILES)
+        }
+        statistics = set(self.context.get('statistics', ()))
+
+        for name, value in original_data.items():
+            if name in self.declared_fields:
+                continue
+            if not PERCENTILE_FIELD_RE.match(name):
+                raise ValidationError('Unknown field', name)
+            if (
+                isinstance(value, bool) or
+                not isinstance(value, (int, float)) or
+                value < 0
+            ):
+                raise ValidationError('Must be non-negative number', name)
+
+        fields = {'town', *percentiles, *statistics}
+        missing = fields - original_data.keys()
+        if missing:
+            raise ValidationError(
+                'Missing fields: %s' % ', '.join(sorted(missing))
+            )
+        unexpected = original_data.keys() - fields
+        if unexpected:
+            raise ValidationError(
+                'Unexpected fields: %s' % ', '.join(sorted(unexpected))
+            )
+
+
+class TownAgeStatQuerySchema(Schema):
+    approximate = Bool()
+    percentiles = List(Float(validate=Range(min=0, max=100)),
+                       validate=Length(min=1, max=20))
+    statistics = List(Str(validate=OneOf(TOWN_AGE_STATISTICS)),
+                      validate=Length(min=1))
 
 
 class TownAgeStatResponseSchema(Schema):
-    data = Nested(TownAgeStatSchema(many=True), required=True)
+    data = Nested(TownAgeStatSchema, many=True, required=True)
+    # Максимальное отклонение перцентилей от точных значений (в годах),
+    # возвращается только для приблизительного расчета.
+    error_bound = Float(validate=Range(min=0))
+
+
+class ProfileQuerySchema(Schema):
+    # Длительность профилирования, секунд
+    seconds = Float(validate=Range(min=0.1, max=60), required=True)
+    # Интервал между выборками стека, миллисекунд
+    interval = Float(validate=Range(min=1, max=1000))
 
 
 class ErrorSchema(Schema):
@@ -0,0 +1,183 @@
+"""
+Разбивка времени обработки запроса для заголовка ответа Server-Timing:
+https://www.w3.org/TR/server-timing/
+
+Учитываются валидация запроса, ожидание соединения из пула PostgreSQL,
+выполнение запросов и сериализация ответа. Заголовок отправляется до тела
+потоковых ответов (AsyncGenJSONListPayload), поэтому получение и сериализация
+их данных не учитываются (см. метрики analyzer_stream_*).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+from typing import Optional
+
+from aiohttp.web_request import Request
+from aiohttp.web_response import StreamResponse
+from asyncpgsa import PG
+
+from analyzer.utils.pg import pool_acquired
+
+
+HEADER = 'Server-Timing'
+METRICS = ('validation', 'pool', 'db', 'serialization')
+
+# Разбивка времени обработки текущего запроса (устанавливается
+# timing_middleware)
+current_timings: ContextVar[Optional['Timings']] = ContextVar(
+    'current_timings', default=None
+)
+
+
+class Timings:
+    __slots__ = ('started', 'durations')
+
+    def __init__(self):
+        self.started = monotonic()
+        self.durations = dict.fromkeys(METRICS, 0.0)
+
+    def add(self, name: str, duration: float):
+        self.durations[name] += duration
+
+    @contextmanager
+    def measure(self, name: str):
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, monotonic() - started)
+
+    @contextmanager
+    def measure_query(self):
+        """
+        Измеряет время ожидания соединения из пула (до его получения, см.
+        analyzer.utils.pg.on_acquire) и время выполнения запроса.
+        """
+        acquired = []
+        token = pool_acquired.set(acquired)
+        started = monotonic()
+        try:
+            yield
+        finally:
+            pool_acquired.reset(token)
+            finished = monotonic()
+            acquired = acquired[0] if acquired else started
+            self.add('pool', acquired - started)
+            self.add('db', finished - acquired)
+
+    def header(self) -> str:
+        total = monotonic() - self.started
+        return ', '.join(
+            '%s;dur=%.3f' % (name, duration * 1000)
+            for name, duration in (*self.durations.items(), ('total', total))
+        )
+
+
+@contextmanager
+def measure(name: str):
+    """
+    Учитывает время выполнения блока в разбивке текущего запроса (если блок
+    выполняется при обработке запроса).
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    with timings.measure(name):
+        yield
+
+
+class TimingConnection:
+    """
+    Обертка над соединением asyncpgsa, учитывающая время выполнения запросов.
+    """
+    __slots__ = ('connection', 'timings')
+
+    def __init__(self, connection, timings: Timings):
+        self.connection = connection
+        self.timings = timings
+
+    async def execute(self, *args, **kwargs):
+        with self.timings.measure('db'):
+            return await self.connection.execute(*args, **kwargs)
+
+    async def fetch(self, *args, **kwargs):
+        with self.timings.measure('db'):
+            return await self.connection.fetch(*args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        with self.timings.measure('db'):
+            return await self.connection.fetchrow(*args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        with self.timings.measure('db'):
+            return await self.connection.fetchval(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class TimingTransaction:
+    """
+    Контекстный менеджер транзакции: учитывает время получения соединения и
+    начала транзакции, возвращает TimingConnection.
+    """
+    __slots__ = ('transaction_ctx', 'timings')
+
+    def __init__(self, transaction_ctx, timings: Timings):
+        self.transaction_ctx = transaction_ctx
+        self.timings = timings
+
+    async def __aenter__(self) -> TimingConnection:
+        with self.timings.measure_query():
+            connection = await self.transaction_ctx.__aenter__()
+        return TimingConnection(connection, self.timings)
+
+    async def __aexit__(self, *exc_info):
+        with self.timings.measure('db'):
+            return await self.transaction_ctx.__aexit__(*exc_info)
+
+
+class TimingPG:
+    """
+    Обертка над подключением к PostgreSQL (см. BaseView.pg), учитывающая время
+    ожидания соединений и выполнения запросов в разбивке запроса.
+    """
+    __slots__ = ('pg', 'timings')
+
+    def __init__(self, pg: PG, timings: Timings):
+        self.pg = pg
+        self.timings = timings
+
+    def transaction(self, **kwargs) -> TimingTransaction:
+        return TimingTransaction(self.pg.transaction(**kwargs), self.timings)
+
+    async def execute(self, *args, **kwargs):
+        with self.timings.measure_query():
+            return await self.pg.execute(*args, **kwargs)
+
+    async def fetch(self, *args, **kwargs):
+        with self.timings.measure_query():
+            return await self.pg.fetch(*args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        with self.timings.measure_query():
+            return await self.pg.fetchrow(*args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        with self.timings.measure_query():
+            return await self.pg.fetchval(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.pg, name)
+
+
+async def add_server_timing(request: Request, response: StreamResponse):
+    """
+    Добавляет заголовок Server-Timing перед отправкой ответа (сигнал
+    on_response_prepare), в т.ч. ответа с ошибкой.
+    """
+    timings = request.get('timings')
+    if timings is not None:
+        response.headers[HEADER] = timings.header()
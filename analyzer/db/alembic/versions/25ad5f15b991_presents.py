@@ -0,0 +1,54 @@
+"""presents
+
+Revision ID: 25ad5f15b991
+Revises: d5f704ed4610
+Create Date: 2026-10-19 09:12:37.402113
+
+"""
+from alembic import op
+from sqlalchemy import (
+    Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint,
+)
+
+
+# revision identifiers, used by Alembic.
+revision = '25ad5f15b991'
+down_revision = 'd5f704ed4610'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'presents',
+        Column('import_id', Integer(), nullable=False),
+        Column('citizen_id', Integer(), nullable=False),
+        Column('month', Integer(), nullable=False),
+        Column('presents', Integer(), nullable=False),
+        PrimaryKeyConstraint('import_id', 'citizen_id', 'month',
+                             name=op.f('pk__presents')),
+        ForeignKeyConstraint(
+            ('import_id', 'citizen_id'),
+            ['citizens.import_id', 'citizens.citizen_id'],
+            name=op.f('fk__presents__import_id_citizen_id__citizens')
+        )
+    )
+
+    # Рассчитываем статистику для уже существующих выгрузок
+    op.execute('''
+        INSERT INTO presents (import_id, citizen_id, month, presents)
+        SELECT
+            relations.import_id,
+            relations.citizen_id,
+            date_part('month', citizens.birth_date)::integer,
+            count(relations.relative_id)
+        FROM relations
+        JOIN citizens ON
+            citizens.import_id = relations.import_id AND
+            citizens.citizen_id = relations.relative_id
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def downgrade():
+    op.drop_table('presents')
@@ -0,0 +1,48 @@
+"""handler indexes
+
+Revision ID: 3f7c2a91b4e8
+Revises: 9d6918065868
+Create Date: 2026-10-19 16:21:08.514203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f7c2a91b4e8'
+down_revision = '9d6918065868'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Индексы создаются без блокировки записи в таблицы (CONCURRENTLY), что
+    # невозможно внутри транзакции. Если создание индекса прервется, в
+    # таблице останется невалидный индекс, его необходимо удалить вручную.
+    with op.get_context().autocommit_block():
+        # Все запросы к жителям фильтруют их по выгрузке, индекс по городу
+        # (без import_id) не используется. Составной индекс для статистики
+        # возрастов по городам (import_id, town, birth_date) не добавлен:
+        # планировщик предпочитает ему первичный ключ (см.
+        # benchmarks/plans), а поддерживать его пришлось бы при каждой
+        # загрузке выгрузки.
+        op.drop_index(op.f('ix__citizens__town'), 'citizens',
+                      postgresql_concurrently=True)
+
+        # Связи ищутся по родственнику при изменении жителей (удаление
+        # обратных связей в PATCH_CITIZEN_QUERY и PATCH_CITIZENS_QUERY), этот
+        # же индекс используется для проверки внешнего ключа
+        # (import_id, relative_id).
+        op.create_index(
+            op.f('ix__relations__import_id_relative_id'), 'relations',
+            ['import_id', 'relative_id'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix__relations__import_id_relative_id'),
+                      'relations', postgresql_concurrently=True)
+        op.create_index(op.f('ix__citizens__town'), 'citizens', ['town'],
+                        postgresql_concurrently=True)
@@ -0,0 +1,25 @@
+"""import generation
+
+Revision ID: 9d6918065868
+Revises: da04de337fef
+Create Date: 2026-10-19 13:05:41.830517
+
+"""
+from alembic import op
+from sqlalchemy import Column, Integer
+
+
+# revision identifiers, used by Alembic.
+revision = '9d6918065868'
+down_revision = 'da04de337fef'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('imports', Column('generation', Integer(), nullable=False,
+                                    server_default='0'))
+
+
+def downgrade():
+    op.drop_column('imports', 'generation')
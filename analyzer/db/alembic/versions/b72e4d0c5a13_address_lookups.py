@@ -0,0 +1,151 @@
+"""address lookups
+
+Revision ID: b72e4d0c5a13
+Revises: 3f7c2a91b4e8
+Create Date: 2026-10-19 18:02:41.736590
+
+Переносит города, улицы и строения жителей в словари towns, streets и
+buildings (отдельные для каждой выгрузки).
+
+Миграция перезаписывает таблицы citizens и town_birth_months (UPDATE всех
+строк и изменение первичного ключа) и до завершения удерживает на них
+блокировку ACCESS EXCLUSIVE: все запросы к жителям, в т.ч. на чтение, ждут ее
+окончания. Индексы в миграции не создаются, выполнить перезапись таблиц
+неблокирующим способом (как CREATE INDEX CONCURRENTLY) нельзя. На 1 млн
+жителей (100 выгрузок по 10000) миграция выполняется около 35 секунд, поэтому
+на больших объемах данных ее следует применять при остановленном сервисе.
+"""
+from alembic import op
+from sqlalchemy import (
+    Column, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String,
+    UniqueConstraint,
+)
+
+
+# revision identifiers, used by Alembic.
+revision = 'b72e4d0c5a13'
+down_revision = '3f7c2a91b4e8'
+branch_labels = None
+depends_on = None
+
+
+# Словарь, поле жителя, которое переносится в словарь
+LOOKUPS = (
+    ('towns', 'town'),
+    ('streets', 'street'),
+    ('buildings', 'building'),
+)
+
+
+def upgrade():
+    for table, field in LOOKUPS:
+        op.create_table(
+            table,
+            Column(f'{field}_id', Integer(), nullable=False),
+            Column('import_id', Integer(), nullable=False),
+            Column('name', String(), nullable=False),
+            ForeignKeyConstraint(
+                ['import_id'], ['imports.import_id'],
+                name=op.f(f'fk__{table}__import_id__imports')
+            ),
+            PrimaryKeyConstraint(f'{field}_id', name=op.f(f'pk__{table}')),
+            UniqueConstraint('import_id', 'name',
+                             name=op.f(f'uq__{table}__import_id_name'))
+        )
+        op.execute(f'''
+            INSERT INTO {table} (import_id, name)
+            SELECT DISTINCT import_id, {field} FROM citizens ORDER BY 1, 2
+        ''')
+
+    # Строки town_birth_months с population = 0 могут ссылаться на города,
+    # которых уже нет у жителей выгрузки. В словарях хранятся только
+    # используемые значения, поэтому такие строки удаляются.
+    op.execute('''
+        DELETE FROM town_birth_months
+        WHERE NOT EXISTS (
+            SELECT 1 FROM towns
+            WHERE towns.import_id = town_birth_months.import_id
+              AND towns.name = town_birth_months.town
+        )
+    ''')
+
+    for table, field in LOOKUPS:
+        op.add_column('citizens', Column(f'{field}_id', Integer()))
+
+    op.execute('''
+        UPDATE citizens
+        SET town_id = towns.town_id,
+            street_id = streets.street_id,
+            building_id = buildings.building_id
+        FROM towns, streets, buildings
+        WHERE towns.import_id = citizens.import_id
+          AND towns.name = citizens.town
+          AND streets.import_id = citizens.import_id
+          AND streets.name = citizens.street
+          AND buildings.import_id = citizens.import_id
+          AND buildings.name = citizens.building
+    ''')
+
+    for table, field in LOOKUPS:
+        op.alter_column('citizens', f'{field}_id', nullable=False)
+        op.drop_column('citizens', field)
+        op.create_foreign_key(
+            op.f(f'fk__citizens__{field}_id__{table}'), 'citizens', table,
+            [f'{field}_id'], [f'{field}_id']
+        )
+
+    op.add_column('town_birth_months', Column('town_id', Integer()))
+    op.execute('''
+        UPDATE town_birth_months
+        SET town_id = towns.town_id
+        FROM towns
+        WHERE towns.import_id = town_birth_months.import_id
+          AND towns.name = town_birth_months.town
+    ''')
+    op.alter_column('town_birth_months', 'town_id', nullable=False)
+    op.drop_constraint(op.f('pk__town_birth_months'), 'town_birth_months')
+    op.drop_column('town_birth_months', 'town')
+    op.create_primary_key(op.f('pk__town_birth_months'), 'town_birth_months',
+                          ['import_id', 'town_id', 'birth_month'])
+    op.create_foreign_key(
+        op.f('fk__town_birth_months__town_id__towns'), 'town_birth_months',
+        'towns', ['town_id'], ['town_id'], ondelete='CASCADE'
+    )
+
+
+def downgrade():
+    op.add_column('town_birth_months', Column('town', String()))
+    op.execute('''
+        UPDATE town_birth_months
+        SET town = towns.name
+        FROM towns
+        WHERE towns.town_id = town_birth_months.town_id
+    ''')
+    op.alter_column('town_birth_months', 'town', nullable=False)
+    op.drop_constraint(op.f('pk__town_birth_months'), 'town_birth_months')
+    op.drop_constraint(op.f('fk__town_birth_months__town_id__towns'),
+                       'town_birth_months')
+    op.drop_column('town_birth_months', 'town_id')
+    op.create_primary_key(op.f('pk__town_birth_months'), 'town_birth_months',
+                          ['import_id', 'town', 'birth_month'])
+
+    for table, field in LOOKUPS:
+        op.add_column('citizens', Column(field, String()))
+
+    op.execute('''
+        UPDATE citizens
+        SET town = towns.name,
+            street = streets.name,
+            building = buildings.name
+        FROM towns, streets, buildings
+        WHERE towns.town_id = citizens.town_id
+          AND streets.street_id = citizens.street_id
+          AND buildings.building_id = citizens.building_id
+    ''')
+
+    for table, field in LOOKUPS:
+        op.alter_column('citizens', field, nullable=False)
+        op.drop_constraint(op.f(f'fk__citizens__{field}_id__{table}'),
+                           'citizens')
+        op.drop_column('citizens', f'{field}_id')
+        op.drop_table(table)
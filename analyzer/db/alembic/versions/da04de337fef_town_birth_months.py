@@ -0,0 +1,52 @@
+"""town birth months
+
+Revision ID: da04de337fef
+Revises: 25ad5f15b991
+Create Date: 2026-10-19 11:47:05.118240
+
+"""
+from alembic import op
+from sqlalchemy import (
+    Column, Date, ForeignKeyConstraint, Integer, PrimaryKeyConstraint, String,
+)
+
+
+# revision identifiers, used by Alembic.
+revision = 'da04de337fef'
+down_revision = '25ad5f15b991'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'town_birth_months',
+        Column('import_id', Integer(), nullable=False),
+        Column('town', String(), nullable=False),
+        Column('birth_month', Date(), nullable=False),
+        Column('population', Integer(), nullable=False),
+        PrimaryKeyConstraint('import_id', 'town', 'birth_month',
+                             name=op.f('pk__town_birth_months')),
+        ForeignKeyConstraint(
+            ('import_id', ), ['imports.import_id'],
+            name=op.f('fk__town_birth_months__import_id__imports')
+        )
+    )
+
+    # Рассчитываем статистику для уже существующих выгрузок
+    op.execute('''
+        INSERT INTO town_birth_months (
+            import_id, town, birth_month, population
+        )
+        SELECT
+            import_id,
+            town,
+            date_trunc('month', birth_date)::date,
+            count(*)
+        FROM citizens
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def downgrade():
+    op.drop_table('town_birth_months')
@@ -0,0 +1,183 @@
+"""
+Утилита для проверки консистентности данных в базе данных.
+
+Сравнивает статистику подарков в таблице presents и кол-во жителей по городам
+и месяцам рождения в таблице town_birth_months (обновляются инкрементально при
+изменении жителей) с полным пересчетом по таблицам relations и citizens, а
+также ищет в словарях адресов значения, которых нет у жителей выгрузки.
+Завершается с ненулевым кодом, если найдены расхождения.
+"""
+import argparse
+import logging
+import os
+from typing import List, Optional
+
+from sqlalchemy import (
+    and_, create_engine, exists, func, literal, or_, select, union_all,
+)
+from sqlalchemy.engine import Connection
+
+from analyzer.api.handlers.query import (
+    PRESENTS_QUERY, TOWN_BIRTH_MONTHS_QUERY,
+)
+from analyzer.db.lookups import LOOKUP_TABLES, lookup_key
+from analyzer.db.schema import (
+    citizens_table, presents_table, relations_table, town_birth_months_table,
+)
+from analyzer.utils.pg import DEFAULT_PG_URL
+
+
+log = logging.getLogger(__name__)
+
+
+def find_presents_mismatches(conn: Connection,
+                             import_id: Optional[int] = None) -> List:
+    """
+    Возвращает строки, в которых кол-во подарков в таблице presents (stored)
+    отличается от рассчитанного по родственным связям (expected).
+    """
+    expected = PRESENTS_QUERY
+    stored = presents_table.select().where(presents_table.c.presents != 0)
+    if import_id is not None:
+        expected = expected.where(relations_table.c.import_id == import_id)
+        stored = stored.where(presents_table.c.import_id == import_id)
+    expected = expected.alias('expected')
+    stored = stored.alias('stored')
+
+    query = select([
+        func.coalesce(stored.c.import_id,
+                      expected.c.import_id).label('import_id'),
+        func.coalesce(stored.c.citizen_id,
+                      expected.c.citizen_id).label('citizen_id'),
+        func.coalesce(stored.c.month, expected.c.month).label('month'),
+        func.coalesce(stored.c.presents, 0).label('stored'),
+        func.coalesce(expected.c.presents, 0).label('expected'),
+    ]).select_from(
+        stored.outerjoin(
+            expected, and_(
+                stored.c.import_id == expected.c.import_id,
+                stored.c.citizen_id == expected.c.citizen_id,
+                stored.c.month == expected.c.month,
+            ),
+            full=True
+        )
+    ).where(or_(
+        stored.c.presents.is_(None),
+        expected.c.presents.is_(None),
+        stored.c.presents != expected.c.presents,
+    ))
+    return conn.execute(query).fetchall()
+
+
+def find_town_birth_months_mismatches(conn: Connection,
+                                      import_id: Optional[int] = None) -> List:
+    """
+    Возвращает строки, в которых кол-во жителей в таблице town_birth_months
+    (stored) отличается от рассчитанного по таблице citizens (expected).
+    """
+    expected = TOWN_BIRTH_MONTHS_QUERY
+    stored = town_birth_months_table.select().where(
+        town_birth_months_table.c.population != 0
+    )
+    if import_id is not None:
+        expected = expected.where(citizens_table.c.import_id == import_id)
+        stored = stored.where(town_birth_months_table.c.import_id == import_id)
+    expected = expected.alias('expected')
+    stored = stored.alias('stored')
+
+    query = select([
+        func.coalesce(stored.c.import_id,
+                      expected.c.import_id).label('import_id'),
+        func.coalesce(stored.c.town_id,
+                      expected.c.town_id).label('town_id'),
+        func.coalesce(stored.c.birth_month,
+                      expected.c.birth_month).label('birth_month'),
+        func.coalesce(stored.c.population, 0).label('stored'),
+        func.coalesce(expected.c.population, 0).label('expected'),
+    ]).select_from(
+        stored.outerjoin(
+            expected, and_(
+                stored.c.import_id == expected.c.import_id,
+                stored.c.town_id == expected.c.town_id,
+                stored.c.birth_month == expected.c.birth_month,
+            ),
+            full=True
+        )
+    ).where(or_(
+        stored.c.population.is_(None),
+        expected.c.population.is_(None),
+        stored.c.population != expected.c.population,
+    ))
+    return conn.execute(query).fetchall()
+
+
+def find_unused_addresses(conn: Connection,
+                          import_id: Optional[int] = None) -> List:
+    """
+    Возвращает значения словарей адресов (field, import_id, name), которые не
+    указаны ни у одного жителя выгрузки.
+    """
+    queries = []
+    for field, table in LOOKUP_TABLES.items():
+        key = lookup_key(table)
+        query = select([
+            literal(field).label('field'), table.c.import_id, table.c.name
+        ]).where(~exists().where(and_(
+            citizens_table.c.import_id == table.c.import_id,
+            citizens_table.c[key.name] == key
+        )))
+        if import_id is not None:
+            query = query.where(table.c.import_id == import_id)
+        queries.append(query)
+    return conn.execute(union_all(*queries)).fetchall()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--pg-url', default=os.getenv('ANALYZER_PG_URL', DEFAULT_PG_URL),
+        help='Database URL [env var: ANALYZER_PG_URL]'
+    )
+    parser.add_argument('--import-id', type=int,
+                        help='Check only specified import')
+    options = parser.parse_args()
+
+    engine = create_engine(options.pg_url)
+    try:
+        with engine.connect() as conn:
+            presents = find_presents_mismatches(conn, options.import_id)
+            town_birth_months = find_town_birth_months_mismatches(
+                conn, options.import_id
+            )
+            addresses = find_unused_addresses(conn, options.import_id)
+    finally:
+        engine.dispose()
+
+    for row in presents:
+        log.error('import %d, citizen %d, month %d: stored %d presents, '
+                  'expected %d', row['import_id'], row['citizen_id'],
+                  row['month'], row['stored'], row['expected'])
+
+    for row in town_birth_months:
+        log.error('import %d, town_id %d, birth month %s: stored %d '
+                  'citizens, expected %d', row['import_id'], row['town_id'],
+                  row['birth_month'], row['stored'], row['expected'])
+
+    for row in addresses:
+        log.error('import %d, %s %r: not used by citizens', row['import_id'],
+                  row['field'], row['name'])
+
+    mismatches = len(presents) + len(town_birth_months) + len(addresses)
+    if mismatches:
+        log.error('Found %d mismatches', mismatches)
+        exit(1)
+    log.info('No mismatches found')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Словари адресов жителей.
+
+Города, улицы и строения хранятся в таблицах towns, streets и buildings по
+одной строке на уникальное значение в выгрузке, в таблице citizens - только их
+идентификаторы. Это уменьшает размер таблицы citizens и ее индексов, а
+группировка жителей по городу выполняется по целым числам.
+
+Словари выгрузки заполняются при ее создании (insert_addresses) в той же
+транзакции, что и жители: строки с новым import_id не конфликтуют со строками
+других выгрузок, поэтому вставка не блокирует конкурентные запросы.
+Новые значения при изменении жителей добавляются, а переставшие
+использоваться - удаляются запросами PATCH_CITIZEN_QUERY и PATCH_CITIZENS_QUERY
+(см. analyzer.api.handlers.query) под advisory-блокировкой выгрузки.
+Запросы на чтение получают значения соединением со словарями.
+"""
+from typing import Dict, List, Mapping, Sequence
+
+from sqlalchemy import Integer, String, Table, bindparam, cast, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.sql import Insert
+
+from analyzer.db.schema import buildings_table, streets_table, towns_table
+
+
+# Поля жителя, значения которых хранятся в словарях
+LOOKUP_TABLES = {
+    'town': towns_table,
+    'street': streets_table,
+    'building': buildings_table,
+}
+
+# Идентификаторы значений по полям жителя и значениям
+AddressIds = Dict[str, Dict[str, int]]
+
+
+def lookup_key(table: Table):
+    return table.primary_key.columns.values()[0]
+
+
+def insert_names_query(table: Table, import_id: int,
+                       names: Sequence[str]) -> Insert:
+    """
+    Добавляет значения в словарь выгрузки и возвращает их идентификаторы.
+    """
+    names = cast(bindparam('names', names, type_=ARRAY(String)),
+                 ARRAY(String))
+    values = select([
+        bindparam('import_id', import_id, type_=Integer),
+        func.unnest(names)
+    ])
+    return insert(table).from_select(
+        ['import_id', 'name'], values
+    ).returning(lookup_key(table), table.c.name)
+
+
+async def insert_addresses(conn, import_id: int,
+                           citizens: List[Mapping]) -> AddressIds:
+    """
+    Заполняет словари новой выгрузки адресами жителей и возвращает
+    идентификаторы значений.
+    """
+    ids = {}
+    for field, table in LOOKUP_TABLES.items():
+        names = list({citizen[field] for citizen in citizens})
+        ids[field] = {}
+        if not names:
+            continue
+
+        key = lookup_key(table)
+        rows = await conn.fetch(insert_names_query(table, import_id, names))
+        ids[field] = {row['name']: row[key.name] for row in rows}
+    return ids
@@ -1,8 +1,8 @@
 from enum import Enum, unique
 
 from sqlalchemy import (
-    Column, Date, Enum as PgEnum, ForeignKey, ForeignKeyConstraint, Integer,
-    MetaData, String, Table,
+    Column, Date, Enum as PgEnum, ForeignKey, ForeignKeyConstraint, Index,
+    Integer, MetaData, String, Table, UniqueConstraint,
 )
 
 
@@ -32,7 +32,44 @@ class Gender(Enum):
 imports_table = Table(
     'imports',
     metadata,
-    Column('import_id', Integer, primary_key=True)
+    Column('import_id', Integer, primary_key=True),
+    # Увеличивается при каждом изменении жителей выгрузки, позволяет
+    # определить, что сохраненная в кэше статистика устарела.
+    Column('generation', Integer, nullable=False, server_default='0')
+)
+
+# Словари адресов жителей: города, улицы и строения повторяются у многих
+# жителей выгрузки, поэтому в таблице citizens хранятся идентификаторы значений
+# (см. analyzer.db.lookups). У каждой выгрузки свои словари: значения
+# добавляются и удаляются только запросами, изменяющими жителей выгрузки.
+towns_table = Table(
+    'towns',
+    metadata,
+    Column('town_id', Integer, primary_key=True),
+    Column('import_id', Integer, ForeignKey('imports.import_id'),
+           nullable=False),
+    Column('name', String, nullable=False),
+    UniqueConstraint('import_id', 'name'),
+)
+
+streets_table = Table(
+    'streets',
+    metadata,
+    Column('street_id', Integer, primary_key=True),
+    Column('import_id', Integer, ForeignKey('imports.import_id'),
+           nullable=False),
+    Column('name', String, nullable=False),
+    UniqueConstraint('import_id', 'name'),
+)
+
+buildings_table = Table(
+    'buildings',
+    metadata,
+    Column('building_id', Integer, primary_key=True),
+    Column('import_id', Integer, ForeignKey('imports.import_id'),
+           nullable=False),
+    Column('name', String, nullable=False),
+    UniqueConstraint('import_id', 'name'),
 )
 
 citizens_table = Table(
@@ -41,9 +78,11 @@ citizens_table = Table(
     Column('import_id', Integer, ForeignKey('imports.import_id'),
            primary_key=True),
     Column('citizen_id', Integer, primary_key=True),
-    Column('town', String, nullable=False, index=True),
-    Column('street', String, nullable=False),
-    Column('building', String, nullable=False),
+    Column('town_id', Integer, ForeignKey('towns.town_id'), nullable=False),
+    Column('street_id', Integer, ForeignKey('streets.street_id'),
+           nullable=False),
+    Column('building_id', Integer, ForeignKey('buildings.building_id'),
+           nullable=False),
     Column('apartment', Integer, nullable=False),
     Column('name', String, nullable=False),
     Column('birth_date', Date, nullable=False),
@@ -64,4 +103,42 @@ relations_table = Table(
         ('import_id', 'relative_id'),
         ('citizens.import_id', 'citizens.citizen_id')
     ),
+    # Поиск связей по родственнику (удаление обратных связей)
+    Index('ix__relations__import_id_relative_id', 'import_id', 'relative_id'),
+)
+
+# Кол-во подарков, которые житель купит своим родственникам в каждом месяце.
+# Поддерживается в актуальном состоянии обработчиками, изменяющими жителей и
+# их родственные связи, чтобы не рассчитывать статистику при каждом запросе.
+# Может содержать строки с presents = 0 (после изменения жителя).
+presents_table = Table(
+    'presents',
+    metadata,
+    Column('import_id', Integer, primary_key=True),
+    Column('citizen_id', Integer, primary_key=True),
+    Column('month', Integer, primary_key=True),
+    Column('presents', Integer, nullable=False),
+    ForeignKeyConstraint(
+        ('import_id', 'citizen_id'),
+        ('citizens.import_id', 'citizens.citizen_id')
+    ),
+)
+
+# Кол-во жителей, родившихся в каждом месяце (birth_month - первое число
+# месяца), по городам. Используется для приблизительного расчета перцентилей
+# возрастов жителей: в отличие от точного расчета не требует сортировки всех
+# жителей города, а размер не зависит от кол-ва жителей.
+# Поддерживается в актуальном состоянии обработчиками, изменяющими жителей.
+# Может содержать строки с population = 0 (после изменения жителя), удаляются
+# вместе с городом, когда в выгрузке не остается его жителей.
+town_birth_months_table = Table(
+    'town_birth_months',
+    metadata,
+    Column('import_id', Integer, ForeignKey('imports.import_id'),
+           primary_key=True),
+    Column('town_id', Integer,
+           ForeignKey('towns.town_id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('birth_month', Date, primary_key=True),
+    Column('population', Integer, nullable=False),
 )
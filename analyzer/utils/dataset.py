@@ -0,0 +1,238 @@
+"""
+Быстрый детерминированный генератор выгрузок для тестов и нагрузочного
+тестирования.
+
+В отличие от analyzer.utils.testing.generate_citizens, Faker вызывается только
+при создании генератора (для наборов имен, городов и улиц), поля жителей
+выбираются из готовых наборов пачками (random.choices), а родственные связи
+выбираются случайными парами без перемешивания всего списка жителей. Время
+генерации выгрузки растет почти линейно от кол-ва жителей и связей.
+
+Одинаковые seed и today дают одинаковые выгрузки. Для бенчмарков выгрузки
+загружаются в БД напрямую через COPY (load_citizens).
+
+Пример сохранения выгрузки в файл:
+    python -m analyzer.utils.dataset --citizens 10000 --relations 1000 \\
+        --seed 1 --format ndjson --output citizens.ndjson
+"""
+import argparse
+import json
+import random
+import sys
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import faker
+
+from analyzer.api.handlers.query import (
+    PRESENTS_QUERY, TOWN_BIRTH_MONTHS_QUERY,
+)
+from analyzer.api.schema import BIRTH_DATE_FORMAT
+from analyzer.db.lookups import insert_addresses
+from analyzer.db.schema import (
+    citizens_table, imports_table, presents_table, relations_table,
+    town_birth_months_table,
+)
+
+
+GENDERS = ('female', 'male')
+MAX_AGE_DAYS = 80 * 365
+
+
+class CitizensGenerator:
+    """
+    Генерирует выгрузки жителей из ограниченных наборов значений.
+
+    :param seed: Начальное значение генератора случайных чисел
+    :param unique_towns: Кол-во уникальных городов в выгрузках
+    :param unique_streets: Кол-во уникальных улиц в выгрузках
+    :param unique_names: Кол-во уникальных имен каждого пола
+    :param today: Дата, относительно которой генерируются даты рождения
+            (не старше 80 лет)
+    """
+
+    def __init__(self, seed: Optional[int] = None, unique_towns: int = 20,
+                 unique_streets: int = 100, unique_names: int = 500,
+                 today: Optional[date] = None):
+        self.random = random.Random(seed)
+
+        fake = faker.Faker('ru_RU')
+        fake.seed_instance(seed)
+        self.towns = [fake.city_name() for _ in range(unique_towns)]
+        self.streets = [fake.street_name() for _ in range(unique_streets)]
+        self.names = {
+            'female': [fake.name_female() for _ in range(unique_names)],
+            'male': [fake.name_male() for _ in range(unique_names)],
+        }
+
+        today = today or date.today()
+        self.birth_dates = [
+            (today - timedelta(days=days)).strftime(BIRTH_DATE_FORMAT)
+            for days in range(MAX_AGE_DAYS)
+        ]
+
+    def generate_relations(self, citizen_ids: List[int],
+                           relations_num: int) -> Dict[int, List[int]]:
+        """
+        Выбирает relations_num различных пар родственников и возвращает
+        родственников каждого жителя (связи симметричны).
+        """
+        citizens_num = len(citizen_ids)
+        if relations_num > citizens_num * (citizens_num - 1) // 2:
+            raise ValueError('Unable to choose relative for citizen')
+
+        pairs = set()
+        randrange = self.random.randrange
+        while len(pairs) < relations_num:
+            left, right = randrange(citizens_num), randrange(citizens_num)
+            if left != right:
+                pairs.add((left, right) if left < right else (right, left))
+
+        relatives = {citizen_id: [] for citizen_id in citizen_ids}
+        for left, right in sorted(pairs):
+            left, right = citizen_ids[left], citizen_ids[right]
+            relatives[left].append(right)
+            relatives[right].append(left)
+        return relatives
+
+    def generate(self, citizens_num: int,
+                 relations_num: Optional[int] = None,
+                 start_citizen_id: int = 0) -> List[Dict[str, Any]]:
+        """
+        Генерирует список жителей в формате ImportsView.
+
+        :param citizens_num: Количество жителей
+        :param relations_num: Количество родственных связей (подразумевается
+                одна связь между двумя людьми), по умолчанию 10% от кол-ва
+                жителей
+        :param start_citizen_id: С какого citizen_id начинать
+        """
+        if relations_num is None:
+            relations_num = citizens_num // 10
+
+        citizen_ids = list(range(start_citizen_id,
+                                 start_citizen_id + citizens_num))
+        relatives = self.generate_relations(citizen_ids, relations_num)
+
+        rnd = self.random
+        genders = rnd.choices(GENDERS, k=citizens_num)
+        names = {
+            gender: iter(rnd.choices(self.names[gender],
+                                     k=genders.count(gender)))
+            for gender in GENDERS
+        }
+        columns = zip(
+            citizen_ids,
+            genders,
+            rnd.choices(self.birth_dates, k=citizens_num),
+            rnd.choices(self.towns, k=citizens_num),
+            rnd.choices(self.streets, k=citizens_num),
+            rnd.choices(range(1, 100), k=citizens_num),
+            rnd.choices(range(1, 120), k=citizens_num),
+        )
+        return [
+            {
+                'citizen_id': citizen_id,
+                'name': next(names[gender]),
+                'birth_date': birth_date,
+                'gender': gender,
+                'town': town,
+                'street': street,
+                'building': str(building),
+                'apartment': apartment,
+                'relatives': relatives[citizen_id],
+            }
+            for (citizen_id, gender, birth_date, town, street, building,
+                 apartment) in columns
+        ]
+
+
+async def load_citizens(conn, citizens: List[Dict[str, Any]]) -> int:
+    """
+    Загружает выгрузку в БД (как ImportsView, но через COPY, без ограничения
+    на кол-во жителей в запросе) и возвращает ее import_id. Должна вызываться
+    в транзакции соединения asyncpgsa.
+    """
+    import_id = await conn.fetchval(
+        imports_table.insert().returning(imports_table.c.import_id)
+    )
+    address_ids = await insert_addresses(conn, import_id, citizens)
+    towns, streets, buildings = (
+        address_ids['town'], address_ids['street'], address_ids['building']
+    )
+    await conn.copy_records_to_table(
+        citizens_table.name,
+        columns=[
+            'import_id', 'citizen_id', 'town_id', 'street_id', 'building_id',
+            'apartment', 'name', 'birth_date', 'gender'
+        ],
+        records=[
+            (
+                import_id, citizen['citizen_id'], towns[citizen['town']],
+                streets[citizen['street']], buildings[citizen['building']],
+                citizen['apartment'], citizen['name'],
+                datetime.strptime(citizen['birth_date'],
+                                  BIRTH_DATE_FORMAT).date(),
+                citizen['gender']
+            )
+            for citizen in citizens
+        ]
+    )
+    await conn.copy_records_to_table(
+        relations_table.name,
+        columns=['import_id', 'citizen_id', 'relative_id'],
+        records=[
+            (import_id, citizen['citizen_id'], relative_id)
+            for citizen in citizens
+            for relative_id in citizen['relatives']
+        ]
+    )
+    for table, query, key in (
+        (presents_table, PRESENTS_QUERY, relations_table.c.import_id),
+        (town_birth_months_table, TOWN_BIRTH_MONTHS_QUERY,
+         citizens_table.c.import_id),
+    ):
+        await conn.execute(table.insert().from_select(
+            [column.name for column in table.columns],
+            query.where(key == import_id)
+        ))
+    return import_id
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument('--citizens', type=int, default=10000,
+                    help='Number of citizens in import')
+parser.add_argument('--relations', type=int,
+                    help='Number of relations between citizens '
+                         '(10%% of citizens by default)')
+parser.add_argument('--towns', type=int, default=20,
+                    help='Number of unique towns in import')
+parser.add_argument('--start-citizen-id', type=int, default=0)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--format', choices=('json', 'ndjson'), default='json',
+                    help='json: request body of POST /imports, '
+                         'ndjson: one citizen per line')
+parser.add_argument('--output', type=argparse.FileType('w'),
+                    default=sys.stdout, help='Output file (stdout by default)')
+
+
+def main():
+    args = parser.parse_args()
+    generator = CitizensGenerator(seed=args.seed, unique_towns=args.towns)
+    citizens = generator.generate(args.citizens, args.relations,
+                                  args.start_citizen_id)
+
+    with args.output as fp:
+        if args.format == 'json':
+            json.dump({'citizens': citizens}, fp, ensure_ascii=False)
+            fp.write('\n')
+        else:
+            for citizen in citizens:
+                fp.write(json.dumps(citizen, ensure_ascii=False))
+                fp.write('\n')
+
+
+if __name__ == '__main__':
+    main()
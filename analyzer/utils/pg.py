@@ -1,17 +1,23 @@
+import asyncio
 import logging
 import os
 from collections import AsyncIterable
+from contextvars import ContextVar
+from decimal import ROUND_HALF_UP, Decimal
+from math import ceil
 from pathlib import Path
+from time import monotonic
 from types import SimpleNamespace
-from typing import Union
+from typing import List, Optional, Union
 
 from aiohttp.web_app import Application
 from alembic.config import Config
 from asyncpgsa import PG
 from asyncpgsa.transactionmanager import ConnectionTransactionContextManager
 from configargparse import Namespace
-from sqlalchemy import Numeric, cast, func
+from sqlalchemy import Column, Numeric, cast, func
 from sqlalchemy.sql import Select
+from yarl import URL
 
 
 CENSORED = '***'
@@ -24,32 +30,114 @@ PROJECT_PATH = Path(__file__).parent.parent.resolve()
 
 log = logging.getLogger(__name__)
 
+# Время получения соединений из пула (по time.monotonic) добавляется в список,
+# установленный в текущем контексте. Позволяет отделить время ожидания
+# соединения от времени выполнения запроса (см. analyzer.api.timing).
+pool_acquired: ContextVar[Optional[List[float]]] = ContextVar(
+    'pool_acquired', default=None
+)
 
-async def setup_pg(app: Application, args: Namespace) -> PG:
-    db_info = args.pg_url.with_password(CENSORED)
+
+async def on_acquire(_):
+    acquired = pool_acquired.get()
+    if acquired is not None:
+        acquired.append(monotonic())
+
+
+async def connect_pg(url: URL, args: Namespace) -> PG:
+    db_info = url.with_password(CENSORED)
     log.info('Connecting to database: %s', db_info)
 
-    app['pg'] = PG()
-    await app['pg'].init(
-        str(args.pg_url),
+    # Пулер соединений в режиме транзакций (например, PgBouncer) может
+    # выполнять транзакции клиента на разных соединениях с PostgreSQL, поэтому
+    # asyncpg не должен сохранять подготовленные запросы между транзакциями.
+    kwargs = {'statement_cache_size': 0} if args.pg_pooler_mode else {}
+
+    pg = PG()
+    await pg.init(
+        str(url),
         min_size=args.pg_pool_min_size,
-        max_size=args.pg_pool_max_size
+        max_size=args.pg_pool_max_size,
+        setup=on_acquire,
+        **kwargs
     )
-    await app['pg'].fetchval('SELECT 1')
+    await pg.fetchval('SELECT 1')
     log.info('Connected to database %s', db_info)
+    return pg
+
+
+async def disconnect_pg(pg: PG, url: URL):
+    db_info = url.with_password(CENSORED)
+    log.info('Disconnecting from database %s', db_info)
+    await pg.pool.close()
+    log.info('Disconnected from database %s', db_info)
+
+
+async def setup_pg(app: Application, args: Namespace) -> PG:
+    app['pg'] = await connect_pg(args.pg_url, args)
+    try:
+        yield
+    finally:
+        await disconnect_pg(app['pg'], args.pg_url)
+
+
+async def setup_pg_replica(app: Application, args: Namespace):
+    """
+    Подключается к реплике PostgreSQL (если она указана в настройках), с
+    которой читают данные GET-обработчики.
+    """
+    if args.pg_replica_url is None:
+        app['pg_replica'] = None
+        yield
+        return
 
+    app['pg_replica'] = await connect_pg(args.pg_replica_url, args)
     try:
         yield
     finally:
-        log.info('Disconnecting from database %s', db_info)
-        await app['pg'].pool.close()
-        log.info('Disconnected from database %s', db_info)
+        await disconnect_pg(app['pg_replica'], args.pg_replica_url)
 
 
 def rounded(column, fraction: int = 2):
     return func.round(cast(column, Numeric), fraction)
 
 
+def round_half_up(value: float, fraction: int = 2) -> float:
+    """
+    Округляет значение в Python так же, как PostgreSQL округляет значения типа
+    double precision, приведенные к numeric (см. rounded).
+    """
+    value = Decimal('%.15g' % value)
+    return float(value.quantize(Decimal(1).scaleb(-fraction), ROUND_HALF_UP))
+
+
+def remaining_time(deadline: Optional[float]) -> Optional[float]:
+    """
+    Возвращает время до истечения срока deadline (по time.monotonic) для
+    передачи в asyncpg в качестве timeout: по его истечении asyncpg отменяет
+    выполнение запроса в PostgreSQL.
+    """
+    if deadline is None:
+        return None
+
+    timeout = deadline - monotonic()
+    if timeout <= 0:
+        raise asyncio.TimeoutError()
+    return timeout
+
+
+async def set_statement_timeout(conn, deadline: Optional[float]):
+    """
+    Ограничивает время выполнения запросов текущей транзакции в PostgreSQL
+    сроком deadline. Запросы будут остановлены, даже если запрос на отмену от
+    asyncpg не дойдет до сервера.
+    """
+    timeout = remaining_time(deadline)
+    if timeout is not None:
+        await conn.execute("SELECT set_config('statement_timeout', $1, true)",
+                           str(ceil(timeout * 1000)))
+
+
 def make_alembic_config(cmd_opts: Union[Namespace, SimpleNamespace],
                         base_path: str = PROJECT_PATH) -> Config:
     """
@@ -78,25 +166,78 @@ class SelectQuery(AsyncIterable):
     """
     Используется чтобы отправлять данные из PostgreSQL клиенту сразу после
     получения, по частям, без буфферизации всех данных.
+
+    Данные отправляются после завершения обработчика, поэтому срок обработки
+    запроса deadline (по time.monotonic) проверяется при получении каждой
+    части данных.
     """
     PREFETCH = 1000
 
     __slots__ = (
-        'query', 'transaction_ctx', 'prefetch', 'timeout'
+        'query', 'transaction_ctx', 'prefetch', 'deadline'
     )
 
     def __init__(self, query: Select,
                  transaction_ctx: ConnectionTransactionContextManager,
                  prefetch: int = None,
-                 timeout: float = None):
+                 deadline: float = None):
         self.query = query
         self.transaction_ctx = transaction_ctx
         self.prefetch = prefetch or self.PREFETCH
-        self.timeout = timeout
+        self.deadline = deadline
+
+    async def __aiter__(self):
+        async with self.transaction_ctx as conn:
+            await set_statement_timeout(conn, self.deadline)
+            cursor = await conn.cursor(
+                self.query, timeout=remaining_time(self.deadline)
+            )
+            while True:
+                rows = await cursor.fetch(
+                    self.prefetch, timeout=remaining_time(self.deadline)
+                )
+                for row in rows:
+                    yield row
+
+                if len(rows) < self.prefetch:
+                    break
+
+
+class KeysetSelectQuery(SelectQuery):
+    """
+    Аналог SelectQuery для работы через пулер соединений в режиме транзакций.
+
+    Курсор asyncpg всегда использует именованный подготовленный запрос,
+    который остается на соединении с PostgreSQL после завершения транзакции и
+    может конфликтовать с запросами других клиентов пулера. Поэтому данные
+    запрашиваются частями по prefetch строк обычными запросами с условием
+    key > последнего полученного значения. Транзакция должна иметь уровень
+    изоляции repeatable read, чтобы все части соответствовали одному снимку
+    данных.
+    """
+    __slots__ = ('key', )
+
+    def __init__(self, query: Select, key: Column,
+                 transaction_ctx: ConnectionTransactionContextManager,
+                 prefetch: int = None,
+                 deadline: float = None):
+        super().__init__(query, transaction_ctx, prefetch, deadline)
+        self.key = key
 
     async def __aiter__(self):
+        query = self.query.order_by(self.key).limit(self.prefetch)
         async with self.transaction_ctx as conn:
-            cursor = conn.cursor(self.query, prefetch=self.prefetch,
-                                 timeout=self.timeout)
-            async for row in cursor:
-                yield row
+            await set_statement_timeout(conn, self.deadline)
+            rows = await conn.fetch(query,
+                                    timeout=remaining_time(self.deadline))
+            while True:
+                for row in rows:
+                    yield row
+
+                if len(rows) < self.prefetch:
+                    break
+
+                rows = await conn.fetch(
+                    query.where(self.key > rows[-1][self.key.name]),
+                    timeout=remaining_time(self.deadline)
+                )
@@ -0,0 +1,77 @@
+"""
+Статистический профилировщик потока с циклом событий.
+
+Отдельный поток с заданным интервалом получает стек профилируемого потока
+(sys._current_frames) и считает, сколько раз встретился каждый стек. Результат
+возвращается в формате collapsed stacks (одна строка на стек: функции от
+корня через ';' и кол-во выборок), который принимают flamegraph.pl и
+speedscope.
+"""
+import sys
+import threading
+from collections import Counter
+from time import monotonic, sleep
+from typing import Dict, Tuple
+
+
+Stack = Tuple[str, ...]
+
+
+def format_frame(frame) -> str:
+    code = frame.f_code
+    return '%s:%s:%d' % (code.co_filename, code.co_name, code.co_firstlineno)
+
+
+def get_stack(frame) -> Stack:
+    stack = []
+    while frame is not None:
+        stack.append(format_frame(frame))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def collapse(stacks: Dict[Stack, int]) -> str:
+    return ''.join(
+        '%s %d\n' % (';'.join(stack), count)
+        for stack, count in sorted(stacks.items(), key=lambda item: item[0])
+    )
+
+
+class SamplingProfiler:
+    """
+    Профилирует не более одного потока одновременно: профилирование
+    замедляет профилируемый поток.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """
+        Занимает профилировщик для вызова sample. Возвращает False, если
+        профилировщик уже занят.
+        """
+        return self.lock.acquire(blocking=False)
+
+    def sample(self, thread_id: int, duration: float,
+               interval: float) -> Dict[Stack, int]:
+        """
+        Собирает стеки потока thread_id в течение duration секунд с
+        интервалом interval секунд и освобождает профилировщик, занятый
+        acquire. Блокирует текущий поток, должен вызываться в отдельном потоке
+        (например, через loop.run_in_executor).
+        """
+        try:
+            stacks = Counter()
+            deadline = monotonic() + duration
+            while monotonic() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                if frame is None:
+                    break
+                stacks[get_stack(frame)] += 1
+                # Ссылка на кадр удерживает все его локальные переменные
+                del frame
+                sleep(interval)
+            return stacks
+        finally:
+            self.lock.release()
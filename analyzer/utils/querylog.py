@@ -0,0 +1,326 @@
+"""
+Журнал запросов к PostgreSQL (включается аргументом --query-log).
+
+Подключения app['pg'] и app['pg_replica'] заменяются обертками, которые
+замеряют время выполнения каждого запроса (в т.ч. получение частей данных
+курсоров SelectQuery) и пишут в лог запись с обработчиком, выполнившим запрос.
+Для части медленных запросов (дольше --query-log-threshold) в фоне
+выполняется EXPLAIN (ANALYZE, BUFFERS) и план также пишется в лог.
+
+Поля записей передаются в extra, поэтому доступны для агрегации при выводе
+логов в формате json (--log-format=json).
+"""
+import asyncio
+import logging
+import random
+import re
+from contextvars import ContextVar
+from math import ceil
+from time import monotonic
+from typing import Optional, Sequence
+
+from aiohttp.web_app import Application
+from asyncpgsa import PG
+from asyncpgsa.connection import compile_query
+from configargparse import Namespace
+
+
+log = logging.getLogger(__name__)
+
+# Обработчик, выполняющий запросы в текущем контексте (устанавливается
+# query_log_middleware). Запросы вне обработчиков (например, фоновые) имеют
+# обработчик по умолчанию.
+current_handler = ContextVar('current_handler', default='background')
+
+# Длина текста запроса в записях лога ограничена: запросы, добавляющие
+# жителей, содержат десятки тысяч параметров.
+STATEMENT_MAX_LENGTH = 1024
+
+# EXPLAIN ANALYZE выполняет запрос, поэтому планы получаются только для
+# запросов на чтение (дополнительно они выполняются в транзакции только для
+# чтения): простых SELECT, без WITH (CTE может изменять данные), блокировок
+# строк и функций, изменяющих состояние сессии или получающих блокировки
+# (например, установка statement_timeout).
+EXPLAINABLE_RE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+NOT_EXPLAINABLE_RE = re.compile(
+    r'\b(set_config|pg_advisory_\w+|nextval|setval)\s*\(|'
+    r'\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE)\b|\bFOR\s+KEY\s+SHARE\b',
+    re.IGNORECASE
+)
+
+
+def is_explainable(statement: str) -> bool:
+    return bool(
+        EXPLAINABLE_RE.match(statement) and
+        not NOT_EXPLAINABLE_RE.search(statement)
+    )
+
+
+class QueryLog:
+    def __init__(self, threshold: float, explain_rate: float,
+                 explain_timeout: float):
+        self.threshold = threshold
+        self.explain_rate = explain_rate
+        self.explain_timeout = explain_timeout
+        # Выполняется не более одного EXPLAIN одновременно, чтобы получение
+        # планов не занимало соединения пула, нужные обработчикам.
+        self.explain_task: Optional[asyncio.Task] = None
+
+    def record(self, pg: PG, handler: str, call: str, statement: str,
+               params: Sequence, duration: float, rows: Optional[int]):
+        slow = duration >= self.threshold
+        log.log(
+            logging.WARNING if slow else logging.INFO,
+            'Query handler=%s call=%s duration=%.6f rows=%s statement=%s',
+            handler, call, duration, rows, statement[:STATEMENT_MAX_LENGTH],
+            extra={
+                'handler': handler,
+                'call': call,
+                'duration': duration,
+                'rows': rows,
+                'slow': slow,
+                'statement': statement[:STATEMENT_MAX_LENGTH],
+            }
+        )
+
+        if (
+            slow and self.explain_task is None and
+            is_explainable(statement) and
+            random.random() < self.explain_rate
+        ):
+            self.explain_task = asyncio.ensure_future(
+                self.explain(pg, handler, statement, params, duration)
+            )
+            self.explain_task.add_done_callback(self.on_explained)
+
+    def on_explained(self, _: asyncio.Task):
+        self.explain_task = None
+
+    async def explain(self, pg: PG, handler: str, statement: str,
+                      params: Sequence, duration: float):
+        try:
+            async with pg.transaction(readonly=True) as conn:
+                await conn.execute(
+                    "SELECT set_config('statement_timeout', $1, true)",
+                    str(ceil(self.explain_timeout * 1000))
+                )
+                plan = await conn.fetchval(
+                    'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement,
+                    *params
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.warning('Unable to explain query handler=%s statement=%s',
+                        handler, statement[:STATEMENT_MAX_LENGTH],
+                        exc_info=True)
+            return
+
+        log.warning(
+            'Query plan handler=%s duration=%.6f statement=%s plan=%s',
+            handler, duration, statement[:STATEMENT_MAX_LENGTH], plan,
+            extra={
+                'handler': handler,
+                'duration': duration,
+                'statement': statement[:STATEMENT_MAX_LENGTH],
+                'plan': plan,
+            }
+        )
+
+    async def close(self):
+        if self.explain_task is not None:
+            self.explain_task.cancel()
+            await asyncio.gather(self.explain_task, return_exceptions=True)
+
+
+def compile_statement(query, args: Sequence):
+    """
+    Возвращает текст запроса и его параметры. Запросы SQLAlchemy компилируются
+    один раз: для лога и для выполнения.
+    """
+    if isinstance(query, str):
+        return query, args
+    statement, params = compile_query(query)
+    return statement, params or args
+
+
+def count_rows(result) -> Optional[int]:
+    return len(result) if isinstance(result, list) else None
+
+
+class QueryLogCursor:
+    """
+    Курсор, замеряющий время получения каждой части данных.
+    """
+    __slots__ = ('connection', 'cursor', 'statement', 'params')
+
+    def __init__(self, connection: 'QueryLogConnection', cursor,
+                 statement: str, params: Sequence):
+        self.connection = connection
+        self.cursor = cursor
+        self.statement = statement
+        self.params = params
+
+    async def fetch(self, n: int, *, timeout: float = None):
+        started, rows = monotonic(), None
+        try:
+            rows = await self.cursor.fetch(n, timeout=timeout)
+            return rows
+        finally:
+            self.connection.record('cursor.fetch', self.statement,
+                                   self.params, monotonic() - started,
+                                   count_rows(rows))
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class QueryLogConnection:
+    """
+    Обертка над соединением asyncpgsa, замеряющая время выполнения запросов.
+    Обработчик определяется при создании обертки, поэтому запросы потоковых
+    ответов, выполняемые после выхода из обработчика, относятся к нему.
+    """
+    __slots__ = ('query_log', 'pg', 'connection', 'handler')
+
+    def __init__(self, query_log: QueryLog, pg: PG, connection,
+                 handler: str):
+        self.query_log = query_log
+        self.pg = pg
+        self.connection = connection
+        self.handler = handler
+
+    def record(self, call: str, statement: str, params: Sequence,
+               duration: float, rows: Optional[int]):
+        self.query_log.record(self.pg, self.handler, call, statement, params,
+                              duration, rows)
+
+    async def call(self, call: str, query, *args, **kwargs):
+        statement, params = compile_statement(query, args)
+        # Запросы, завершившиеся ошибкой (в т.ч. отмененные по истечении
+        # срока обработки запроса), также записываются в лог.
+        started, result = monotonic(), None
+        try:
+            result = await getattr(self.connection, call)(
+                statement, *params, **kwargs
+            )
+            return result
+        finally:
+            self.record(call, statement, params, monotonic() - started,
+                        count_rows(result))
+
+    async def execute(self, query, *args, **kwargs):
+        return await self.call('execute', query, *args, **kwargs)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self.call('fetch', query, *args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self.call('fetchrow', query, *args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self.call('fetchval', query, *args, **kwargs)
+
+    async def cursor(self, query, *args, **kwargs) -> QueryLogCursor:
+        statement, params = compile_statement(query, args)
+        started = monotonic()
+        try:
+            cursor = await self.connection.cursor(statement, *params,
+                                                  **kwargs)
+        finally:
+            self.record('cursor', statement, params, monotonic() - started,
+                        None)
+        return QueryLogCursor(self, cursor, statement, params)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class QueryLogTransaction:
+    """
+    Контекстный менеджер транзакции, возвращающий QueryLogConnection.
+    """
+    __slots__ = ('query_log', 'pg', 'transaction_ctx', 'handler')
+
+    def __init__(self, query_log: QueryLog, pg: PG, transaction_ctx):
+        self.query_log = query_log
+        self.pg = pg
+        self.transaction_ctx = transaction_ctx
+        self.handler = current_handler.get()
+
+    async def __aenter__(self) -> QueryLogConnection:
+        connection = await self.transaction_ctx.__aenter__()
+        return QueryLogConnection(self.query_log, self.pg, connection,
+                                  self.handler)
+
+    async def __aexit__(self, *exc_info):
+        return await self.transaction_ctx.__aexit__(*exc_info)
+
+
+class QueryLogPG:
+    """
+    Обертка над asyncpgsa.PG (app['pg'], app['pg_replica']) с теми же методами
+    выполнения запросов.
+    """
+    __slots__ = ('query_log', 'pg')
+
+    def __init__(self, query_log: QueryLog, pg: PG):
+        self.query_log = query_log
+        self.pg = pg
+
+    def transaction(self, **kwargs) -> QueryLogTransaction:
+        return QueryLogTransaction(self.query_log, self.pg,
+                                   self.pg.transaction(**kwargs))
+
+    async def call(self, call: str, query, *args, **kwargs):
+        async with self.pg.pool.acquire() as connection:
+            connection = QueryLogConnection(self.query_log, self.pg,
+                                            connection, current_handler.get())
+            return await connection.call(call, query, *args, **kwargs)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self.call('execute', query, *args, **kwargs)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self.call('fetch', query, *args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self.call('fetchrow', query, *args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self.call('fetchval', query, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.pg, name)
+
+
+async def setup_query_log(app: Application, args: Namespace):
+    """
+    Заменяет подключения к PostgreSQL обертками, записывающими запросы в лог,
+    если журнал запросов включен в настройках приложения. Должен выполняться
+    после подключения к PostgreSQL и до создания объектов, использующих
+    подключения.
+    """
+    if not args.query_log:
+        app['query_log'] = None
+        yield
+        return
+
+    log.info('Logging queries, explaining %.0f%% of queries slower than '
+             '%.3fs', args.query_log_explain_rate * 100,
+             args.query_log_threshold)
+    query_log = app['query_log'] = QueryLog(
+        threshold=args.query_log_threshold,
+        explain_rate=args.query_log_explain_rate,
+        explain_timeout=args.query_log_explain_timeout
+    )
+
+    pg, pg_replica = app['pg'], app['pg_replica']
+    app['pg'] = QueryLogPG(query_log, pg)
+    if pg_replica is not None:
+        app['pg_replica'] = QueryLogPG(query_log, pg_replica)
+    try:
+        yield
+    finally:
+        await query_log.close()
+        app['pg'], app['pg_replica'] = pg, pg_replica
@@ -0,0 +1,98 @@
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Callable
+
+
+log = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Запускает функцию target в заданном кол-ве дочерних процессов (fork) и
+    перезапускает процессы, завершившиеся без команды на остановку.
+
+    Дочерние процессы наследуют открытые файловые дескрипторы родителя
+    (например, сокет, аллоцированный до запуска), поэтому все процессы
+    принимают соединения на одном сокете.
+    """
+
+    def __init__(self, target: Callable[[], None], processes: int,
+                 restart_delay: float = 1.0):
+        self.target = target
+        self.processes = processes
+        # Пауза перед перезапуском процесса, чтобы процессы, падающие сразу
+        # после старта (например, если недоступна БД), не перезапускались
+        # непрерывно.
+        self.restart_delay = restart_delay
+        # pid -> номер процесса
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, number: int):
+        pid = os.fork()
+        if pid:
+            log.info('Started worker #%d (pid %d)', number, pid)
+            self.children[pid] = number
+            return
+
+        # Дочерний процесс: обработчики сигналов родителя не нужны
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 1
+        try:
+            self.target()
+            code = 0
+        except SystemExit as e:
+            # Код завершения определяется так же, как интерпретатором: None -
+            # успешное завершение, не число выводится в stderr с кодом 1.
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            log.exception('Worker #%d failed', number)
+        finally:
+            # Дочерний процесс не должен выполнять код родителя (atexit,
+            # finally-блоки выше по стеку), поэтому завершается через
+            # os._exit, предварительно записав буфферизованные логи.
+            logging.shutdown()
+            os._exit(code)
+
+    def stop(self, signum, frame):
+        log.info('Received signal %d, stopping workers', signum)
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for number in range(self.processes):
+            self.spawn(number)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            number = self.children.pop(pid, None)
+            if number is None or self.stopping:
+                continue
+
+            log.warning('Worker #%d (pid %d) exited with status %d, '
+                        'restarting', number, pid, status)
+            time.sleep(self.restart_delay)
+            if not self.stopping:
+                self.spawn(number)
+
+        log.info('All workers stopped')
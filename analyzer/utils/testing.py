@@ -223,6 +223,26 @@ async def patch_citizen(
         return data['data']
 
 
+async def patch_citizens(
+        client: TestClient,
+        import_id: int,
+        citizens: List[Mapping[str, Any]],
+        expected_status: Union[int, EnumMeta] = HTTPStatus.OK,
+        **request_kwargs
+) -> List[dict]:
+    response = await client.patch(
+        url_for(CitizensView.URL_PATH, import_id=import_id),
+        json={'citizens': citizens},
+        **request_kwargs
+    )
+    assert response.status == expected_status
+    if response.status == HTTPStatus.OK:
+        data = await response.json()
+        errors = CitizensResponseSchema().validate(data)
+        assert errors == {}
+        return data['data']
+
+
 async def get_citizens_birthdays(
         client: TestClient,
         import_id: int,
@@ -241,6 +261,23 @@ async def get_citizens_birthdays(
         return data['data']
 
 
+def town_age_stat_context(params) -> Dict[str, list]:
+    """
+    Возвращает запрошенные перцентили и статистики для проверки ответа
+    TownAgeStatResponseSchema.
+    """
+    if isinstance(params, Mapping):
+        params = params.items()
+
+    context = {}
+    for name, value in params:
+        if name == 'percentiles':
+            context.setdefault(name, []).append(float(value))
+        elif name == 'statistics':
+            context.setdefault(name, []).append(value)
+    return context
+
+
 async def get_citizens_ages(
         client: TestClient,
         import_id: int,
@@ -254,6 +291,8 @@ async def get_citizens_ages(
     assert response.status == expected_status
     if response.status == HTTPStatus.OK:
         data = await response.json()
-        errors = TownAgeStatResponseSchema().validate(data)
+        errors = TownAgeStatResponseSchema(
+            context=town_age_stat_context(request_kwargs.get('params', {}))
+        ).validate(data)
         assert errors == {}
         return data['data']
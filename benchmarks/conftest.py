@@ -0,0 +1,157 @@
+"""
+Бенчмарки обработчиков REST API сервиса.
+
+Используют фикстуры тестов API: временную БД с примененными миграциями и
+клиент API. Для каждого набора данных (кол-во жителей и родственных связей на
+жителя) в БД загружается выгрузка, после чего измеряется время ответа
+обработчиков (последовательные запросы) и пропускная способность
+(конкурентные запросы). Результаты выводятся в конце запуска и могут быть
+сохранены в json (--bench-output) для сравнения между коммитами.
+
+Пример запуска (pytest должен запускаться как модуль, чтобы были доступны
+фикстуры тестов):
+    python -m pytest benchmarks --bench-sizes=1000,10000 \\
+        --bench-output=bench.json
+"""
+import json
+from typing import List, NamedTuple
+
+import pytest
+from asyncpgsa import PG
+
+from analyzer.api.__main__ import parser
+from analyzer.utils.dataset import CitizensGenerator, load_citizens
+from tests.api.conftest import api_client, migrated_postgres  # noqa: F401
+from tests.conftest import alembic_config, postgres  # noqa: F401
+
+
+# Результаты всех бенчмарков запуска
+RESULTS = []
+
+TOWNS_NUM = 20
+
+
+class Dataset(NamedTuple):
+    citizens_num: int
+    # Среднее кол-во родственников у жителя
+    density: float
+
+    @property
+    def name(self) -> str:
+        return 'citizens=%d,density=%g' % (self.citizens_num, self.density)
+
+
+class LoadedDataset(NamedTuple):
+    dataset: Dataset
+    import_id: int
+    citizen_ids: List[int]
+    citizens: List[dict]
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench-sizes', default='1000,10000,100000',
+                    help='Comma separated numbers of citizens in import')
+    group.addoption('--bench-densities', default='0.2,2',
+                    help='Comma separated average numbers of relatives of '
+                         'citizen')
+    group.addoption('--bench-requests', type=int, default=50,
+                    help='Number of requests to each handler')
+    group.addoption('--bench-concurrency', type=int, default=4,
+                    help='Number of concurrent requests to measure '
+                         'throughput')
+    group.addoption('--bench-seed', type=int, default=0)
+    group.addoption('--bench-output', help='Save results to JSON file')
+
+
+def pytest_generate_tests(metafunc):
+    if 'dataset' not in metafunc.fixturenames:
+        return
+
+    config = metafunc.config
+    datasets = [
+        Dataset(int(size), float(density))
+        for size in config.getoption('bench_sizes').split(',')
+        for density in config.getoption('bench_densities').split(',')
+    ]
+    metafunc.parametrize('dataset', datasets,
+                         ids=[dataset.name for dataset in datasets])
+
+
+@pytest.fixture
+def arguments(aiomisc_unused_port, migrated_postgres):  # noqa: F811
+    """
+    Аргументы для запуска приложения: кэш статистики отключен, чтобы
+    измерялся расчет статистики, а не кэш.
+    """
+    return parser.parse_args([
+        '--log-level=warning',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={migrated_postgres}',
+        '--town-stat-cache-size=0',
+    ])
+
+
+async def load_dataset(pg_url: str, citizens: List[dict]) -> int:
+    pg = PG()
+    await pg.init(pg_url, min_size=1, max_size=1)
+    try:
+        async with pg.transaction() as conn:
+            import_id = await load_citizens(conn, citizens)
+        await pg.execute('ANALYZE')
+    finally:
+        await pg.pool.close()
+    return import_id
+
+
+@pytest.fixture
+async def loaded_dataset(dataset, migrated_postgres,  # noqa: F811
+                         request) -> LoadedDataset:
+    generator = CitizensGenerator(seed=request.config.getoption('bench_seed'),
+                                  unique_towns=TOWNS_NUM)
+    citizens = generator.generate(
+        citizens_num=dataset.citizens_num,
+        relations_num=int(dataset.citizens_num * dataset.density / 2),
+        start_citizen_id=1
+    )
+    import_id = await load_dataset(migrated_postgres, citizens)
+    citizen_ids = [citizen['citizen_id'] for citizen in citizens]
+    return LoadedDataset(dataset, import_id, citizen_ids, citizens)
+
+
+@pytest.fixture
+def bench_results() -> list:
+    return RESULTS
+
+
+@pytest.fixture
+def bench_options(request) -> dict:
+    return {
+        'requests': request.config.getoption('bench_requests'),
+        'concurrency': request.config.getoption('bench_concurrency'),
+        'seed': request.config.getoption('bench_seed'),
+    }
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+
+    terminalreporter.section('benchmarks')
+    terminalreporter.write_line('%-32s %-30s %9s %9s %9s %9s' % (
+        'dataset', 'scenario', 'p50, ms', 'p90, ms', 'p99, ms', 'rps'
+    ))
+    for result in RESULTS:
+        terminalreporter.write_line('%-32s %-30s %9.1f %9.1f %9.1f %9.1f' % (
+            result['dataset'], result['scenario'],
+            result['latency']['p50'] * 1000, result['latency']['p90'] * 1000,
+            result['latency']['p99'] * 1000, result['throughput']
+        ))
+
+
+def pytest_sessionfinish(session):
+    output = session.config.getoption('bench_output')
+    if output and RESULTS:
+        with open(output, 'w') as fp:
+            json.dump({'results': RESULTS}, fp, indent=2, ensure_ascii=False)
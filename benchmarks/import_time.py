@@ -0,0 +1,136 @@
+"""
+Измеряет время запуска REST API сервиса: время импорта analyzer.api.__main__
+(отчет в формате python -X importtime), создания приложения и построения
+спецификации OpenAPI (см. --api-docs).
+
+Импорт измеряется в отдельных процессах python, выводится медианное время и
+модули с наибольшим суммарным (cumulative) временем импорта в медианном
+запуске. Результаты можно сохранить в json для сравнения между коммитами.
+
+Пример запуска:
+    python benchmarks/import_time.py --repeat 10 --output import_time.json
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+from time import monotonic
+
+
+PROJECT_PATH = Path(__file__).parent.parent.resolve()
+MODULE = 'analyzer.api.__main__'
+
+# Строка отчета -X importtime:
+# import time: self [us] | cumulative | imported package
+IMPORT_TIME_RE = re.compile(
+    r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$', re.M
+)
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument('--module', default=MODULE,
+                    help='Module to measure import time of')
+parser.add_argument('--repeat', type=int, default=5,
+                    help='Number of python processes to run')
+parser.add_argument('--top', type=int, default=20,
+                    help='Number of slowest imported modules to show')
+parser.add_argument('--output', type=Path,
+                    help='Save results to JSON file')
+
+
+def profile_import(module: str) -> list:
+    """
+    Импортирует модуль в новом процессе python и возвращает отчет
+    -X importtime: список (модуль, собственное и суммарное время в
+    микросекундах, уровень вложенности).
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_PATH, stderr=subprocess.PIPE, check=True,
+        universal_newlines=True
+    )
+    return [
+        (name, int(self_us), int(cumulative_us), len(indent) // 2)
+        for self_us, cumulative_us, indent, name
+        in IMPORT_TIME_RE.findall(result.stderr)
+    ]
+
+
+def total_time(report: list) -> int:
+    # Суммарное время импорта модулей верхнего уровня, включая модули,
+    # импортируемые интерпретатором при запуске
+    return sum(cumulative for _, _, cumulative, level in report if level == 0)
+
+
+def measure_app() -> dict:
+    """
+    Измеряет время создания приложения и построения спецификации OpenAPI.
+    Подключение к БД при этом не требуется.
+    """
+    sys.path.insert(0, str(PROJECT_PATH))
+    from analyzer.api.__main__ import parser as api_parser
+    from analyzer.api.app import create_app
+
+    args = api_parser.parse_args(['--api-docs=lazy'])
+    started = monotonic()
+    app = create_app(args)
+    create_time = monotonic() - started
+
+    started = monotonic()
+    app['docs'].build(app)
+    return {
+        'create_app': create_time,
+        'build_spec': monotonic() - started,
+    }
+
+
+def main():
+    args = parser.parse_args()
+
+    reports = sorted(
+        (profile_import(args.module) for _ in range(args.repeat)),
+        key=total_time
+    )
+    report = reports[len(reports) // 2]
+    totals = [total_time(item) / 1e6 for item in reports]
+
+    print('Import %s: median %.3fs, min %.3fs, max %.3fs' % (
+        args.module, median(totals), min(totals), max(totals)
+    ))
+    print()
+    print('%12s %12s  %s' % ('self, ms', 'cumul., ms', 'module'))
+    slowest = sorted(report, key=lambda item: item[2], reverse=True)
+    for name, self_us, cumulative_us, level in slowest[:args.top]:
+        print('%12.1f %12.1f  %s%s' % (
+            self_us / 1000, cumulative_us / 1000, '  ' * level, name
+        ))
+
+    app_times = measure_app()
+    print()
+    print('create_app: %.3fs' % app_times['create_app'])
+    print('Build OpenAPI spec: %.3fs' % app_times['build_spec'])
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({
+            'module': args.module,
+            'import': {
+                'median': median(totals),
+                'min': min(totals),
+                'max': max(totals),
+                'modules': {
+                    name: {'self': self_us / 1e6,
+                           'cumulative': cumulative_us / 1e6}
+                    for name, self_us, cumulative_us, _ in report
+                },
+            },
+            **app_times,
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Проверка производительности обработчиков на регрессии.
+
+Запускает бенчмарки обработчиков (python -m pytest benchmarks) и сравнивает
+время ответа (p50, p99) и пропускную способность каждого сценария на каждом
+наборе данных с сохраненными в репозитории результатами (baseline). Выводит
+таблицу изменений и завершается с ненулевым кодом, если изменения превышают
+допустимые, если baseline отсутствует или если сценарий есть только в одном
+из наборов результатов.
+
+Результаты зависят от оборудования: baseline необходимо записывать
+(--update-baseline) на той же машине, на которой выполняется проверка.
+Аргументы после -- передаются pytest и сохраняются в baseline; если они не
+указаны, бенчмарки запускаются с аргументами baseline.
+
+Пример запуска:
+    python benchmarks/regression.py --update-baseline -- --bench-sizes=1000
+    python benchmarks/regression.py
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+PROJECT_PATH = Path(__file__).parent.parent.resolve()
+
+# Ухудшение времени ответа - увеличение, пропускной способности - уменьшение
+LATENCY_METRICS = ('p50', 'p99')
+THROUGHPUT_METRIC = 'throughput'
+
+Key = Tuple[str, str]
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument('--baseline', type=Path,
+                    default=PROJECT_PATH / 'benchmarks' / 'baseline.json',
+                    help='Stored benchmark results to compare with')
+parser.add_argument('--results', type=Path,
+                    help='Compare existing benchmark results (--bench-output) '
+                         'instead of running benchmarks')
+parser.add_argument('--update-baseline', action='store_true',
+                    help='Save results as new baseline instead of comparing')
+parser.add_argument('--p50-tolerance', type=float, default=0.2,
+                    help='Allowed relative increase of median response time')
+parser.add_argument('--p99-tolerance', type=float, default=0.5,
+                    help='Allowed relative increase of 99th percentile of '
+                         'response time')
+parser.add_argument('--throughput-tolerance', type=float, default=0.2,
+                    help='Allowed relative decrease of throughput')
+parser.add_argument('--min-latency-delta', type=float, default=0.001,
+                    help='Response time increase (in seconds) which is '
+                         'always tolerated, e.g. for fast handlers')
+parser.add_argument('pytest_args', nargs='*',
+                    help='Additional arguments for pytest (after --)')
+
+
+def run_benchmarks(output: Path, pytest_args: List[str]):
+    subprocess.run(
+        [
+            sys.executable, '-m', 'pytest', 'benchmarks',
+            f'--bench-output={output}', *pytest_args
+        ],
+        cwd=PROJECT_PATH, check=True
+    )
+
+
+def load_results(path: Path) -> Dict[Key, dict]:
+    with open(path) as fp:
+        results = json.load(fp)['results']
+    return {
+        (result['dataset'], result['scenario']): result
+        for result in results
+    }
+
+
+def load_pytest_args(path: Path) -> List[str]:
+    with open(path) as fp:
+        return json.load(fp).get('pytest_args', [])
+
+
+def save_baseline(path: Path, results_path: Path, pytest_args: List[str]):
+    with open(results_path) as fp:
+        results = json.load(fp)
+    results['pytest_args'] = pytest_args
+    with open(path, 'w') as fp:
+        json.dump(results, fp, indent=2, ensure_ascii=False)
+        fp.write('\n')
+
+
+def change(baseline: float, current: float) -> float:
+    return (current - baseline) / baseline if baseline else 0
+
+
+def compare(args, baseline: dict, current: dict) -> List[str]:
+    """
+    Возвращает метрики сценария, ухудшившиеся больше допустимого.
+    """
+    regressions = []
+    for metric in LATENCY_METRICS:
+        before = baseline['latency'][metric]
+        after = current['latency'][metric]
+        tolerance = getattr(args, f'{metric}_tolerance')
+        if (
+            change(before, after) > tolerance and
+            after - before > args.min_latency_delta
+        ):
+            regressions.append(metric)
+
+    before = baseline[THROUGHPUT_METRIC]
+    after = current[THROUGHPUT_METRIC]
+    if -change(before, after) > args.throughput_tolerance:
+        regressions.append(THROUGHPUT_METRIC)
+    return regressions
+
+
+def format_value(baseline: Optional[dict], current: Optional[dict],
+                 metric: str) -> str:
+    def get(result):
+        if metric == THROUGHPUT_METRIC:
+            return result[metric]
+        # Время ответа выводится в миллисекундах
+        return result['latency'][metric] * 1000
+
+    if baseline is None or current is None:
+        return '%.1f' % get(baseline or current)
+
+    before, after = get(baseline), get(current)
+    return '%.1f→%.1f (%+.0f%%)' % (before, after,
+                                    change(before, after) * 100)
+
+
+def report(args, baseline: Dict[Key, dict],
+           current: Dict[Key, dict]) -> bool:
+    """
+    Выводит таблицу изменений по сценариям и возвращает True, если найдены
+    регрессии или сценарии, которые есть только в одном из наборов.
+    """
+    row = '%-28s %-36s %-24s %-24s %-24s %s'
+    print(row % ('dataset', 'scenario', 'p50, ms', 'p99, ms', 'rps',
+                 'status'))
+
+    failed = False
+    for key in sorted(baseline.keys() | current.keys()):
+        before, after = baseline.get(key), current.get(key)
+        if before is None:
+            # Сценарий необходимо добавить в baseline (--update-baseline)
+            failed = True
+            status = 'NEW'
+        elif after is None:
+            failed = True
+            status = 'MISSING'
+        else:
+            regressions = compare(args, before, after)
+            status = 'ok'
+            if regressions:
+                failed = True
+                status = 'REGRESSION (%s)' % ', '.join(regressions)
+
+        print(row % (*key, *(
+            format_value(before, after, metric)
+            for metric in (*LATENCY_METRICS, THROUGHPUT_METRIC)
+        ), status))
+    return failed
+
+
+def main():
+    args = parser.parse_args()
+    pytest_args = args.pytest_args
+    if not args.update_baseline:
+        if not args.baseline.exists():
+            parser.error(f'Baseline {args.baseline} does not exist, record '
+                         f'it with --update-baseline')
+        pytest_args = pytest_args or load_pytest_args(args.baseline)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results_path = args.results
+        if results_path is None:
+            results_path = Path(tmp) / 'results.json'
+            run_benchmarks(results_path, pytest_args)
+
+        if args.update_baseline:
+            save_baseline(args.baseline, results_path, pytest_args)
+            print(f'Baseline saved to {args.baseline}')
+            return
+
+        current = load_results(results_path)
+
+    if report(args, load_results(args.baseline), current):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import asyncio
+import random
+from http import HTTPStatus
+from math import ceil
+from time import monotonic
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List
+
+from aiohttp.test_utils import TestClient
+
+from analyzer.api.handlers import (
+    HANDLERS, CitizenBirthdaysView, CitizensView, CitizenView, ImportsView,
+    MetricsView, ProfileView, TownAgeStatView,
+)
+from analyzer.utils.testing import url_for
+
+
+# Максимальное кол-во жителей в выгрузке (см. ImportSchema)
+MAX_IMPORT_CITIZENS = 10000
+# Кол-во жителей, изменяемых одним запросом к CitizensView.patch
+PATCH_CITIZENS_NUM = 100
+# Загрузка выгрузок выполняется дольше остальных запросов, поэтому их
+# выполняется меньше
+IMPORT_REQUESTS_DIVIDER = 10
+
+# Обработчики, для которых бенчмарк не выполняется
+EXCLUDED_HANDLERS = {
+    # Выполняется заданное в запросе время
+    ProfileView,
+}
+
+Request = Callable[[TestClient, random.Random], Awaitable[None]]
+
+
+async def check(response, expected_status=HTTPStatus.OK):
+    # Ответ читается целиком: время получения тела потоковых ответов входит
+    # во время ответа
+    await response.read()
+    assert response.status == expected_status
+
+
+def make_scenarios(data) -> Dict[str, Request]:
+    """
+    Возвращает обработчики и запросы к ним для загруженного набора данных
+    (LoadedDataset) по названию сценария (HTTP-метод и путь обработчика).
+    """
+    import_id = data.import_id
+    citizen_ids = data.citizen_ids
+    scenarios = {}
+
+    # Выгрузка загружается из первых жителей набора данных (без
+    # родственников за пределами загружаемой части)
+    import_citizens = data.citizens[:MAX_IMPORT_CITIZENS]
+    import_ids = {citizen['citizen_id'] for citizen in import_citizens}
+    import_citizens = [
+        {**citizen, 'relatives': [
+            relative_id for relative_id in citizen['relatives']
+            if relative_id in import_ids
+        ]}
+        for citizen in import_citizens
+    ]
+
+    async def get(client, _, path, **params):
+        await check(await client.get(url_for(path, import_id=import_id),
+                                     params=params))
+
+    async def post_import(client, _):
+        await check(await client.post(ImportsView.URL_PATH,
+                                      json={'citizens': import_citizens}),
+                    HTTPStatus.CREATED)
+
+    async def patch_citizen(client, rnd):
+        citizen_id = rnd.choice(citizen_ids)
+        url = url_for(CitizenView.URL_PATH, import_id=import_id,
+                      citizen_id=citizen_id)
+        await check(await client.patch(url, json={
+            'name': 'Житель %d' % rnd.randrange(10 ** 6)
+        }))
+
+    async def patch_citizens(client, rnd):
+        citizens = [
+            {'citizen_id': citizen_id,
+             'name': 'Житель %d' % rnd.randrange(10 ** 6)}
+            for citizen_id in rnd.sample(
+                citizen_ids, min(PATCH_CITIZENS_NUM, len(citizen_ids))
+            )
+        ]
+        url = url_for(CitizensView.URL_PATH, import_id=import_id)
+        await check(await client.patch(url, json={'citizens': citizens}))
+
+    async def get_metrics(client, _):
+        await check(await client.get(MetricsView.URL_PATH))
+
+    def scenario(handler, method: str, request: Request, **params):
+        name = '%s %s' % (method, handler.URL_PATH)
+        if params:
+            name += '?' + '&'.join('%s=%s' % item for item in params.items())
+        scenarios[name] = (handler, request)
+
+    scenario(ImportsView, 'POST', post_import)
+    scenario(CitizensView, 'GET', lambda client, rnd: get(
+        client, rnd, CitizensView.URL_PATH
+    ))
+    scenario(CitizensView, 'PATCH', patch_citizens)
+    scenario(CitizenView, 'PATCH', patch_citizen)
+    scenario(CitizenBirthdaysView, 'GET', lambda client, rnd: get(
+        client, rnd, CitizenBirthdaysView.URL_PATH
+    ))
+    scenario(TownAgeStatView, 'GET', lambda client, rnd: get(
+        client, rnd, TownAgeStatView.URL_PATH
+    ))
+    scenario(TownAgeStatView, 'GET', lambda client, rnd: get(
+        client, rnd, TownAgeStatView.URL_PATH, approximate='true'
+    ), approximate='true')
+    scenario(MetricsView, 'GET', get_metrics)
+    return scenarios
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга.
+    """
+    values = sorted(values)
+    rank = max(ceil(percent / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+async def measure(client: TestClient, request: Request, requests_num: int,
+                  concurrency: int, rnd: random.Random) -> dict:
+    # Прогрев (в т.ч. подготовка запросов в соединениях с БД)
+    await request(client, rnd)
+
+    # Время ответа измеряется на последовательных запросах
+    timings = []
+    for _ in range(requests_num):
+        started = monotonic()
+        await request(client, rnd)
+        timings.append(monotonic() - started)
+
+    # Пропускная способность - на конкурентных запросах
+    remaining = requests_num
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await request(client, rnd)
+
+    started = monotonic()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = monotonic() - started
+
+    return {
+        'requests': requests_num,
+        'latency': {
+            'mean': sum(timings) / len(timings),
+            'p50': percentile(timings, 50),
+            'p90': percentile(timings, 90),
+            'p99': percentile(timings, 99),
+            'max': max(timings),
+        },
+        'throughput': requests_num / elapsed,
+    }
+
+
+def test_scenarios_cover_handlers():
+    data = SimpleNamespace(import_id=0, citizen_ids=[], citizens=[])
+    scenarios = make_scenarios(data)
+    covered = {handler for handler, _ in scenarios.values()}
+    assert covered | EXCLUDED_HANDLERS == set(HANDLERS)
+
+
+async def test_handlers(api_client, loaded_dataset, bench_options,
+                        bench_results):
+    rnd = random.Random(bench_options['seed'])
+    scenarios = make_scenarios(loaded_dataset)
+    for name, (handler, request) in scenarios.items():
+        requests_num = bench_options['requests']
+        if handler is ImportsView:
+            requests_num = max(requests_num // IMPORT_REQUESTS_DIVIDER, 1)
+
+        result = await measure(api_client, request, requests_num,
+                               bench_options['concurrency'], rnd)
+        bench_results.append({
+            'dataset': loaded_dataset.dataset.name,
+            'citizens': loaded_dataset.dataset.citizens_num,
+            'density': loaded_dataset.dataset.density,
+            'scenario': name,
+            **result,
+        })
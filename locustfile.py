@@ -7,25 +7,29 @@ from locust.exception import RescheduleTask
 from analyzer.api.handlers import (
     CitizenBirthdaysView, CitizensView, CitizenView, TownAgeStatView,
 )
-from analyzer.utils.testing import generate_citizen, generate_citizens, url_for
+from analyzer.utils.dataset import CitizensGenerator
+from analyzer.utils.testing import generate_citizen, url_for
 
 
 class AnalyzerTaskSet(TaskSet):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.round = 0
+        # Генерация выгрузки не должна занимать процессор клиента во время
+        # нагрузки: наборы имен и городов готовятся один раз
+        self.generator = CitizensGenerator(seed=0)
 
     def make_dataset(self):
         citizens = [
             # Первого жителя создаем с родственником. В запросе к
             # PATCH-обработчику список relatives будет содержать только другого
-            # жителя, что потребует выполнения максимального кол-ва запросов
-            # (как на добавление новой родственной связи, так и на удаление
+            # жителя, что потребует максимального объема изменений (как
+            # добавления новой родственной связи, так и удаления
             # существующей).
             generate_citizen(citizen_id=1, relatives=[2]),
             generate_citizen(citizen_id=2, relatives=[1]),
-            *generate_citizens(citizens_num=9998, relations_num=1000,
-                               start_citizen_id=3)
+            *self.generator.generate(citizens_num=9998, relations_num=1000,
+                                     start_citizen_id=3)
         ]
         return {citizen['citizen_id']: citizen for citizen in citizens}
 
@@ -48,7 +48,11 @@ setup(
     python_requires='>=3.8',
     packages=find_packages(exclude=['tests']),
     install_requires=load_requirements('requirements.txt'),
-    extras_require={'dev': load_requirements('requirements.dev.txt')},
+    extras_require={
+        'analytics': ['numpy'],
+        'uvloop': ['uvloop'],
+        'dev': load_requirements('requirements.dev.txt'),
+    },
     entry_points={
         'console_scripts': [
             # f-strings в setup.py не используются из-за соображений
@@ -58,7 +62,8 @@ setup(
             # ранних версий python, не стоит лишать пользователей этой
             # возможности.
             '{0}-api = {0}.api.__main__:main'.format(module_name),
-            '{0}-db = {0}.db.__main__:main'.format(module_name)
+            '{0}-db = {0}.db.__main__:main'.format(module_name),
+            '{0}-db-check = {0}.db.check:main'.format(module_name)
         ]
     },
     include_package_data=True
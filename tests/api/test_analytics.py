@@ -0,0 +1,125 @@
+"""
+Аналитический движок должен возвращать те же результаты, что и SQL-запросы
+обработчиков.
+"""
+from copy import copy
+from datetime import date
+
+import pytest
+
+from analyzer.api.analytics import AnalyticsEngine, ImportAnalytics
+from analyzer.api.app import create_app
+from analyzer.api.schema import BIRTH_DATE_FORMAT
+from analyzer.utils.testing import (
+    generate_citizen, generate_citizens, get_citizens_ages,
+    get_citizens_birthdays, import_data, patch_citizen,
+)
+
+
+pytest.importorskip('numpy')
+
+AGE_STAT_PARAMS = [
+    ('percentiles', '10'), ('percentiles', '90'), ('percentiles', '33.3'),
+    ('statistics', 'mean'), ('statistics', 'min'), ('statistics', 'max'),
+    ('statistics', 'count'),
+]
+
+
+@pytest.fixture
+async def analytics_client(aiohttp_client, arguments):
+    arguments = copy(arguments)
+    arguments.analytics_engine = True
+    client = await aiohttp_client(create_app(arguments))
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+async def compare_stats(sql_client, analytics_client, import_id):
+    expected = await get_citizens_birthdays(sql_client, import_id)
+    actual = await get_citizens_birthdays(analytics_client, import_id)
+    assert expected.keys() == actual.keys()
+    for month in expected:
+        assert (
+            sorted(expected[month], key=lambda i: i['citizen_id']) ==
+            sorted(actual[month], key=lambda i: i['citizen_id'])
+        )
+
+    for params in ({}, AGE_STAT_PARAMS):
+        expected = await get_citizens_ages(sql_client, import_id,
+                                           params=params)
+        actual = await get_citizens_ages(analytics_client, import_id,
+                                         params=params)
+        assert (
+            sorted(expected, key=lambda i: i['town']) ==
+            sorted(actual, key=lambda i: i['town'])
+        )
+
+
+async def test_analytics(api_client, analytics_client):
+    today = date.today()
+    citizens = [
+        # Житель сам себе родственник
+        generate_citizen(citizen_id=1, relatives=[1]),
+        # Дни рождения сегодня и 29 февраля
+        generate_citizen(citizen_id=2, town='Москва',
+                         birth_date=today.replace(year=2000)
+                         .strftime(BIRTH_DATE_FORMAT)),
+        generate_citizen(citizen_id=3, town='Москва',
+                         birth_date='29.02.2000'),
+        *generate_citizens(citizens_num=300, relations_num=500,
+                           unique_towns=5, start_citizen_id=4)
+    ]
+    import_id = await import_data(api_client, citizens)
+    await compare_stats(api_client, analytics_client, import_id)
+
+    # Движок должен сбрасывать данные выгрузки при ее изменении
+    await patch_citizen(analytics_client, import_id, 4, data={
+        'birth_date': '01.01.1950', 'town': 'Москва', 'relatives': [1, 2, 3]
+    })
+    await compare_stats(api_client, analytics_client, import_id)
+
+    # Изменения, сделанные другим процессом (другим экземпляром приложения),
+    # определяются по поколению выгрузки
+    await patch_citizen(api_client, import_id, 5, data={
+        'birth_date': '01.06.1960', 'relatives': [1]
+    })
+    await compare_stats(api_client, analytics_client, import_id)
+
+
+async def test_analytics_empty_import(api_client, analytics_client):
+    import_id = await import_data(api_client, [])
+    await compare_stats(api_client, analytics_client, import_id)
+
+
+def make_import_analytics(citizens_num: int) -> ImportAnalytics:
+    citizen_rows = [
+        {'citizen_id': i, 'birth_date': date(2000, 1, 1), 'town': 'Москва'}
+        for i in range(citizens_num)
+    ]
+    return ImportAnalytics.from_rows(citizen_rows, [])
+
+
+def test_analytics_engine_eviction():
+    data = make_import_analytics(100)
+    engine = AnalyticsEngine(pg=None, memory_limit=data.nbytes * 2)
+
+    engine.store(1, data)
+    engine.store(2, make_import_analytics(100))
+    assert list(engine.imports) == [1, 2]
+
+    # Выгрузка, которая не помещается в память, не сохраняется
+    engine.store(3, make_import_analytics(1000))
+    assert list(engine.imports) == [1, 2]
+
+    # Вытесняется наименее востребованная выгрузка
+    engine.imports.move_to_end(1)
+    engine.store(4, make_import_analytics(100))
+    assert list(engine.imports) == [1, 4]
+    assert engine.memory_used == data.nbytes * 2
+
+    engine.invalidate(1)
+    assert list(engine.imports) == [4]
+    assert engine.memory_used == data.nbytes
@@ -1,13 +1,34 @@
+from copy import copy
 from http import HTTPStatus
 from typing import Any, Mapping
 
 import pytest
 
+from analyzer.api.app import create_app
+from analyzer.db.check import find_presents_mismatches
 from analyzer.utils.testing import (
-    generate_citizen, get_citizens_birthdays, import_data,
+    generate_citizen, generate_citizens, get_citizens_birthdays, import_data,
+    patch_citizen, patch_citizens,
 )
 
 
+@pytest.fixture(params=[False, True], ids=['json-in-python', 'json-in-db'])
+async def api_client(request, aiohttp_client, arguments):
+    """
+    Тесты выполняются для обоих способов формирования ответа.
+    """
+    arguments = copy(arguments)
+    arguments.birthdays_json_in_db = request.param
+    client = await aiohttp_client(create_app(arguments), server_kwargs={
+        'port': arguments.api_port
+    })
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
 def make_response(values: Mapping[str, Any] = None):
     """
     Генерирует словарь, в котором ключи месяцы, а значения по умолчанию - [].
@@ -106,3 +127,89 @@ async def test_get_citizens_birthdays(api_client, dataset):
 
 async def test_get_nonexistent_import_birthdays(api_client):
     await get_citizens_birthdays(api_client, 999, HTTPStatus.NOT_FOUND)
+
+
+async def test_get_citizens_birthdays_after_patch(
+        api_client, migrated_postgres_connection
+):
+    """
+    Статистика должна обновляться при изменении дат рождения и родственных
+    связей жителей.
+    """
+    citizens = [
+        generate_citizen(citizen_id=1, birth_date='31.12.2019',
+                         relatives=[2, 3]),
+        generate_citizen(citizen_id=2, birth_date='11.02.2020',
+                         relatives=[1]),
+        generate_citizen(citizen_id=3, birth_date='17.02.2020',
+                         relatives=[1]),
+        generate_citizen(citizen_id=4, birth_date='01.03.2020',
+                         relatives=[]),
+    ]
+    import_id = await import_data(api_client, citizens)
+
+    # Житель #1 меняет месяц рождения, родственников (#3 -> #4) и становится
+    # сам себе родственником.
+    await patch_citizen(api_client, import_id, 1, data={
+        'birth_date': '01.02.2020', 'relatives': [1, 2, 4]
+    })
+    # Житель #2 меняет только месяц рождения
+    await patch_citizen(api_client, import_id, 2,
+                        data={'birth_date': '05.05.2019'})
+
+    expected = make_response({
+        '2': [
+            {'citizen_id': 1, 'presents': 1},
+            {'citizen_id': 2, 'presents': 1},
+            {'citizen_id': 4, 'presents': 1},
+        ],
+        '3': [
+            {'citizen_id': 1, 'presents': 1},
+        ],
+        '5': [
+            {'citizen_id': 1, 'presents': 1},
+        ],
+    })
+
+    result = await get_citizens_birthdays(api_client, import_id)
+    for month in expected:
+        actual = {
+            (citizen['citizen_id'], citizen['presents'])
+            for citizen in result[month]
+        }
+        assert actual == {
+            (citizen['citizen_id'], citizen['presents'])
+            for citizen in expected[month]
+        }
+
+    assert find_presents_mismatches(migrated_postgres_connection) == []
+
+
+async def test_citizens_birthdays_consistency(api_client,
+                                              migrated_postgres_connection):
+    """
+    После множества изменений таблица presents должна совпадать с полным
+    пересчетом статистики.
+    """
+    citizens = generate_citizens(citizens_num=50, relations_num=100,
+                                 start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+
+    for citizen in citizens[:10]:
+        await patch_citizen(api_client, import_id, citizen['citizen_id'], {
+            'birth_date': '01.%02d.2000' % (citizen['citizen_id'] % 12 + 1),
+            'relatives': [
+                relative_id for relative_id in citizen['relatives']
+                if relative_id % 2
+            ] + [citizen['citizen_id']]
+        })
+
+    await patch_citizens(api_client, import_id, [
+        {'citizen_id': 20, 'birth_date': '01.01.2000', 'relatives': [21, 22]},
+        {'citizen_id': 21, 'relatives': [20]},
+        {'citizen_id': 22, 'relatives': [20, 23]},
+        {'citizen_id': 30, 'birth_date': '01.06.2000'},
+    ])
+
+    assert find_presents_mismatches(migrated_postgres_connection,
+                                    import_id) == []
@@ -4,6 +4,7 @@ from http import HTTPStatus
 import pytest
 
 from analyzer.api.schema import BIRTH_DATE_FORMAT
+from analyzer.db.lookups import LOOKUP_TABLES, insert_names_query
 from analyzer.db.schema import citizens_table, imports_table, relations_table
 from analyzer.utils.testing import (
     compare_citizen_groups, generate_citizen, get_citizens,
@@ -39,9 +40,19 @@ datasets = [
 ]
 
 
+def insert_addresses(connection, import_id, citizens):
+    address_ids = {}
+    for field, table in LOOKUP_TABLES.items():
+        names = list({citizen[field] for citizen in citizens})
+        rows = connection.execute(insert_names_query(table, import_id, names))
+        address_ids[field] = {row['name']: row[0] for row in rows}
+    return address_ids
+
+
 def import_dataset(connection, citizens) -> int:
     query = imports_table.insert().returning(imports_table.c.import_id)
     import_id = connection.execute(query).scalar()
+    address_ids = insert_addresses(connection, import_id, citizens)
 
     citizen_rows = []
     relations_rows = []
@@ -54,9 +65,9 @@ def import_dataset(connection, citizens) -> int:
                 citizen['birth_date'], BIRTH_DATE_FORMAT
             ).date(),
             'gender': citizen['gender'],
-            'town': citizen['town'],
-            'street': citizen['street'],
-            'building': citizen['building'],
+            'town_id': address_ids['town'][citizen['town']],
+            'street_id': address_ids['street'][citizen['street']],
+            'building_id': address_ids['building'][citizen['building']],
             'apartment': citizen['apartment'],
         })
 
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import func, select
+
+from analyzer.api.__main__ import parser
+from analyzer.api.app import create_app
+from analyzer.api.handlers import TownAgeStatView
+from analyzer.api.metrics import DEADLINES_EXCEEDED, REQUESTS_CANCELLED
+from analyzer.utils.testing import generate_citizens, import_data, url_for
+
+
+# Запрос статистики, выполняющийся дольше любого срока в тестах
+SLOW_QUERY = classmethod(lambda cls, *args: select([func.pg_sleep(30)]))
+
+
+# Статистика рассчитывается без кэша и через кэш, где расчет выполняется
+# отдельной задачей, общей для конкурентных запросов
+@pytest.fixture(params=[0, 1024], ids=['no-cache', 'cache'])
+def arguments(request, aiomisc_unused_port, migrated_postgres):
+    return parser.parse_args([
+        '--log-level=debug',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={migrated_postgres}',
+        '--deadline-reads=0.5',
+        f'--town-stat-cache-size={request.param}',
+    ])
+
+
+async def wait_queries_cancelled(connection, timeout: float = 5):
+    """
+    Ожидает, пока PostgreSQL остановит выполнение медленных запросов.
+    """
+    query = '''
+        SELECT count(*) FROM pg_stat_activity
+        WHERE datname = current_database() AND state = 'active' AND
+              pid <> pg_backend_pid() AND position('pg_sleep' in query) > 0
+    '''
+    deadline = time.monotonic() + timeout
+    while True:
+        # Статистика pg_stat_activity сохраняется на время транзакции
+        connection.execute('SELECT pg_stat_clear_snapshot()')
+        if not connection.execute(query).scalar():
+            return
+        assert time.monotonic() < deadline, 'Query was not cancelled'
+        await asyncio.sleep(0.05)
+
+
+async def test_deadline_exceeded(api_client, migrated_postgres_connection):
+    import_id = await import_data(api_client, generate_citizens(
+        citizens_num=3, start_citizen_id=1
+    ))
+    exceeded = DEADLINES_EXCEEDED.labels(
+        '/imports/{import_id}/towns/stat/percentile/age'
+    )
+    exceeded_before = exceeded.value
+
+    with patch.object(TownAgeStatView, 'exact_query', SLOW_QUERY):
+        started = time.monotonic()
+        response = await api_client.get(
+            url_for(TownAgeStatView.URL_PATH, import_id=import_id)
+        )
+        assert response.status == HTTPStatus.GATEWAY_TIMEOUT
+        assert time.monotonic() - started < 5
+
+    await wait_queries_cancelled(migrated_postgres_connection)
+    assert exceeded.value == exceeded_before + 1
+
+
+async def test_client_disconnect(aiohttp_client, arguments,
+                                 migrated_postgres_connection):
+    # Без срока обработки запрос отменяется только при отключении клиента
+    arguments.deadline_reads = 0
+    client = await aiohttp_client(create_app(arguments), server_kwargs={
+        'port': arguments.api_port
+    })
+    try:
+        import_id = await import_data(client, generate_citizens(
+            citizens_num=3, start_citizen_id=1
+        ))
+        cancelled = REQUESTS_CANCELLED.labels(
+            '/imports/{import_id}/towns/stat/percentile/age'
+        )
+        cancelled_before = cancelled.value
+
+        with patch.object(TownAgeStatView, 'exact_query', SLOW_QUERY):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.get(
+                    url_for(TownAgeStatView.URL_PATH, import_id=import_id)
+                ), timeout=0.5)
+
+            await wait_queries_cancelled(migrated_postgres_connection)
+        assert cancelled.value == cancelled_before + 1
+    finally:
+        await client.close()
@@ -0,0 +1,33 @@
+from http import HTTPStatus
+
+import pytest
+
+from analyzer.api.__main__ import parser
+from analyzer.api.docs import DOCS_MODES, SWAGGER_PATH, SWAGGER_URL
+
+
+@pytest.fixture(params=DOCS_MODES)
+def arguments(request, aiomisc_unused_port, migrated_postgres):
+    return parser.parse_args([
+        '--log-level=debug',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={migrated_postgres}',
+        f'--api-docs={request.param}',
+    ])
+
+
+async def test_docs(api_client, arguments):
+    if arguments.api_docs == 'lazy':
+        # Спецификация не строится при запуске
+        assert api_client.server.app['swagger_dict'] == {}
+
+    response = await api_client.get(SWAGGER_PATH)
+    if arguments.api_docs == 'off':
+        assert response.status == HTTPStatus.NOT_FOUND
+        return
+    assert response.status == HTTPStatus.OK
+
+    response = await api_client.get(SWAGGER_URL)
+    assert response.status == HTTPStatus.OK
+    assert '/imports' in (await response.json())['paths']
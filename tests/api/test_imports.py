@@ -4,6 +4,7 @@ from http import HTTPStatus
 import pytest
 
 from analyzer.api.schema import BIRTH_DATE_FORMAT
+from analyzer.db.schema import towns_table
 from analyzer.utils.pg import MAX_INTEGER
 from analyzer.utils.testing import (
     compare_citizen_groups, generate_citizen, generate_citizens, get_citizens,
@@ -138,3 +139,30 @@ async def test_import(api_client, citizens, expected_status):
     if expected_status == HTTPStatus.CREATED:
         imported_citizens = await get_citizens(api_client, import_id)
         assert compare_citizen_groups(citizens, imported_citizens)
+
+
+async def test_import_addresses(api_client, migrated_postgres_connection):
+    """
+    У каждой выгрузки свои словари адресов, одинаковые адреса жителей
+    выгрузки хранятся в словаре один раз.
+    """
+    citizens = [
+        generate_citizen(citizen_id=1, town='Москва', relatives=[]),
+        generate_citizen(citizen_id=2, town='Тверь', relatives=[]),
+        generate_citizen(citizen_id=3, town='Москва', relatives=[]),
+    ]
+    import_ids = []
+    for _ in range(2):
+        import_id = await import_data(api_client, citizens)
+        imported_citizens = await get_citizens(api_client, import_id)
+        assert compare_citizen_groups(citizens, imported_citizens)
+        import_ids.append(import_id)
+
+    towns = migrated_postgres_connection.execute(
+        towns_table.select()
+    ).fetchall()
+    assert sorted((town['import_id'], town['name']) for town in towns) == [
+        (import_id, name)
+        for import_id in import_ids
+        for name in ('Москва', 'Тверь')
+    ]
@@ -0,0 +1,130 @@
+import asyncio
+from functools import wraps
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytest
+
+from analyzer.api.__main__ import parser
+from analyzer.api.app import create_app
+from analyzer.api.handlers import CitizensView, ImportsView
+from analyzer.api.limits import Limiter
+from analyzer.utils.pg import SelectQuery
+from analyzer.utils.testing import (
+    generate_citizens, get_citizens, import_data, url_for,
+)
+
+
+@pytest.fixture
+async def api_client(aiohttp_client, aiomisc_unused_port, migrated_postgres):
+    arguments = parser.parse_args([
+        '--log-level=debug',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={migrated_postgres}',
+        '--limit-imports=1',
+        '--limit-reads=1',
+        '--limit-queue-timeout=0.1',
+        '--limit-retry-after=5',
+    ])
+    app = create_app(arguments)
+    client = await aiohttp_client(app, server_kwargs={
+        'port': arguments.api_port
+    })
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+async def test_limiter_queue():
+    limiter = Limiter(10)
+    assert await limiter.acquire(8, timeout=0)
+
+    # Запрос, которому не хватает единиц, пропускается вперед только после
+    # освобождения ресурса и не обгоняется более поздними запросами
+    large = asyncio.ensure_future(limiter.acquire(5, timeout=1))
+    await asyncio.sleep(0)
+    assert not await limiter.acquire(1, timeout=0.01)
+
+    limiter.release(8)
+    assert await large
+    assert limiter.used == 5
+
+    # Запрос больше ограничения ожидает освобождения всего ресурса
+    assert not await limiter.acquire(100, timeout=0.01)
+    limiter.release(5)
+    assert await limiter.acquire(100, timeout=0)
+    assert limiter.used == 10
+    limiter.release(100)
+    assert limiter.used == 0 and not limiter.waiters
+
+
+async def test_shed_imports(api_client):
+    citizens = generate_citizens(citizens_num=3, start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+
+    started, finish = asyncio.Event(), asyncio.Event()
+    post = ImportsView.post
+
+    # Схемы валидации aiohttp-apispec хранятся в атрибутах обработчика
+    @wraps(post)
+    async def slow_post(self):
+        started.set()
+        await finish.wait()
+        return await post(self)
+
+    with patch.object(ImportsView, 'post', slow_post):
+        slow_import = asyncio.ensure_future(import_data(api_client, citizens))
+        await started.wait()
+
+        # Место для выгрузок не освободилось за отведенное время
+        response = await api_client.post(ImportsView.URL_PATH,
+                                         json={'citizens': citizens})
+        assert response.status == HTTPStatus.SERVICE_UNAVAILABLE
+        assert response.headers['Retry-After'] == '5'
+        data = await response.json()
+        assert data['error']['code'] == 'service_unavailable'
+
+        # Чтение не ограничивается загрузкой выгрузок
+        await get_citizens(api_client, import_id)
+
+        finish.set()
+        assert await slow_import is not None
+
+    # Ограничение освобождается после обработки запроса
+    await import_data(api_client, citizens)
+
+
+async def test_shed_reads_while_streaming(api_client):
+    """
+    Ограничение чтения удерживается, пока тело потокового ответа
+    (данные из курсора PostgreSQL) отправляется клиенту.
+    """
+    citizens = generate_citizens(citizens_num=3, start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+
+    started, finish = asyncio.Event(), asyncio.Event()
+    select_query_iter = SelectQuery.__aiter__
+
+    async def slow_iter(self):
+        started.set()
+        await finish.wait()
+        async for row in select_query_iter(self):
+            yield row
+
+    with patch.object(SelectQuery, '__aiter__', slow_iter):
+        slow_read = asyncio.ensure_future(get_citizens(api_client, import_id))
+        await started.wait()
+
+        response = await api_client.get(
+            url_for(CitizensView.URL_PATH, import_id=import_id)
+        )
+        assert response.status == HTTPStatus.SERVICE_UNAVAILABLE
+
+        finish.set()
+        assert len(await slow_read) == 3
+
+    # Ограничение освобождается после отправки ответа
+    await get_citizens(api_client, import_id)
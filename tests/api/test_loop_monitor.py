@@ -0,0 +1,39 @@
+import asyncio
+import logging
+import time
+
+from analyzer.api.loop_monitor import LoopMonitor
+from analyzer.api.metrics import LOOP_BLOCKS, LOOP_LAG
+
+
+def block_loop(seconds: float):
+    time.sleep(seconds)
+
+
+async def test_loop_monitor(caplog):
+    caplog.set_level(logging.WARNING, logger='analyzer.api.loop_monitor')
+    lag_before = sum(LOOP_LAG.labels().counts)
+    blocks_before = LOOP_BLOCKS.labels().value
+
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.1)
+    task = asyncio.ensure_future(monitor.measure_lag())
+    loop = asyncio.get_event_loop()
+    watcher = loop.run_in_executor(None, monitor.watch)
+    try:
+        await asyncio.sleep(0.05)
+        block_loop(0.3)
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.stop()
+        task.cancel()
+        await asyncio.gather(task, watcher, return_exceptions=True)
+
+    assert sum(LOOP_LAG.labels().counts) > lag_before
+    # Блокировка записывается в лог один раз, со стеком блокирующего кода
+    assert LOOP_BLOCKS.labels().value - blocks_before == 1
+    messages = [
+        record.getMessage() for record in caplog.records
+        if record.name == 'analyzer.api.loop_monitor'
+    ]
+    assert len(messages) == 1
+    assert 'block_loop' in messages[0]
@@ -0,0 +1,81 @@
+import re
+from http import HTTPStatus
+from types import SimpleNamespace
+
+from analyzer.api.handlers import MetricsView
+from analyzer.api.metrics import (
+    PG_POOL_MAX_SIZE, PG_POOL_SIZE, PG_POOL_WAITING, collect_pool_stats,
+)
+from analyzer.utils.testing import generate_citizens, get_citizens, import_data
+
+
+def parse_metrics(text: str) -> dict:
+    """
+    Возвращает значения метрик в виде словаря {'имя{метки}': значение}.
+    """
+    return {
+        name: float(value)
+        for name, value in re.findall(r'^([^#\s][^ ]*) (\S+)$', text, re.M)
+    }
+
+
+async def get_metrics(api_client) -> dict:
+    response = await api_client.get(MetricsView.URL_PATH)
+    assert response.status == HTTPStatus.OK
+    assert response.headers['Content-Type'].startswith('text/plain')
+    return parse_metrics(await response.text())
+
+
+async def test_metrics(api_client):
+    # Обработчик определяется путем без регулярных выражений параметров
+    handler = '/imports/{import_id}/citizens'
+    requests_key = (
+        'analyzer_http_requests_total{handler="%s",method="GET",status="200"}'
+        % handler
+    )
+    duration_key = (
+        'analyzer_http_request_duration_seconds_count'
+        '{handler="%s",method="GET"}' % handler
+    )
+
+    before = await get_metrics(api_client)
+
+    citizens = generate_citizens(citizens_num=10, start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+    await get_citizens(api_client, import_id)
+    await get_citizens(api_client, import_id)
+    # Запрос к несуществующему обработчику
+    response = await api_client.get('/not-found')
+    assert response.status == HTTPStatus.NOT_FOUND
+
+    after = await get_metrics(api_client)
+    assert after[requests_key] - before.get(requests_key, 0) == 2
+    assert after[duration_key] - before.get(duration_key, 0) == 2
+    assert after[
+        'analyzer_http_requests_total'
+        '{handler="unknown",method="GET",status="404"}'
+    ] >= 1
+
+    # Тело ответа со списком жителей отправляется потоком
+    assert after['analyzer_streamed_bytes_total'] > \
+        before.get('analyzer_streamed_bytes_total', 0)
+
+    # Учитывается только запрос к /metrics, который сейчас выполняется
+    assert after['analyzer_http_requests_in_progress'] == 1
+    assert after['analyzer_pg_pool_size'] >= 1
+    assert after['analyzer_pg_pool_waiting'] == 0
+
+
+def test_collect_pool_stats_without_internals():
+    """
+    Если внутреннее состояние пула asyncpg недоступно, метрики, для которых
+    есть публичные методы, обновляются, а остальные пропускаются.
+    """
+    PG_POOL_WAITING.set(7)
+    pool = SimpleNamespace(
+        get_size=lambda: 3, get_idle_size=lambda: 1, get_max_size=lambda: 10
+    )
+    collect_pool_stats(pool)
+    assert PG_POOL_SIZE.labels().value == 3
+    assert PG_POOL_MAX_SIZE.labels().value == 10
+    assert PG_POOL_WAITING.labels().value == 7
@@ -0,0 +1,295 @@
+"""
+Проверяется работа сервиса через пулер соединений в режиме транзакций
+(--pg-pooler-mode).
+
+Вместо PgBouncer используется TransactionPooler - минимальный пулер,
+распределяющий транзакции клиентов по нескольким соединениям с PostgreSQL.
+"""
+import asyncio
+import struct
+from http import HTTPStatus
+
+import pytest
+from yarl import URL
+
+from analyzer.api.__main__ import parser
+from analyzer.api.app import create_app
+from analyzer.utils.testing import (
+    generate_citizens, get_citizens, get_citizens_ages, get_citizens_birthdays,
+    import_data, patch_citizen, patch_citizens,
+)
+
+
+SSL_REQUEST_CODE = 80877103
+CANCEL_REQUEST_CODE = 80877102
+# Запросы аутентификации (AuthenticationRequest), требующие ответа клиента:
+# пароль в открытом виде, MD5, SASL
+AUTH_REQUESTS_WITH_RESPONSE = {3, 5, 10, 11}
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """
+    Читает сообщение протокола PostgreSQL (тип, длина и данные).
+    """
+    header = await reader.readexactly(5)
+    length, = struct.unpack('!i', header[1:])
+    return header + await reader.readexactly(length - 4)
+
+
+async def read_startup_message(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(4)
+    length, = struct.unpack('!i', header)
+    return header + await reader.readexactly(length - 4)
+
+
+def make_message(type_: bytes, payload: bytes = b'') -> bytes:
+    return type_ + struct.pack('!i', len(payload) + 4) + payload
+
+
+class TransactionPooler:
+    """
+    Выполняет транзакции клиентов на нескольких соединениях с PostgreSQL:
+    свободное соединение выделяется клиенту при получении первого сообщения и
+    освобождается, когда PostgreSQL сообщает о завершении транзакции
+    (ReadyForQuery со статусом I), как в PgBouncer с pool_mode=transaction.
+    Свободные соединения выделяются по очереди, поэтому последовательные
+    транзакции клиента выполняются на разных соединениях.
+
+    Соединения с PostgreSQL создаются при подключении первых клиентов (они
+    проходят аутентификацию), остальные клиенты получают сохраненные
+    параметры сервера без аутентификации.
+    """
+
+    def __init__(self, pg_url: URL, size: int = 2):
+        self.pg_url = pg_url
+        self.size = size
+        self.server = None
+        # Соединения с PostgreSQL (reader, writer)
+        self.connections = []
+        self.idle = asyncio.Queue()
+        # Параметры сервера, отправляемые клиентам после подключения
+        self.startup_response = []
+        self.sessions = set()
+
+    async def start(self, port: int):
+        self.server = await asyncio.start_server(self.handle_client,
+                                                 '127.0.0.1', port)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for task in self.sessions:
+            task.cancel()
+        await asyncio.gather(*self.sessions, return_exceptions=True)
+        for _, writer in self.connections:
+            writer.write(make_message(b'X'))
+            writer.close()
+
+    async def handle_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.sessions.add(task)
+        try:
+            if await self.startup(reader, writer):
+                await self.session(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(task)
+            writer.close()
+
+    async def startup(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> bool:
+        message = await read_startup_message(reader)
+        code, = struct.unpack('!i', message[4:8])
+        if code == SSL_REQUEST_CODE:
+            writer.write(b'N')
+            message = await read_startup_message(reader)
+            code, = struct.unpack('!i', message[4:8])
+        if code == CANCEL_REQUEST_CODE:
+            return False
+
+        if len(self.connections) < self.size:
+            self.connections.append(None)
+            connection = await self.connect(message, reader, writer)
+            self.connections[self.connections.index(None)] = connection
+            self.idle.put_nowait(connection)
+            return True
+
+        for response in self.startup_response:
+            writer.write(response)
+        writer.write(make_message(b'Z', b'I'))
+        return True
+
+    async def connect(self, startup_message: bytes,
+                      reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter):
+        """
+        Подключается к PostgreSQL, передавая сообщения аутентификации между
+        клиентом и сервером.
+        """
+        server_reader, server_writer = await asyncio.open_connection(
+            self.pg_url.host, self.pg_url.port or 5432
+        )
+        server_writer.write(startup_message)
+        startup_response = []
+        while True:
+            message = await read_message(server_reader)
+            writer.write(message)
+            if message[:1] == b'R':
+                auth_code, = struct.unpack('!i', message[5:9])
+                if auth_code in AUTH_REQUESTS_WITH_RESPONSE:
+                    server_writer.write(await read_message(reader))
+                elif auth_code == 0:
+                    startup_response.append(message)
+            elif message[:1] in (b'S', b'K'):
+                startup_response.append(message)
+            elif message[:1] == b'Z':
+                self.startup_response = startup_response
+                return server_reader, server_writer
+
+    @staticmethod
+    async def relay_transaction(server_reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        """
+        Передает клиенту ответы PostgreSQL до завершения транзакции.
+        """
+        while True:
+            message = await read_message(server_reader)
+            if writer is not None:
+                writer.write(message)
+            if message[:1] == b'Z' and message[5:6] == b'I':
+                return
+
+    @staticmethod
+    def is_terminate(message: bytes) -> bool:
+        """
+        Клиент завершил сессию (Terminate) или отключился.
+        """
+        return message is None or message[:1] == b'X'
+
+    @staticmethod
+    async def read_messages(reader: asyncio.StreamReader,
+                            messages: asyncio.Queue):
+        try:
+            while True:
+                await messages.put(await read_message(reader))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await messages.put(None)
+
+    async def transaction(self, connection, message: bytes,
+                          messages: asyncio.Queue,
+                          writer: asyncio.StreamWriter) -> bool:
+        """
+        Выполняет транзакцию клиента на соединении с PostgreSQL, начиная с
+        сообщения message. Возвращает False, если клиент отключился во время
+        транзакции (транзакция откатывается).
+        """
+        server_reader, server_writer = connection
+        transaction = asyncio.ensure_future(
+            self.relay_transaction(server_reader, writer)
+        )
+        server_writer.write(message)
+        while not transaction.done():
+            get_message = asyncio.ensure_future(messages.get())
+            await asyncio.wait([transaction, get_message],
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not get_message.done():
+                get_message.cancel()
+                continue
+
+            message = get_message.result()
+            if self.is_terminate(message):
+                # Клиент отключился во время транзакции
+                transaction.cancel()
+                server_writer.write(make_message(b'Q', b'ROLLBACK\0'))
+                await self.relay_transaction(server_reader, None)
+                return False
+            server_writer.write(message)
+        transaction.result()
+        return True
+
+    async def session(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter):
+        messages = asyncio.Queue()
+        reader_task = asyncio.ensure_future(
+            self.read_messages(reader, messages)
+        )
+        try:
+            while True:
+                message = await messages.get()
+                if self.is_terminate(message):
+                    return
+
+                connection = await self.idle.get()
+                try:
+                    if not await self.transaction(connection, message,
+                                                  messages, writer):
+                        return
+                finally:
+                    self.idle.put_nowait(connection)
+        finally:
+            reader_task.cancel()
+
+
+@pytest.fixture
+async def pooler(aiomisc_unused_port_factory, migrated_postgres):
+    pooler = TransactionPooler(URL(migrated_postgres))
+    port = aiomisc_unused_port_factory()
+    await pooler.start(port)
+    try:
+        yield URL(migrated_postgres).with_host('127.0.0.1').with_port(port)
+    finally:
+        await pooler.stop()
+
+
+@pytest.fixture
+async def api_client(aiohttp_client, aiomisc_unused_port, pooler):
+    arguments = parser.parse_args([
+        '--log-level=debug',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={pooler}',
+        '--pg-pooler-mode',
+    ])
+    app = create_app(arguments)
+    client = await aiohttp_client(app, server_kwargs={
+        'port': arguments.api_port
+    })
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+async def test_pooler_mode(api_client):
+    # Жителей больше, чем запрашивается за один раз (KeysetSelectQuery)
+    citizens = generate_citizens(citizens_num=2500, relations_num=1000,
+                                 start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+
+    # Запросы выполняются конкурентно, чтобы транзакции разных соединений
+    # пула чередовались на одном соединении с PostgreSQL
+    results = await asyncio.gather(*[
+        get_citizens(api_client, import_id) for _ in range(5)
+    ])
+    for result in results:
+        assert [citizen['citizen_id'] for citizen in result] == \
+            list(range(1, 2501))
+
+    await asyncio.gather(
+        patch_citizen(api_client, import_id, 1, {'name': 'Иван'}),
+        patch_citizens(api_client, import_id, [
+            {'citizen_id': 2, 'relatives': [3]}
+        ]),
+        get_citizens_birthdays(api_client, import_id),
+        get_citizens_ages(api_client, import_id),
+    )
+
+    citizens = await get_citizens(api_client, import_id)
+    assert citizens[0]['name'] == 'Иван'
+    assert citizens[1]['relatives'] == [3]
+
+    await get_citizens(api_client, import_id + 1,
+                       expected_status=HTTPStatus.NOT_FOUND)
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from analyzer.api.__main__ import parser
+from analyzer.utils.querylog import is_explainable
+from analyzer.utils.testing import (
+    generate_citizens, get_citizens, get_citizens_birthdays, import_data,
+)
+
+
+@pytest.fixture
+def arguments(aiomisc_unused_port, migrated_postgres):
+    return parser.parse_args([
+        '--log-level=debug',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={migrated_postgres}',
+        '--query-log',
+        # Все запросы считаются медленными, планы получаются для всех
+        '--query-log-threshold=0',
+        '--query-log-explain-rate=1',
+    ])
+
+
+def query_records(caplog, message: str):
+    return [
+        record for record in caplog.records
+        if record.name == 'analyzer.utils.querylog' and
+        record.msg.startswith(message)
+    ]
+
+
+@pytest.mark.parametrize('statement,explainable', [
+    ('SELECT * FROM citizens WHERE import_id = $1', True),
+    ('  select count(*) FROM imports', True),
+    ("SELECT set_config('statement_timeout', $1, true)", False),
+    ('SELECT pg_advisory_xact_lock($1)', False),
+    ('SELECT * FROM citizens FOR UPDATE', False),
+    ('WITH updated AS (UPDATE citizens SET name = $1) SELECT 1', False),
+    ('UPDATE citizens SET name = $1', False),
+])
+def test_is_explainable(statement, explainable):
+    assert is_explainable(statement) == explainable
+
+
+async def test_query_log(api_client, caplog):
+    caplog.set_level(logging.INFO, logger='analyzer.utils.querylog')
+    citizens = generate_citizens(citizens_num=10, start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+    await get_citizens(api_client, import_id)
+    await get_citizens_birthdays(api_client, import_id)
+
+    # Запросы записываются с обработчиком, который их выполнил, в т.ч.
+    # запросы потокового ответа, выполняемые после выхода из обработчика
+    handlers = {
+        record.handler
+        for record in query_records(caplog, 'Query handler=')
+    }
+    assert '/imports' in handlers
+    assert '/imports/{import_id}/citizens' in handlers
+    assert '/imports/{import_id}/citizens/birthdays' in handlers
+
+    calls = {
+        record.call for record in query_records(caplog, 'Query handler=')
+        if record.handler == '/imports/{import_id}/citizens'
+    }
+    assert 'cursor.fetch' in calls
+
+    # Планы медленных запросов получаются в фоне
+    query_log = api_client.server.app['query_log']
+    if query_log.explain_task is not None:
+        await asyncio.wait_for(query_log.explain_task, timeout=5)
+    plans = query_records(caplog, 'Query plan ')
+    assert plans
+    assert 'Plan' in json.loads(plans[0].plan)[0]
@@ -0,0 +1,121 @@
+"""
+Проверяется чтение данных с реплики PostgreSQL. В качестве реплики
+используется та же БД, отставание реплики имитируется подменой запроса,
+проверяющего позицию примененных репликой изменений.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytest
+from asyncpgsa import PG
+
+from analyzer.api.__main__ import parser
+from analyzer.api.app import create_app
+from analyzer.api.handlers import CitizenView, ImportsView, base
+from analyzer.utils.testing import (
+    generate_citizen, get_citizens, get_citizens_ages, get_citizens_birthdays,
+    url_for,
+)
+
+
+@pytest.fixture
+async def api_client(aiohttp_client, aiomisc_unused_port, migrated_postgres):
+    arguments = parser.parse_args([
+        '--log-level=debug',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={migrated_postgres}',
+        f'--pg-replica-url={migrated_postgres}',
+    ])
+    app = create_app(arguments)
+    client = await aiohttp_client(app, server_kwargs={
+        'port': arguments.api_port
+    })
+
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+@contextmanager
+def count_transactions(app):
+    """
+    Подсчитывает транзакции, начатые в пулах мастера и реплики (в них
+    читаются жители).
+    """
+    counts = Counter()
+
+    def transaction(pg, *args, **kwargs):
+        counts['master' if pg is app['pg'] else 'replica'] += 1
+        return transaction_method(pg, *args, **kwargs)
+
+    transaction_method = PG.transaction
+    with patch.object(PG, 'transaction', transaction):
+        yield counts
+
+
+async def test_read_from_replica(api_client):
+    app = api_client.server.app
+    response = await api_client.post(ImportsView.URL_PATH, json={
+        'citizens': [generate_citizen(citizen_id=1)]
+    })
+    assert response.status == HTTPStatus.CREATED
+    import_id = (await response.json())['data']['import_id']
+    lsn = response.headers[base.LSN_HEADER]
+
+    with count_transactions(app) as counts:
+        # Без позиции изменений клиента данные читаются с реплики
+        await get_citizens(api_client, import_id)
+        assert counts == {'replica': 1}
+
+        # Реплика содержит изменения клиента
+        await get_citizens(api_client, import_id,
+                           headers={base.LSN_HEADER: lsn})
+        assert counts == {'replica': 2}
+
+    await get_citizens_birthdays(api_client, import_id)
+    await get_citizens_ages(api_client, import_id)
+
+
+async def test_read_your_writes(api_client):
+    app = api_client.server.app
+    response = await api_client.post(ImportsView.URL_PATH, json={
+        'citizens': [generate_citizen(citizen_id=1, name='Иван')]
+    })
+    import_id = (await response.json())['data']['import_id']
+
+    # Реплика применила изменения до текущей позиции журнала мастера
+    replica_query = 'SELECT pg_current_wal_insert_lsn() >= $1::text::pg_lsn'
+    with patch.object(base, 'REPLAYED_LSN_QUERY', replica_query):
+        response = await api_client.patch(
+            url_for(CitizenView.URL_PATH, import_id=import_id,
+                    citizen_id=1),
+            json={'name': 'Петр'}
+        )
+        assert response.status == HTTPStatus.OK
+        lsn = response.headers[base.LSN_HEADER]
+
+        with count_transactions(app) as counts:
+            citizens = await get_citizens(api_client, import_id,
+                                          headers={base.LSN_HEADER: lsn})
+            assert citizens[0]['name'] == 'Петр'
+            assert counts == {'replica': 1}
+
+            # Реплика еще не получила изменения клиента - данные читаются с
+            # мастера
+            await get_citizens(api_client, import_id,
+                               headers={base.LSN_HEADER: 'FFFFFFFF/0'})
+            assert counts == {'master': 1, 'replica': 1}
+
+
+async def test_invalid_lsn(api_client):
+    response = await api_client.post(ImportsView.URL_PATH, json={
+        'citizens': [generate_citizen(citizen_id=1)]
+    })
+    import_id = (await response.json())['data']['import_id']
+    await get_citizens(api_client, import_id,
+                       expected_status=HTTPStatus.BAD_REQUEST,
+                       headers={base.LSN_HEADER: 'invalid'})
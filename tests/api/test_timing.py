@@ -0,0 +1,70 @@
+import re
+from http import HTTPStatus
+
+import pytest
+
+from analyzer.api.__main__ import parser
+from analyzer.api.handlers import ProfileView
+from analyzer.api.timing import HEADER, METRICS
+from analyzer.utils.testing import generate_citizens, import_data, url_for
+
+
+ADMIN_TOKEN = 'secret'
+SERVER_TIMING_RE = re.compile(r'^(\w+);dur=(\d+\.\d{3})$')
+
+
+@pytest.fixture
+def arguments(aiomisc_unused_port, migrated_postgres):
+    return parser.parse_args([
+        '--log-level=debug',
+        '--api-address=127.0.0.1',
+        f'--api-port={aiomisc_unused_port}',
+        f'--pg-url={migrated_postgres}',
+        f'--admin-token={ADMIN_TOKEN}',
+    ])
+
+
+def parse_server_timing(value: str) -> dict:
+    timings = {}
+    for metric in value.split(', '):
+        match = SERVER_TIMING_RE.match(metric)
+        assert match, metric
+        timings[match.group(1)] = float(match.group(2))
+    return timings
+
+
+async def test_server_timing(api_client):
+    citizens = generate_citizens(citizens_num=10, start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+
+    response = await api_client.get(
+        url_for('/imports/{import_id}/citizens/birthdays',
+                import_id=import_id)
+    )
+    assert response.status == HTTPStatus.OK
+    timings = parse_server_timing(response.headers[HEADER])
+    assert set(timings) == {*METRICS, 'total'}
+    assert timings['db'] > 0
+    assert sum(timings[name] for name in METRICS) <= timings['total'] + 0.01
+
+    # Заголовок добавляется и в ответы с ошибкой
+    response = await api_client.get(
+        url_for('/imports/{import_id}/citizens', import_id=import_id + 1)
+    )
+    assert response.status == HTTPStatus.NOT_FOUND
+    assert HEADER in response.headers
+
+
+async def test_profile(api_client):
+    url = ProfileView.URL_PATH + '?seconds=0.2'
+    response = await api_client.get(url)
+    assert response.status == HTTPStatus.FORBIDDEN
+
+    headers = {'Authorization': f'Bearer {ADMIN_TOKEN}'}
+    response = await api_client.get(url, headers=headers)
+    assert response.status == HTTPStatus.OK
+    lines = (await response.text()).splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert stack and int(count) > 0
@@ -9,17 +9,23 @@ analyzer.api.handlers.TownAgeStatView.CURRENT_DATE
 возврастов жителей в тесте, которая позволяет подменить базовую дату с помощью
 параметра base_date.
 """
+import asyncio
 from copy import copy
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from http import HTTPStatus
 from unittest.mock import patch
 
 import pytest
 import pytz
 
-from analyzer.api.schema import BIRTH_DATE_FORMAT
+from analyzer.api.cache import TownAgeStatCache
+from analyzer.api.handlers import TownAgeStatView
+from analyzer.api.handlers.town_stat import APPROXIMATE_ERROR_BOUND
+from analyzer.api.schema import BIRTH_DATE_FORMAT, TownAgeStatResponseSchema
+from analyzer.db.check import find_town_birth_months_mismatches
 from analyzer.utils.testing import (
-    generate_citizen, get_citizens_ages, import_data,
+    generate_citizen, generate_citizens, get_citizens_ages, import_data,
+    patch_citizen, patch_citizens, url_for,
 )
 
 
@@ -115,5 +121,201 @@ async def test_get_ages(api_client, dataset):
             )
 
 
+@patch('analyzer.api.handlers.TownAgeStatView.CURRENT_DATE', new=CURRENT_DATE)
+async def test_get_custom_statistics(api_client):
+    import_id = await import_data(api_client, [
+        generate_citizen(birth_date=age2date(years=10, days=364),
+                         town='Москва', citizen_id=1),
+        generate_citizen(birth_date=age2date(years=30, days=364),
+                         town='Москва', citizen_id=2),
+        generate_citizen(birth_date=age2date(years=50, days=364),
+                         town='Москва', citizen_id=3)
+    ])
+    result = await get_citizens_ages(api_client, import_id, params=[
+        ('percentiles', '10'), ('percentiles', '90'),
+        ('percentiles', '95.5'), ('statistics', 'mean'),
+        ('statistics', 'min'), ('statistics', 'max'),
+        ('statistics', 'count'),
+    ])
+    assert result == [{
+        'town': 'Москва', 'p10': 14., 'p90': 46., 'p95.5': 48.2,
+        'mean': 30., 'min': 10., 'max': 50., 'count': 3
+    }]
+
+
+@pytest.mark.parametrize('params', [
+    {'percentiles': '101'},
+    {'percentiles': 'abc'},
+    {'statistics': 'median'},
+])
+async def test_get_invalid_statistics(api_client, params):
+    import_id = await import_data(api_client, [generate_citizen()])
+    await get_citizens_ages(api_client, import_id, HTTPStatus.BAD_REQUEST,
+                            params=params)
+
+
 async def test_get_nonexistent_import_birthdays(api_client):
     await get_citizens_ages(api_client, 999, HTTPStatus.NOT_FOUND)
+
+
+async def test_get_approximate_ages(api_client, migrated_postgres_connection):
+    """
+    Приблизительно рассчитанные перцентили должны отличаться от точных не
+    более чем на APPROXIMATE_ERROR_BOUND, в т.ч. после изменения жителей.
+    """
+    citizens = generate_citizens(citizens_num=200, unique_towns=3,
+                                 start_citizen_id=1)
+    import_id = await import_data(api_client, citizens)
+
+    async def check():
+        exact = await get_citizens_ages(api_client, import_id)
+        response = await api_client.get(
+            url_for(TownAgeStatView.URL_PATH, import_id=import_id),
+            params={'approximate': 'true'}
+        )
+        assert response.status == HTTPStatus.OK
+        data = await response.json()
+        assert data['error_bound'] == APPROXIMATE_ERROR_BOUND
+        approximate = {town['town']: town for town in data['data']}
+        assert len(exact) == len(approximate)
+        for town in exact:
+            for percentile in ['p50', 'p75', 'p99']:
+                value = approximate[town['town']][percentile]
+                assert 0 <= value - town[percentile] <= \
+                    APPROXIMATE_ERROR_BOUND
+
+        assert find_town_birth_months_mismatches(
+            migrated_postgres_connection, import_id
+        ) == []
+
+    await check()
+
+    # Житель переезжает в новый город, у другого жителя меняется месяц
+    # рождения.
+    await patch_citizen(api_client, import_id, 1, data={'town': 'Ялта'})
+    await patch_citizen(api_client, import_id, 2,
+                        data={'birth_date': age2date(years=5)})
+    await check()
+
+    await patch_citizens(api_client, import_id, [
+        {'citizen_id': 3, 'town': 'Ялта', 'birth_date': age2date(years=70)},
+        {'citizen_id': 4, 'town': 'Тверь'},
+        {'citizen_id': 5, 'birth_date': age2date(years=1, days=20)},
+    ])
+    await check()
+
+
+async def test_town_stat_cache(api_client):
+    """
+    Статистика рассчитывается один раз для конкурентных запросов и
+    пересчитывается после изменения выгрузки и наступления новых суток.
+    """
+    import_id = await import_data(api_client, [
+        generate_citizen(citizen_id=1, town='Москва',
+                         birth_date=age2date(years=10, days=1))
+    ])
+
+    calls = 0
+    calculate = TownAgeStatView.calculate
+
+    async def counting_calculate(self, *args, **kwargs):
+        nonlocal calls
+        calls += 1
+        # Даем возможность конкурентным запросам дождаться этого расчета
+        await asyncio.sleep(0.1)
+        return await calculate(self, *args, **kwargs)
+
+    with patch.object(TownAgeStatView, 'calculate', counting_calculate), \
+            patch.object(TownAgeStatView, 'CURRENT_DATE', CURRENT_DATE):
+        results = await asyncio.gather(*[
+            get_citizens_ages(api_client, import_id) for _ in range(5)
+        ])
+        assert calls == 1
+        assert all(result[0]['p50'] == 10 for result in results)
+
+        await patch_citizen(api_client, import_id, 1,
+                            data={'birth_date': age2date(years=20)})
+        result = await get_citizens_ages(api_client, import_id)
+        assert calls == 2
+        assert result[0]['p50'] == 20
+
+        result = await get_citizens_ages(api_client, import_id)
+        assert calls == 2
+
+    # Наступили следующие сутки
+    next_day = CURRENT_DATE + timedelta(days=1)
+    with patch.object(TownAgeStatView, 'calculate', counting_calculate), \
+            patch.object(TownAgeStatView, 'CURRENT_DATE', next_day):
+        await get_citizens_ages(api_client, import_id)
+        assert calls == 3
+
+
+async def test_age_on_requested_date(api_client, migrated_postgres_connection):
+    """
+    Возраст рассчитывается на переданную дату, а не на текущую дату сервера
+    БД, поэтому версия кэша и статистика всегда относятся к одной дате.
+    """
+    import_id = await import_data(api_client, [
+        generate_citizen(birth_date='17.02.2000', town='Москва')
+    ])
+    for today, age in ((date(2020, 2, 16), 19), (date(2020, 2, 17), 20)):
+        rows = migrated_postgres_connection.execute(
+            TownAgeStatView.exact_query(import_id, today)
+        ).fetchall()
+        assert TownAgeStatView.exact_stats(rows)[0]['p50'] == age
+
+
+@pytest.mark.parametrize('context,stat,valid', [
+    ({}, {'town': 'Москва', 'p50': 1., 'p75': 2., 'p99': 3.}, True),
+    # Без параметров должны возвращаться перцентили по умолчанию
+    ({}, {'town': 'Москва', 'p50': 1., 'p75': 2.}, False),
+    ({}, {'town': 'Москва', 'p50': 1., 'p75': 2., 'p99': 3., 'p10': 1.},
+     False),
+    ({}, {'town': 'Москва', 'p50': 1., 'p75': 2., 'p99': 3., 'foo': 1},
+     False),
+    ({}, {'town': 'Москва', 'p50': 1., 'p75': 2., 'p99': -3.}, False),
+    (
+        {'percentiles': [95.5], 'statistics': ['count']},
+        {'town': 'Москва', 'p95.5': 1., 'count': 2}, True
+    ),
+    (
+        {'percentiles': [95.5], 'statistics': ['count']},
+        {'town': 'Москва', 'p95.5': 1.}, False
+    ),
+])
+def test_town_age_stat_schema(context, stat, valid):
+    errors = TownAgeStatResponseSchema(context=context).validate({
+        'data': [stat]
+    })
+    assert (errors == {}) == valid
+
+
+async def test_town_stat_cache_cancel():
+    """
+    Общий расчет отменяется, когда отменены все ожидавшие его запросы.
+    """
+    cache = TownAgeStatCache(max_size=1)
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def compute():
+        started.set()
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    key, version = (1, False, (50, ), ()), (0, date(2020, 2, 17))
+    waiters = [
+        asyncio.ensure_future(cache.get(key, version, compute))
+        for _ in range(2)
+    ]
+    await started.wait()
+
+    waiters[0].cancel()
+    await asyncio.sleep(0.01)
+    assert not cancelled.is_set()
+
+    waiters[1].cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert not cache.waiters and not cache.computing
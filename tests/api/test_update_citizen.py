@@ -2,6 +2,9 @@ from datetime import date, timedelta
 from http import HTTPStatus
 
 from analyzer.api.schema import BIRTH_DATE_FORMAT
+from analyzer.db.check import (
+    find_town_birth_months_mismatches, find_unused_addresses,
+)
 from analyzer.db.schema import Gender
 from analyzer.utils.testing import (
     compare_citizen_groups, compare_citizens, generate_citizen,
@@ -155,3 +158,61 @@ async def test_patch_nonexistent(api_client):
     await patch_citizen(api_client, import_id, 999,
                         data={'name': 'Иван Иванов'},
                         expected_status=HTTPStatus.NOT_FOUND)
+
+
+async def test_patch_citizen_remove_relatives(api_client):
+    """
+    Пустой список relatives должен удалять все родственные связи жителя (в обе
+    стороны), не затрагивая остальные поля.
+    """
+    dataset = [
+        generate_citizen(citizen_id=1, relatives=[1, 2, 3]),
+        generate_citizen(citizen_id=2, relatives=[1, 3]),
+        generate_citizen(citizen_id=3, relatives=[1, 2]),
+    ]
+    import_id = await import_data(api_client, dataset)
+
+    dataset[0]['relatives'] = []
+    dataset[1]['relatives'] = [3]
+    dataset[2]['relatives'] = [2]
+    actual = await patch_citizen(api_client, import_id, 1,
+                                 data={'relatives': []})
+    assert compare_citizens(dataset[0], actual)
+
+    actual_citizens = await get_citizens(api_client, import_id)
+    assert compare_citizen_groups(actual_citizens, dataset)
+
+
+async def test_patch_citizen_addresses(api_client,
+                                       migrated_postgres_connection):
+    """
+    Новые адреса добавляются в словари выгрузки, а адреса, которые больше не
+    указаны ни у одного жителя выгрузки, удаляются из словарей (вместе со
+    статистикой по городу).
+    """
+    dataset = [
+        generate_citizen(citizen_id=1, town='Москва', street='Тверская',
+                         building='1', relatives=[]),
+        generate_citizen(citizen_id=2, town='Москва', street='Арбат',
+                         building='2', relatives=[]),
+    ]
+    import_id = await import_data(api_client, dataset)
+
+    for citizen_id, data in (
+        (1, {'town': 'Тверь', 'street': 'Арбат', 'building': '2'}),
+        (2, {'town': 'Тверь'}),
+        (2, {'street': 'Тверская', 'building': '1'}),
+    ):
+        dataset[citizen_id - 1].update(data)
+        actual = await patch_citizen(api_client, import_id, citizen_id,
+                                     data=data)
+        assert compare_citizens(dataset[citizen_id - 1], actual)
+
+        actual_citizens = await get_citizens(api_client, import_id)
+        assert compare_citizen_groups(actual_citizens, dataset)
+        assert find_unused_addresses(
+            migrated_postgres_connection, import_id
+        ) == []
+        assert find_town_birth_months_mismatches(
+            migrated_postgres_connection, import_id
+        ) == []
@@ -0,0 +1,146 @@
+from http import HTTPStatus
+
+from analyzer.db.check import (
+    find_town_birth_months_mismatches, find_unused_addresses,
+)
+from analyzer.db.schema import Gender
+from analyzer.utils.testing import (
+    compare_citizen_groups, generate_citizen, get_citizens, import_data,
+    patch_citizens,
+)
+
+
+async def test_patch_citizens(api_client):
+    """
+    Проверяет, что данные о нескольких жителях и их родственниках успешно
+    обновляются одним запросом.
+    """
+    # Дополнительная выгрузка с жителями с одинаковыми идентификаторами, чтобы
+    # убедиться, что изменения не затронут жителей другой выгрузки.
+    side_dataset = [
+        generate_citizen(citizen_id=1, relatives=[2]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3),
+    ]
+    side_dataset_id = await import_data(api_client, side_dataset)
+
+    dataset = [
+        generate_citizen(citizen_id=1, relatives=[2]),
+        generate_citizen(citizen_id=2, relatives=[1]),
+        generate_citizen(citizen_id=3, relatives=[]),
+        generate_citizen(citizen_id=4, relatives=[]),
+    ]
+    import_id = await import_data(api_client, dataset)
+
+    # Житель #1 меняет только имя, житель #2 - пол и родственников (связь с
+    # #1 удаляется, связь с #3 добавляется), у жителя #4 появляется связь с
+    # самим собой.
+    dataset[0]['name'] = 'Иванова Иванна Ивановна'
+    dataset[0]['relatives'] = []
+    dataset[1]['gender'] = Gender.female.value
+    dataset[1]['relatives'] = [3]
+    dataset[2]['relatives'] = [2]
+    dataset[3]['relatives'] = [4]
+
+    actual = await patch_citizens(api_client, import_id, [
+        {'citizen_id': 1, 'name': dataset[0]['name']},
+        {'citizen_id': 2, 'gender': dataset[1]['gender'], 'relatives': [3]},
+        {'citizen_id': 4, 'relatives': [4]},
+    ])
+    assert compare_citizen_groups(
+        actual, [dataset[0], dataset[1], dataset[3]]
+    )
+
+    actual_citizens = await get_citizens(api_client, import_id)
+    assert compare_citizen_groups(actual_citizens, dataset)
+
+    actual_citizens = await get_citizens(api_client, side_dataset_id)
+    assert compare_citizen_groups(actual_citizens, side_dataset)
+
+
+async def test_patch_citizens_asymmetric_relatives(api_client):
+    """
+    Родственные связи между жителями, которые изменяются в одном запросе,
+    должны быть указаны у обоих жителей.
+    """
+    dataset = [generate_citizen(citizen_id=1), generate_citizen(citizen_id=2)]
+    import_id = await import_data(api_client, dataset)
+
+    await patch_citizens(api_client, import_id, [
+        {'citizen_id': 1, 'relatives': [2]},
+        {'citizen_id': 2, 'relatives': []},
+    ], expected_status=HTTPStatus.BAD_REQUEST)
+
+
+async def test_patch_citizens_add_nonexistent_relative(api_client):
+    dataset = [generate_citizen(citizen_id=1), generate_citizen(citizen_id=2)]
+    import_id = await import_data(api_client, dataset)
+
+    await patch_citizens(api_client, import_id, [
+        {'citizen_id': 1, 'name': 'Иван Иванов'},
+        {'citizen_id': 2, 'relatives': [999]},
+    ], expected_status=HTTPStatus.BAD_REQUEST)
+
+    # Изменения не должны примениться частично
+    actual_citizens = await get_citizens(api_client, import_id)
+    assert compare_citizen_groups(actual_citizens, dataset)
+
+
+async def test_patch_citizens_nonexistent(api_client):
+    await patch_citizens(api_client, 999, [{'citizen_id': 1}],
+                         expected_status=HTTPStatus.NOT_FOUND)
+
+    dataset = [generate_citizen(citizen_id=1)]
+    import_id = await import_data(api_client, dataset)
+    await patch_citizens(api_client, import_id, [
+        {'citizen_id': 1, 'name': 'Иван Иванов'},
+        {'citizen_id': 999, 'name': 'Иван Иванов'},
+    ], expected_status=HTTPStatus.NOT_FOUND)
+
+    actual_citizens = await get_citizens(api_client, import_id)
+    assert compare_citizen_groups(actual_citizens, dataset)
+
+
+async def test_patch_citizens_addresses(api_client,
+                                        migrated_postgres_connection):
+    """
+    Жители могут обменяться адресами, переехать на новые адреса или
+    освободить старые в одном запросе: словари выгрузки должны содержать
+    только указанные у жителей значения.
+    """
+    dataset = [
+        generate_citizen(citizen_id=1, town='Москва', street='Тверская',
+                         building='1', relatives=[]),
+        generate_citizen(citizen_id=2, town='Тверь', street='Арбат',
+                         building='2', relatives=[]),
+        generate_citizen(citizen_id=3, town='Тверь', street='Арбат',
+                         building='2', relatives=[]),
+    ]
+    import_id = await import_data(api_client, dataset)
+
+    for patches in (
+        [
+            {'citizen_id': 1, 'town': 'Тверь', 'street': 'Арбат'},
+            {'citizen_id': 2, 'town': 'Москва', 'street': 'Тверская'},
+        ],
+        [
+            {'citizen_id': 1, 'town': 'Ялта', 'building': '3'},
+            {'citizen_id': 2, 'town': 'Ялта', 'building': '3'},
+            {'citizen_id': 3, 'town': 'Ялта', 'building': '3'},
+        ],
+    ):
+        for patch in patches:
+            dataset[patch['citizen_id'] - 1].update(patch)
+        actual = await patch_citizens(api_client, import_id, patches)
+        assert compare_citizen_groups(
+            actual, [dataset[patch['citizen_id'] - 1] for patch in patches]
+        )
+
+        actual_citizens = await get_citizens(api_client, import_id)
+        assert compare_citizen_groups(actual_citizens, dataset)
+        assert find_unused_addresses(
+            migrated_postgres_connection, import_id
+        ) == []
+        assert find_town_birth_months_mismatches(
+            migrated_postgres_connection, import_id
+        ) == []
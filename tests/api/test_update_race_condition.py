@@ -10,7 +10,9 @@
 жителя останется набор родственников из последнего выполненного запроса.
 
 Но может сложиться так, что при выполнении запросов обработчики CitizenView
-одновременно получат информацию о жителе и его родственниках из БД.
+одновременно получат информацию о жителе и его родственниках из БД (в том
+числе, если оба запроса на изменение будут выполнены до того, как завершится
+хотя бы одна транзакция).
 Каждый обработчик увидит что на данный момент у жителя родственников нет
 (соответственно, чтобы привести БД к запрашиваемому состоянию нужно добавить
 связь с новым родственником).
@@ -37,11 +39,12 @@ from analyzer.utils.testing import (
 class PatchedCitizenView(CitizenView):
     URL_PATH = r'/with_lock/imports/{import_id:\d+}/citizens/{citizen_id:\d+}'
 
-    async def get_citizen(self, conn, import_id, citizen_id):
-        citizen = await super().get_citizen(conn, import_id, citizen_id)
+    async def patch_citizen(self, conn, import_id, citizen_id, data):
+        citizen = await super().patch_citizen(conn, import_id, citizen_id,
+                                              data)
 
-        # Блокируем выполнение других методов, пока все обработчики не
-        # прочитают жителя из БД.
+        # Не завершаем транзакцию, пока все обработчики не изменят жителя в
+        # БД.
         await asyncio.sleep(2)
         return citizen
 
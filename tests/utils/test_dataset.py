@@ -0,0 +1,50 @@
+from datetime import date
+
+import pytest
+
+from analyzer.api.schema import ImportSchema
+from analyzer.utils.dataset import CitizensGenerator
+
+
+TODAY = date(2020, 1, 1)
+
+
+def test_generate_is_deterministic():
+    left = CitizensGenerator(seed=1, today=TODAY).generate(100, 50)
+    right = CitizensGenerator(seed=1, today=TODAY).generate(100, 50)
+    assert left == right
+
+
+def test_generate_citizens():
+    citizens = CitizensGenerator(seed=1, unique_towns=3).generate(
+        citizens_num=1000, relations_num=300, start_citizen_id=5
+    )
+    assert [citizen['citizen_id'] for citizen in citizens] == list(
+        range(5, 1005)
+    )
+    assert len({citizen['town'] for citizen in citizens}) <= 3
+    assert ImportSchema().validate({'citizens': citizens}) == {}
+
+    # Родственные связи симметричны и не повторяются
+    relatives = {
+        citizen['citizen_id']: citizen['relatives'] for citizen in citizens
+    }
+    pairs = set()
+    for citizen_id, citizen_relatives in relatives.items():
+        assert citizen_id not in citizen_relatives
+        assert len(set(citizen_relatives)) == len(citizen_relatives)
+        for relative_id in citizen_relatives:
+            assert citizen_id in relatives[relative_id]
+            pairs.add(frozenset((citizen_id, relative_id)))
+    assert len(pairs) == 300
+
+
+def test_generate_relations_limit():
+    generator = CitizensGenerator(seed=1)
+
+    # Между двумя жителями может быть родственная связь
+    generator.generate(citizens_num=2, relations_num=1)
+
+    # Между двумя жителями не может быть двух родственных связей
+    with pytest.raises(ValueError):
+        generator.generate(citizens_num=2, relations_num=2)
@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+from analyzer.utils.supervisor import Supervisor
+
+
+def wait_pids(path, count: int, timeout: float = 10):
+    """
+    Ожидает, пока процессы запишут в директорию path не менее count файлов с
+    названиями в виде своих pid.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pids = {int(name) for name in os.listdir(path)}
+        if len(pids) >= count:
+            return pids
+        time.sleep(0.01)
+    raise TimeoutError
+
+
+@pytest.mark.parametrize('exit_code,expected', [
+    (None, 0),
+    (0, 0),
+    (3, 3),
+    ('Fatal error', 1),
+])
+def test_worker_exit_code(exit_code, expected):
+    """
+    SystemExit в дочернем процессе завершает его с тем же кодом, что и
+    интерпретатор.
+    """
+    def worker():
+        raise SystemExit(exit_code)
+
+    supervisor = Supervisor(worker, processes=1)
+    supervisor.spawn(0)
+    pid, = supervisor.children
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status)
+    assert os.WEXITSTATUS(status) == expected
+
+
+def test_supervisor_restarts_workers(tmp_path):
+    def worker():
+        (tmp_path / str(os.getpid())).touch()
+        time.sleep(60)
+
+    supervisor = multiprocessing.get_context('fork').Process(
+        target=Supervisor(worker, processes=2, restart_delay=0).run
+    )
+    supervisor.start()
+    try:
+        workers = wait_pids(tmp_path, 2)
+
+        # Упавший процесс перезапускается
+        killed = workers.pop()
+        os.kill(killed, signal.SIGKILL)
+        restarted = wait_pids(tmp_path, 3) - workers - {killed}
+        assert len(restarted) == 1
+
+        # При остановке завершаются все процессы
+        os.kill(supervisor.pid, signal.SIGTERM)
+        supervisor.join(timeout=10)
+        assert supervisor.exitcode == 0
+        for pid in workers | restarted:
+            assert not os.path.exists(f'/proc/{pid}')
+    finally:
+        if supervisor.is_alive():
+            supervisor.kill()